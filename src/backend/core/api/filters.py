@@ -2,6 +2,7 @@
 
 import unicodedata
 
+from django.contrib.postgres.search import TrigramSimilarity
 from django.utils.translation import gettext_lazy as _
 
 import django_filters
@@ -38,13 +39,46 @@ class AccentInsensitiveCharFilter(django_filters.CharFilter):
         return super().filter(qs, value)
 
 
+class RankedAccentInsensitiveCharFilter(AccentInsensitiveCharFilter):
+    """
+    An accent-insensitive CharFilter ranking the matches by the trigram similarity of
+    their unaccented value with the value searched. The field should be covered by a
+    trigram index on its immutable unaccented value for the filter to use it.
+    """
+
+    def filter(self, qs, value):
+        """
+        Filter the queryset, annotate the similarity of each match with the value
+        searched as `<field_name>_similarity` and rank them by decreasing similarity,
+        the order of the queryset breaking ties. Matches are not ranked if an ordering
+        is requested.
+        """
+        qs = super().filter(qs, value)
+        if not value:
+            return qs
+
+        similarity = f"{self.field_name:s}_similarity"
+        qs = qs.annotate(
+            **{
+                similarity: TrigramSimilarity(
+                    models.ImmutableUnaccent(self.field_name), remove_accents(value)
+                )
+            }
+        )
+        if self.parent is not None and self.parent.data.get("ordering"):
+            return qs
+        return qs.order_by(f"-{similarity:s}", *qs.query.order_by)
+
+
 class DocumentFilter(django_filters.FilterSet):
     """
     Custom filter for filtering documents on title (accent and case insensitive).
     """
 
-    title = AccentInsensitiveCharFilter(
-        field_name="title", lookup_expr="unaccent__icontains", label=_("Title")
+    title = RankedAccentInsensitiveCharFilter(
+        field_name="title",
+        lookup_expr="immutable_unaccent__icontains",
+        label=_("Title"),
     )
 
     class Meta:
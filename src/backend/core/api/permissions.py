@@ -10,8 +10,12 @@ from core import choices
 from core.models import DocumentAccess, RoleChoices, get_trashbin_cutoff
 
 ACTION_FOR_METHOD_TO_PERMISSION = {
+    "attachment_upload_slot": {"POST": "attachment_upload"},
+    "attachment_upload_confirm": {"POST": "attachment_upload"},
     "versions_detail": {"DELETE": "versions_destroy", "GET": "versions_retrieve"},
+    "versions_delta": {"GET": "versions_retrieve"},
     "children": {"GET": "children_list", "POST": "children_create"},
+    "content_update": {"POST": "update"},
 }
 
 
@@ -152,7 +156,7 @@ class ResourceAccessPermission(IsAuthenticated):
         if super().has_permission(request, view) is False:
             return False
 
-        if view.action == "create":
+        if view.action in ["create", "bulk"]:
             role = getattr(view, view.resource_field_name).get_role(request.user)
             if role not in choices.PRIVILEGED_ROLES:
                 raise exceptions.PermissionDenied(
@@ -1,10 +1,12 @@
 """Client serializers for the impress core app."""
+# pylint: disable=too-many-lines
 
 import binascii
 import mimetypes
 from base64 import b64decode
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
 from django.utils.functional import lazy
 from django.utils.translation import gettext_lazy as _
@@ -13,6 +15,7 @@ import magic
 from rest_framework import serializers
 
 from core import choices, enums, models, utils
+from core.api.utils import is_unsafe_attachment
 from core.services.ai_services import AI_ACTIONS
 from core.services.converter_services import (
     ConversionError,
@@ -155,6 +158,22 @@ class DocumentLightSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "path", "depth"]
 
 
+class SearchDocumentSerializer(ListDocumentSerializer):
+    """Serialize documents found by a search with the fragments matching the query."""
+
+    highlight = serializers.CharField(read_only=True, allow_null=True)
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = models.Document
+        fields = [*ListDocumentSerializer.Meta.fields, "highlight", "rank"]
+        read_only_fields = [
+            *ListDocumentSerializer.Meta.read_only_fields,
+            "highlight",
+            "rank",
+        ]
+
+
 class DocumentSerializer(ListDocumentSerializer):
     """Serialize documents with all fields for display in detail views."""
 
@@ -246,49 +265,77 @@ class DocumentSerializer(ListDocumentSerializer):
     def save(self, **kwargs):
         """
         Process the content field to extract attachment keys and update the document's
-        "attachments" field for access control.
+        "attachments" field for access control. Attachments are only extracted when
+        the digest of the content differs from the digest of the content they were
+        last extracted from for the document.
         """
         content = self.validated_data.get("content", "")
-        extracted_attachments = set(utils.extract_attachments(content))
-
         existing_attachments = (
             set(self.instance.attachments or []) if self.instance else set()
         )
-        new_attachments = extracted_attachments - existing_attachments
 
-        if new_attachments:
-            attachments_documents = (
-                models.Document.objects.filter(
-                    attachments__overlap=list(new_attachments)
+        new_attachments, extracted_digest = set(), None
+        digest = utils.get_content_digest(content) if content else None
+        if digest and (
+            self.instance is None
+            or cache.get(self.instance.get_attachments_digest_cache_key()) != digest
+        ):
+            try:
+                new_attachments = (
+                    set(utils.extract_attachments(content)) - existing_attachments
                 )
-                .only("path", "attachments")
-                .order_by("path")
-            )
+                extracted_digest = digest
+            except ValueError:
+                # The content could not be loaded in time: the media paths found in
+                # its encoding are only granted below if the user can read them anyway
+                new_attachments = (
+                    utils.extract_attachments_candidates(content) - existing_attachments
+                )
+
+        if new_attachments:
+            # Keep the new keys included in a document readable by the user: access
+            # can be given on any of these documents or any of their ancestors
+            sources = models.DocumentAttachment.objects.filter(
+                key__in=new_attachments
+            ).values_list("key", "document__path")
+            steplen = models.Document.steplen
+            ancestors_paths = {
+                path[:i]
+                for _key, path in sources
+                for i in range(steplen, len(path) + 1, steplen)
+            }
 
             user = self.context["request"].user
-            readable_per_se_paths = (
+            readable_paths = set(
                 models.Document.objects.readable_per_se(user)
-                .order_by("path")
+                .filter(path__in=ancestors_paths)
                 .values_list("path", flat=True)
             )
-            readable_attachments_paths = utils.filter_descendants(
-                [doc.path for doc in attachments_documents],
-                readable_per_se_paths,
-                skip_sorting=True,
-            )
-
-            readable_attachments = set()
-            for document in attachments_documents:
-                if document.path not in readable_attachments_paths:
-                    continue
-                readable_attachments.update(set(document.attachments) & new_attachments)
+            readable_attachments = {
+                key
+                for key, path in sources
+                if any(
+                    path[:i] in readable_paths
+                    for i in range(steplen, len(path) + 1, steplen)
+                )
+            }
 
             # Update attachments with readable keys
             self.validated_data["attachments"] = list(
                 existing_attachments | readable_attachments
             )
-
-        return super().save(**kwargs)
+            if new_attachments - readable_attachments:
+                # Extract them again on next save, the user may be able to read them
+                extracted_digest = None
+
+        instance = super().save(**kwargs)
+        if extracted_digest:
+            cache.set(
+                instance.get_attachments_digest_cache_key(),
+                extracted_digest,
+                settings.DOCUMENT_CONTENT_ARTIFACTS_CACHE_TIMEOUT,
+            )
+        return instance
 
 
 class DocumentAccessSerializer(serializers.ModelSerializer):
@@ -538,17 +585,7 @@ class FileUploadSerializer(serializers.Serializer):
         mime = magic.Magic(mime=True)
         magic_mime_type = mime.from_buffer(file.read(1024))
         file.seek(0)  # Reset file pointer to the beginning after reading
-        self.context["is_unsafe"] = False
-        if settings.DOCUMENT_ATTACHMENT_CHECK_UNSAFE_MIME_TYPES_ENABLED:
-            self.context["is_unsafe"] = (
-                magic_mime_type in settings.DOCUMENT_UNSAFE_MIME_TYPES
-            )
-
-            extension_mime_type, _ = mimetypes.guess_type(file.name)
-
-            # Try guessing a coherent extension from the mimetype
-            if extension_mime_type != magic_mime_type:
-                self.context["is_unsafe"] = True
+        self.context["is_unsafe"] = is_unsafe_attachment(file.name, magic_mime_type)
 
         guessed_ext = mimetypes.guess_extension(magic_mime_type)
         # Missing extensions or extensions longer than 5 characters (it's as long as an extension
@@ -574,6 +611,56 @@ class FileUploadSerializer(serializers.Serializer):
         return attrs
 
 
+class AttachmentUploadSlotSerializer(serializers.Serializer):
+    """Receive requests for a slot to upload a file directly to object storage."""
+
+    file_name = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(max_length=255)
+
+    def validate_size(self, size):
+        """Check the announced file size against the limit defined in settings."""
+        if size > settings.DOCUMENT_IMAGE_MAX_SIZE:
+            max_size = settings.DOCUMENT_IMAGE_MAX_SIZE // (1024 * 1024)
+            raise serializers.ValidationError(
+                f"File size exceeds the maximum limit of {max_size:d} MB."
+            )
+        return size
+
+    def validate(self, attrs):
+        """Compute the extension of the file from its name or its content type."""
+        file_name = attrs["file_name"]
+        extension = file_name.rpartition(".")[-1] if "." in file_name else None
+
+        guessed_ext = mimetypes.guess_extension(attrs["content_type"])
+        # Missing extensions or extensions longer than 5 characters are replaced by
+        # the extension we eventually guessed from the content type.
+        if (extension is None or len(extension) > 5) and guessed_ext:
+            extension = guessed_ext[1:]
+
+        if extension is None:
+            raise serializers.ValidationError(
+                {"file_name": "Could not determine file extension."}
+            )
+
+        attrs["expected_extension"] = extension
+        return attrs
+
+
+class AttachmentUploadPartSerializer(serializers.Serializer):
+    """Receive a part of a multipart upload as acknowledged by object storage."""
+
+    part_number = serializers.IntegerField(min_value=1, max_value=10000)
+    etag = serializers.CharField(max_length=255)
+
+
+class AttachmentUploadConfirmSerializer(serializers.Serializer):
+    """Receive the confirmation that a file was uploaded directly to object storage."""
+
+    key = serializers.CharField(max_length=255)
+    parts = AttachmentUploadPartSerializer(many=True, required=False)
+
+
 class TemplateSerializer(serializers.ModelSerializer):
     """Serialize templates."""
 
@@ -686,6 +773,102 @@ class InvitationSerializer(serializers.ModelSerializer):
         return role
 
 
+class DocumentAccessBulkItemSerializer(serializers.Serializer):
+    """Validate one access to create or update in bulk, for a user or a team."""
+
+    user_id = serializers.UUIDField(required=False, allow_null=True)
+    team = serializers.CharField(required=False, allow_blank=True, max_length=100)
+    role = serializers.ChoiceField(choices=models.RoleChoices.choices)
+
+    def validate(self, attrs):
+        """Check that either a user or a team is targeted, not both."""
+        if bool(attrs.get("user_id")) == bool(attrs.get("team")):
+            raise serializers.ValidationError(
+                _("Either user or team must be set, not both.")
+            )
+        return attrs
+
+
+class InvitationBulkItemSerializer(serializers.Serializer):
+    """Validate one invitation to create or update in bulk."""
+
+    email = serializers.EmailField()
+    role = serializers.ChoiceField(choices=models.RoleChoices.choices)
+
+
+class DocumentAccessBulkSerializer(serializers.Serializer):
+    """
+    Validate accesses and invitations to create or update in bulk on a document,
+    checking the targeted users and emails in one query each.
+    """
+
+    accesses = DocumentAccessBulkItemSerializer(many=True, required=False)
+    invitations = InvitationBulkItemSerializer(many=True, required=False)
+
+    def validate(self, attrs):
+        """Check the size of the request and resolve the users targeted by accesses."""
+        accesses = attrs.setdefault("accesses", [])
+        invitations = attrs.setdefault("invitations", [])
+
+        if not accesses and not invitations:
+            raise serializers.ValidationError(
+                _("At least one access or invitation must be provided.")
+            )
+        if len(accesses) + len(invitations) > settings.DOCUMENT_ACCESSES_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                _("No more than {max_size:d} accesses and invitations at once.").format(
+                    max_size=settings.DOCUMENT_ACCESSES_BULK_MAX_SIZE
+                )
+            )
+
+        keys = [(access.get("user_id"), access.get("team")) for access in accesses]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError(
+                {"accesses": [_("Each user or team must be targeted only once.")]}
+            )
+
+        emails = [invitation["email"] for invitation in invitations]
+        if len(set(emails)) != len(emails):
+            raise serializers.ValidationError(
+                {"invitations": [_("Each email must be invited only once.")]}
+            )
+
+        users = models.User.objects.in_bulk(
+            [access["user_id"] for access in accesses if access.get("user_id")]
+        )
+        unknown_ids = [
+            str(access["user_id"])
+            for access in accesses
+            if access.get("user_id") and access["user_id"] not in users
+        ]
+        if unknown_ids:
+            raise serializers.ValidationError(
+                {
+                    "accesses": [
+                        _("Unknown users: {ids:s}.").format(ids=", ".join(unknown_ids))
+                    ]
+                }
+            )
+        for access in accesses:
+            access["user"] = users.get(access.pop("user_id", None))
+            access["team"] = access.get("team") or ""
+
+        if (
+            emails
+            and not settings.OIDC_ALLOW_DUPLICATE_EMAILS
+            and models.User.objects.filter(email__in=emails).exists()
+        ):
+            raise serializers.ValidationError(
+                {
+                    "invitations": [
+                        _("This email is already associated to a registered user.")
+                    ]
+                }
+            )
+
+        return attrs
+
+
 class RoleSerializer(serializers.Serializer):
     """Serializer validating role choices."""
 
@@ -739,6 +922,42 @@ class VersionFilterSerializer(serializers.Serializer):
     )
 
 
+class VersionDeltaSerializer(serializers.Serializer):
+    """Validate the base state from which the delta of a version is computed."""
+
+    from_version_id = serializers.CharField(required=False)
+    state_vector = serializers.CharField(required=False)
+
+    def validate_state_vector(self, value):
+        """Decode the base64 state vector sent by the client."""
+        try:
+            return b64decode(value, validate=True)
+        except binascii.Error as err:
+            raise serializers.ValidationError("Invalid base64 content.") from err
+
+    def validate(self, attrs):
+        """Ensure exactly one base state is provided."""
+        if ("from_version_id" in attrs) == ("state_vector" in attrs):
+            raise serializers.ValidationError(
+                "Either a version id or a state vector must be provided."
+            )
+        return attrs
+
+
+class ContentUpdateSerializer(serializers.Serializer):
+    """Validate a yjs update to merge into the content of a document."""
+
+    update = serializers.CharField(required=True)
+    websocket = serializers.BooleanField(required=False, default=False)
+
+    def validate_update(self, value):
+        """Decode the base64 yjs update sent by the client."""
+        try:
+            return b64decode(value, validate=True)
+        except binascii.Error as err:
+            raise serializers.ValidationError("Invalid base64 content.") from err
+
+
 class AITransformSerializer(serializers.Serializer):
     """Serializer for AI transform requests."""
 
@@ -1,5 +1,6 @@
 """Util to generate S3 authorization headers for object storage access control"""
 
+import mimetypes
 import time
 from abc import ABC, abstractmethod
 
@@ -91,6 +92,22 @@ def generate_s3_authorization_headers(key):
     return request
 
 
+def is_unsafe_attachment(file_name, mime_type):
+    """
+    Tell if an attachment must be considered as unsafe given its file name and the
+    mime type detected from its first bytes: either this mime type is unsafe or it
+    does not match the extension of the file.
+    """
+    if not settings.DOCUMENT_ATTACHMENT_CHECK_UNSAFE_MIME_TYPES_ENABLED:
+        return False
+
+    if mime_type in settings.DOCUMENT_UNSAFE_MIME_TYPES:
+        return True
+
+    extension_mime_type, _ = mimetypes.guess_type(file_name)
+    return extension_mime_type != mime_type
+
+
 class AIBaseRateThrottle(BaseThrottle, ABC):
     """Base throttle class for AI-related rate limiting with backoff."""
 
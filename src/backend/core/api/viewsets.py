@@ -1,28 +1,37 @@
 """API endpoints"""
 # pylint: disable=too-many-lines
 
+import hashlib
 import json
 import logging
+import mimetypes
 import uuid
-from collections import defaultdict
+from base64 import b64encode
 from urllib.parse import unquote, urlencode, urlparse
 
 from django.conf import settings
 from django.contrib.postgres.aggregates import ArrayAgg
-from django.contrib.postgres.search import TrigramSimilarity
+from django.contrib.postgres.search import SearchRank, TrigramSimilarity
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
 from django.db import connection, transaction
 from django.db import models as db
-from django.db.models.expressions import RawSQL
+from django.db.models.expressions import (
+    RawSQL,
+    ValueRange,
+    Window,
+    WindowFrameExclusion,
+)
 from django.db.models.functions import Left, Length
 from django.http import Http404, StreamingHttpResponse
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import capfirst, slugify
 from django.utils.translation import gettext_lazy as _
 
+import magic
 import requests
 import rest_framework as drf
 from botocore.exceptions import ClientError
@@ -34,11 +43,19 @@ from rest_framework import response as drf_response
 from rest_framework.permissions import AllowAny
 from rest_framework.throttling import UserRateThrottle
 
-from core import authentication, choices, enums, models
+from core import authentication, choices, enums, models, search
 from core.services.ai_services import AIService
 from core.services.collaboration_services import CollaborationService
-from core.tasks.mail import send_ask_for_access_mail
-from core.utils import extract_attachments, filter_descendants
+from core.services.yjs_services import YjsProcessingError
+from core.tasks.attachments import compute_attachment_digest
+from core.tasks.mail import send_ask_for_access_mail, send_invitation_mails
+from core.utils import (
+    extract_attachments,
+    extract_attachments_candidates,
+    get_merged_yjs_update,
+    get_yjs_state_vector,
+    get_yjs_update_delta,
+)
 
 from . import permissions, serializers, utils
 from .filters import DocumentFilter, ListDocumentFilter
@@ -326,6 +343,16 @@ class DocumentViewSet(
         Returns: JSON response with the translated text.
         Throttled by: AIDocumentRateThrottle, AIUserRateThrottle.
 
+    12. **Search**: Search the title and content of the documents readable by the
+        current user, ranked by relevance, with the fragments matching the query.
+        Example: GET /documents/search/?q=annual report
+
+    13. **Content Update**: Merge a yjs update into the content of a document instead
+        of sending its whole content, and get the state vector of the new content.
+        Example: POST /documents/{id}/content-update/
+        Expected data:
+        - update (str): The base64 encoded yjs update.
+
     ### Ordering: created_at, updated_at, is_favorite, title
 
         Example:
@@ -337,7 +364,8 @@ class DocumentViewSet(
         - `is_creator_me=false`: Returns documents created by other users.
         - `is_favorite=true`: Returns documents marked as favorite by the current user
         - `is_favorite=false`: Returns documents not marked as favorite by the current user
-        - `title=hello`: Returns documents which title contains the "hello" string
+        - `title=hello`: Returns documents which title contains the "hello" string,
+            ignoring accents and case, ranked by similarity unless ordered otherwise
 
         Example:
         - GET /api/v1.0/documents/?is_creator_me=true&is_favorite=true
@@ -365,6 +393,7 @@ class DocumentViewSet(
     children_serializer_class = serializers.ListDocumentSerializer
     descendants_serializer_class = serializers.ListDocumentSerializer
     list_serializer_class = serializers.ListDocumentSerializer
+    search_serializer_class = serializers.SearchDocumentSerializer
     trashbin_serializer_class = serializers.ListDocumentSerializer
     tree_serializer_class = serializers.ListDocumentSerializer
 
@@ -412,12 +441,13 @@ class DocumentViewSet(
         """Return paginated response for the queryset if requested."""
         context = context or self.get_serializer_context()
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, context=context)
-            return self.get_paginated_response(serializer.data)
+        documents = list(queryset) if page is None else page
+        models.Document.compute_nb_accesses_ancestors(documents)
 
-        serializer = self.get_serializer(queryset, many=True, context=context)
-        return drf.response.Response(serializer.data)
+        serializer = self.get_serializer(documents, many=True, context=context)
+        if page is None:
+            return drf.response.Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def list(self, request, *args, **kwargs):
         """
@@ -458,10 +488,14 @@ class DocumentViewSet(
         for field in ["is_favorite", "is_masked"]:
             queryset = filterset.filters[field].filter(queryset, filter_data[field])
 
-        # Apply ordering only now that everything is filtered and annotated
-        queryset = filters.OrderingFilter().filter_queryset(
-            self.request, queryset, self
-        )
+        # Apply ordering only now that everything is filtered and annotated. Documents
+        # searched by title are ranked by similarity unless an ordering is requested.
+        if filter_data["title"] and not self.request.query_params.get("ordering"):
+            queryset = queryset.order_by("-title_similarity", *self.ordering)
+        else:
+            queryset = filters.OrderingFilter().filter_queryset(
+                self.request, queryset, self
+            )
 
         return self.get_response_for_queryset(queryset)
 
@@ -559,6 +593,9 @@ class DocumentViewSet(
 
     def perform_update(self, serializer):
         """Check rules about collaboration."""
+        if self.request.user.is_authenticated:
+            serializer.instance.content_author = self.request.user
+
         if (
             serializer.validated_data.get("websocket", False)
             or not settings.COLLABORATION_WS_NOT_CONNECTED_READY_ONLY
@@ -572,6 +609,52 @@ class DocumentViewSet(
             "You are not allowed to edit this document."
         )
 
+    @drf.decorators.action(
+        detail=True,
+        methods=["post"],
+        url_path="content-update",
+    )
+    def content_update(self, request, *args, **kwargs):
+        """
+        Merge a yjs update into the content of a document and save it, so that clients
+        not connected to the collaboration server only send their changes instead of
+        the whole content. Returns the state vector of the new content.
+        """
+        document = self.get_object()
+        update_serializer = serializers.ContentUpdateSerializer(data=request.data)
+        update_serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            # Lock the document so that concurrent updates are merged one at a time
+            document = models.Document.objects.select_for_update().get(pk=document.pk)
+            try:
+                content, state_vector, has_changed = get_merged_yjs_update(
+                    document.content, update_serializer.validated_data["update"]
+                )
+            except YjsProcessingError as err:
+                raise drf.exceptions.ValidationError(
+                    {"update": ["The content of the document could not be processed."]}
+                ) from err
+            except ValueError as err:
+                raise drf.exceptions.ValidationError(
+                    {"update": ["Invalid yjs update."]}
+                ) from err
+
+            if has_changed:
+                serializer = serializers.DocumentSerializer(
+                    document,
+                    data={
+                        "content": content,
+                        "websocket": update_serializer.validated_data["websocket"],
+                    },
+                    partial=True,
+                    context=self.get_serializer_context(),
+                )
+                serializer.is_valid(raise_exception=True)
+                self.perform_update(serializer)
+
+        return drf.response.Response({"state_vector": b64encode(state_vector).decode()})
+
     @drf.decorators.action(
         detail=True,
         methods=["get"],
@@ -606,6 +689,52 @@ class DocumentViewSet(
         queryset = queryset.filter(id__in=favorite_documents_ids)
         return self.get_response_for_queryset(queryset)
 
+    @drf.decorators.action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def search(self, request, *args, **kwargs):
+        """
+        Search the title and content of the documents readable by the current user
+        through the document tree: documents on which they have an access, documents
+        they visited whose computed link reach is not restricted, and the descendants
+        of both.
+
+        Results are ranked by relevance and come with the fragments of their content
+        best matching the query, matched words being enclosed in <mark> tags.
+        """
+        user = request.user
+        query_text = request.query_params.get("q", "").strip()
+        if len(query_text) < 2:
+            return self.get_response_for_queryset(self.queryset.none())
+
+        query = search.get_search_query(query_text)
+
+        queryset = (
+            self.queryset.filter(ancestors_deleted_at__isnull=True, search_vector=query)
+            .readable_in_tree(user)
+            .annotate(
+                rank=SearchRank(db.F("search_vector"), query),
+                # Highlights are computed after sorting, on the page returned only
+                highlight=search.get_search_headline(
+                    query_text, search.get_search_config(user.language)
+                ),
+            )
+            .annotate_is_favorite(user)
+            .annotate_user_roles(user)
+            .order_by("-rank", "-updated_at")
+        )
+
+        page = self.paginate_queryset(queryset)
+        documents = list(queryset) if page is None else page
+        models.Document.compute_nb_accesses_ancestors(documents)
+
+        serializer = self.get_serializer(documents, many=True)
+        if page is None:
+            return drf.response.Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
     @drf.decorators.action(
         detail=False,
         methods=["get"],
@@ -716,6 +845,7 @@ class DocumentViewSet(
             )
 
         document.move(target_document, pos=position)
+        models.invalidate_media_auth_cache()
 
         # Make sure we have at least one owner
         if (
@@ -884,11 +1014,13 @@ class DocumentViewSet(
         queryset = queryset.order_by("path")
         queryset = queryset.annotate_user_roles(user)
         queryset = queryset.annotate_is_favorite(user)
+        documents = list(queryset)
+        models.Document.compute_nb_accesses_ancestors(documents)
 
         # Pass ancestors' links paths mapping to the serializer as a context variable
         # in order to allow saving time while computing abilities on the instance
         serializer = self.get_serializer(
-            queryset,
+            documents,
             many=True,
             context={
                 "request": request,
@@ -935,7 +1067,12 @@ class DocumentViewSet(
             if with_accesses
             else {}
         )
-        extracted_attachments = set(extract_attachments(document.content))
+        try:
+            extracted_attachments = set(extract_attachments(base64_yjs_content))
+        except ValueError:
+            # The content could not be loaded in time: keep the attachments it may
+            # include, the document's readers having access to all of them anyway
+            extracted_attachments = extract_attachments_candidates(base64_yjs_content)
         attachments = list(extracted_attachments & set(document.attachments))
         duplicated_document = document.add_sibling(
             "right",
@@ -1018,24 +1155,16 @@ class DocumentViewSet(
 
         return drf.response.Response(versions_data)
 
-    @drf.decorators.action(
-        detail=True,
-        methods=["get", "delete"],
-        url_path="versions/(?P<version_id>[0-9a-z-]+)",
-    )
-    # pylint: disable=unused-argument
-    def versions_detail(self, request, pk, version_id, *args, **kwargs):
-        """Custom action to retrieve a specific version of a document"""
-        document = self.get_object()
-
-        try:
-            response = document.get_content_response(version_id=version_id)
-        except (FileNotFoundError, ClientError) as err:
-            raise Http404 from err
+    def _get_version_or_404(self, document, version_id):
+        """
+        Get a version of the document from the version index. Don't let users access
+        versions that were created before they were given access to the document.
+        """
+        version = document.versions.filter(version_id=version_id).first()
+        if version is None:
+            raise Http404
 
-        # Don't let users access versions that were created before they were given access
-        # to the document
-        user = request.user
+        user = self.request.user
         min_datetime = min(
             access.created_at
             for access in models.DocumentAccess.objects.filter(
@@ -1044,9 +1173,30 @@ class DocumentViewSet(
             )
         )
 
-        if response["LastModified"] < min_datetime:
+        if version.last_modified < min_datetime:
             raise Http404
 
+        return version
+
+    def _get_version_content(self, document, version_id):
+        """Get the base64 yjs content of a version of the document."""
+        try:
+            response = document.get_content_response(version_id=version_id)
+        except (FileNotFoundError, ClientError) as err:
+            raise Http404 from err
+        return response["Body"].read().decode("utf-8")
+
+    @drf.decorators.action(
+        detail=True,
+        methods=["get", "delete"],
+        url_path="versions/(?P<version_id>[0-9a-z-]+)",
+    )
+    # pylint: disable=unused-argument
+    def versions_detail(self, request, pk, version_id, *args, **kwargs):
+        """Custom action to retrieve a specific version of a document"""
+        document = self.get_object()
+        version = self._get_version_or_404(document, version_id)
+
         if request.method == "DELETE":
             response = document.delete_version(version_id)
             return drf.response.Response(
@@ -1055,12 +1205,120 @@ class DocumentViewSet(
 
         return drf.response.Response(
             {
-                "content": response["Body"].read().decode("utf-8"),
-                "last_modified": response["LastModified"],
+                "content": self._get_version_content(document, version_id),
+                "last_modified": version.last_modified,
                 "id": version_id,
             }
         )
 
+    @drf.decorators.action(
+        detail=True,
+        methods=["get"],
+        url_path="versions/(?P<version_id>[0-9a-z-]+)/delta",
+    )
+    # pylint: disable=unused-argument
+    def versions_delta(self, request, pk, version_id, *args, **kwargs):
+        """
+        Custom action to get the yjs update bringing a document from a base state up to
+        date with a version, instead of the full state of the version. The base state is
+        either another version (deltas between versions are cached), which can not be
+        newer than the version as a yjs update can not go backwards, or a state vector
+        sent by the client. Contents that cannot be processed, because they are invalid,
+        too large or too slow to process, are rejected with a 400.
+        """
+        serializer = serializers.VersionDeltaSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        document = self.get_object()
+        version = self._get_version_or_404(document, version_id)
+
+        from_version_id = serializer.validated_data.get("from_version_id")
+        if from_version_id:
+            from_version = self._get_version_or_404(document, from_version_id)
+            if from_version.last_modified > version.last_modified:
+                raise drf.exceptions.ValidationError(
+                    {
+                        "from_version_id": [
+                            "This version is newer than the version requested."
+                        ]
+                    }
+                )
+            cache_key = (
+                f"document_{document.id!s}_version_delta_"
+                f"{from_version.version_id:s}_{version.version_id:s}"
+            )
+            update = cache.get(cache_key)
+            if update is None:
+                try:
+                    state_vector = get_yjs_state_vector(
+                        self._get_version_content(document, from_version.version_id)
+                    )
+                    delta = get_yjs_update_delta(
+                        self._get_version_content(document, version.version_id),
+                        state_vector,
+                    )
+                except ValueError as err:
+                    raise drf.exceptions.ValidationError(
+                        {
+                            "from_version_id": [
+                                "The delta from this version could not be computed."
+                            ]
+                        }
+                    ) from err
+                update = b64encode(delta).decode("utf-8")
+                cache.set(
+                    cache_key,
+                    update,
+                    settings.DOCUMENT_VERSIONS_DELTA_CACHE_TIMEOUT,
+                )
+        else:
+            try:
+                delta = get_yjs_update_delta(
+                    self._get_version_content(document, version.version_id),
+                    serializer.validated_data["state_vector"],
+                )
+            except ValueError as err:
+                raise drf.exceptions.ValidationError(
+                    {"state_vector": ["Invalid state vector."]}
+                ) from err
+            update = b64encode(delta).decode("utf-8")
+
+        return drf.response.Response(
+            {
+                "id": version.version_id,
+                "from_version_id": from_version_id,
+                "update": update,
+            }
+        )
+
+    @drf.decorators.action(
+        detail=True,
+        methods=["post"],
+        url_path="versions/(?P<version_id>[0-9a-z-]+)/restore",
+    )
+    # pylint: disable=unused-argument
+    def versions_restore(self, request, pk, version_id, *args, **kwargs):
+        """
+        Custom action to restore a previous version of a document as its current version.
+        The version is copied in object storage and the collaboration server is notified
+        so that connected users reload the content.
+        """
+        document = self.get_object()
+        version = self._get_version_or_404(document, version_id)
+
+        new_version = document.restore_version(version, author_id=request.user.pk)
+
+        # Notify collaboration server about the content restored
+        CollaborationService().reset_connections(str(document.id))
+
+        return drf.response.Response(
+            {
+                "id": new_version.version_id,
+                "last_modified": new_version.last_modified,
+            },
+            status=drf.status.HTTP_201_CREATED,
+        )
+
     @drf.decorators.action(detail=True, methods=["put"], url_path="link-configuration")
     def link_configuration(self, request, *args, **kwargs):
         """Update link configuration with specific rights (cf get_abilities)."""
@@ -1074,6 +1332,7 @@ class DocumentViewSet(
         serializer.is_valid(raise_exception=True)
 
         serializer.save()
+        models.invalidate_media_auth_cache(paths=[document.path])
 
         # Notify collaboration server about the link updated
         CollaborationService().reset_connections(str(document.id))
@@ -1152,6 +1411,54 @@ class DocumentViewSet(
         link_trace.save(update_fields=["is_masked"])
         return drf.response.Response(status=drf.status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def _get_attachment_storage_params(file_name, content_type, owner, is_unsafe):
+        """Compute the headers and metadata with which an attachment is stored."""
+        params = {
+            "Metadata": {
+                "owner": str(owner),
+                "status": enums.DocumentAttachmentStatus.PROCESSING,
+            },
+            "ContentType": content_type,
+        }
+        if is_unsafe:
+            params["Metadata"]["is_unsafe"] = "true"
+
+        if not content_type.startswith("image/") or is_unsafe:
+            params["ContentDisposition"] = f'attachment; filename="{file_name:s}"'
+        else:
+            params["ContentDisposition"] = f'inline; filename="{file_name:s}"'
+
+        return params
+
+    def _register_attachment(self, document, key, **kwargs):
+        """
+        Register an attachment uploaded to object storage, make it readable by
+        document readers and trigger its analysis. Returns the url to check its status.
+        """
+        # Register the attachment so that its status can be read without
+        # requesting the object storage
+        models.Attachment.objects.create(key=key, document=document, **kwargs)
+
+        # Make the attachment readable by document readers
+        document.attachments.append(key)
+        document.save()
+
+        malware_detection.analyse_file(key, document_id=document.id)
+
+        return self._get_media_check_url(document, key)
+
+    @staticmethod
+    def _get_media_check_url(document, key):
+        """Url to check the status of an attachment of a document."""
+        url = reverse(
+            "documents-media-check",
+            kwargs={"pk": document.id},
+        )
+        parameters = urlencode({"key": key})
+
+        return f"{url:s}?{parameters:s}"
+
     @drf.decorators.action(detail=True, methods=["post"], url_path="attachment-upload")
     def attachment_upload(self, request, *args, **kwargs):
         """Upload a file related to a given document"""
@@ -1162,61 +1469,327 @@ class DocumentViewSet(
         serializer = serializers.FileUploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        file = serializer.validated_data["file"]
+        file_hash = hashlib.sha256()
+        for chunk in file.chunks():
+            file_hash.update(chunk)
+        file.seek(0)
+        digest = file_hash.hexdigest()
+        is_unsafe = serializer.validated_data["is_unsafe"]
+
+        # Identical files are stored once: reuse the key of a file with the same
+        # content, which was or is being scanned already. The name is part of the
+        # headers with which files are served so it must match as well.
+        existing_key = None
+        if not is_unsafe:
+            existing_key = (
+                models.Attachment.objects.filter(
+                    digest=digest,
+                    content_type=serializer.validated_data["content_type"],
+                    file_name=serializer.validated_data["file_name"],
+                )
+                .values_list("key", flat=True)
+                .first()
+            )
+        if existing_key:
+            if existing_key not in document.attachments:
+                document.attachments.append(existing_key)
+                document.save()
+            return drf.response.Response(
+                {"file": self._get_media_check_url(document, existing_key)},
+                status=drf.status.HTTP_201_CREATED,
+            )
+
         # Generate a generic yet unique filename to store the image in object storage
         file_id = uuid.uuid4()
         ext = serializer.validated_data["expected_extension"]
+        file_unsafe = "-unsafe" if is_unsafe else ""
 
-        # Prepare metadata for storage
-        extra_args = {
-            "Metadata": {
-                "owner": str(request.user.id),
-                "status": enums.DocumentAttachmentStatus.PROCESSING,
+        key = f"{document.key_base}/{enums.ATTACHMENTS_FOLDER:s}/{file_id!s}{file_unsafe}.{ext:s}"
+
+        # Prepare headers and metadata for storage
+        extra_args = self._get_attachment_storage_params(
+            serializer.validated_data["file_name"],
+            serializer.validated_data["content_type"],
+            request.user.id,
+            is_unsafe,
+        )
+
+        default_storage.connection.meta.client.upload_fileobj(
+            file, default_storage.bucket_name, key, ExtraArgs=extra_args
+        )
+
+        file_url = self._register_attachment(
+            document,
+            key,
+            size=file.size,
+            content_type=serializer.validated_data["content_type"],
+            file_name=serializer.validated_data["file_name"],
+            digest=digest,
+        )
+
+        return drf.response.Response(
+            {
+                "file": file_url,
             },
-            "ContentType": serializer.validated_data["content_type"],
-        }
-        file_unsafe = ""
-        if serializer.validated_data["is_unsafe"]:
-            extra_args["Metadata"]["is_unsafe"] = "true"
-            file_unsafe = "-unsafe"
+            status=drf.status.HTTP_201_CREATED,
+        )
 
-        key = f"{document.key_base}/{enums.ATTACHMENTS_FOLDER:s}/{file_id!s}{file_unsafe}.{ext:s}"
+    @drf.decorators.action(
+        detail=True, methods=["post"], url_path="attachment-upload-slot"
+    )
+    def attachment_upload_slot(self, request, *args, **kwargs):
+        """
+        Reserve a key to upload a file related to a given document directly to object
+        storage, without going through the backend. Returns the fields of a presigned
+        POST request or, for files larger than DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE,
+        the presigned urls of each part of a multipart upload.
+
+        The upload must then be confirmed with the "attachment-upload-confirm" action.
+        """
+        # Check permissions first
+        document = self.get_object()
 
+        serializer = serializers.AttachmentUploadSlotSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         file_name = serializer.validated_data["file_name"]
-        if (
-            not serializer.validated_data["content_type"].startswith("image/")
-            or serializer.validated_data["is_unsafe"]
-        ):
-            extra_args.update(
-                {"ContentDisposition": f'attachment; filename="{file_name:s}"'}
+        content_type = serializer.validated_data["content_type"]
+        size = serializer.validated_data["size"]
+        ext = serializer.validated_data["expected_extension"]
+
+        key = (
+            f"{document.key_base}/{enums.ATTACHMENTS_FOLDER:s}/{uuid.uuid4()!s}.{ext:s}"
+        )
+
+        # The file is stored with the headers matching its announced content type:
+        # they are checked against its actual content when the upload is confirmed
+        params = self._get_attachment_storage_params(
+            file_name, content_type, request.user.id, is_unsafe=False
+        )
+        expiration = settings.DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION
+        s3_client = default_storage.connection.meta.client
+        bucket_name = default_storage.bucket_name
+
+        upload_id = None
+        if size <= settings.DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE:
+            fields = {
+                "Content-Type": params["ContentType"],
+                "Content-Disposition": params["ContentDisposition"],
+                **{
+                    f"x-amz-meta-{name:s}": value
+                    for name, value in params["Metadata"].items()
+                },
+            }
+            presigned_post = s3_client.generate_presigned_post(
+                bucket_name,
+                key,
+                Fields=fields,
+                Conditions=[
+                    *({name: value} for name, value in fields.items()),
+                    ["content-length-range", 1, settings.DOCUMENT_IMAGE_MAX_SIZE],
+                ],
+                ExpiresIn=expiration,
             )
+            body = {"key": key, "upload": presigned_post}
         else:
-            extra_args.update(
-                {"ContentDisposition": f'inline; filename="{file_name:s}"'}
-            )
+            upload_id, parts = self._create_multipart_upload(key, size, params)
+            body = {
+                "key": key,
+                "part_size": settings.DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE,
+                "parts": parts,
+            }
 
-        file = serializer.validated_data["file"]
-        default_storage.connection.meta.client.upload_fileobj(
-            file, default_storage.bucket_name, key, ExtraArgs=extra_args
+        cache.set(
+            self._get_upload_slot_cache_key(key),
+            {
+                "document_id": str(document.id),
+                "owner": str(request.user.id),
+                "file_name": file_name,
+                "content_type": content_type,
+                "upload_id": upload_id,
+            },
+            expiration,
         )
 
-        # Make the attachment readable by document readers
-        document.attachments.append(key)
-        document.save()
+        return drf.response.Response(body, status=drf.status.HTTP_201_CREATED)
 
-        malware_detection.analyse_file(key, document_id=document.id)
+    @drf.decorators.action(
+        detail=True, methods=["post"], url_path="attachment-upload-confirm"
+    )
+    def attachment_upload_confirm(self, request, *args, **kwargs):
+        """
+        Confirm that a file was uploaded directly to object storage in a slot reserved
+        with the "attachment-upload-slot" action. Its first bytes are read to check its
+        actual type before it is registered and analysed.
+        """
+        # Check permissions first
+        document = self.get_object()
 
-        url = reverse(
-            "documents-media-check",
-            kwargs={"pk": document.id},
+        serializer = serializers.AttachmentUploadConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key = serializer.validated_data["key"]
+
+        slot_cache_key = self._get_upload_slot_cache_key(key)
+        slot = cache.get(slot_cache_key)
+        if slot is None or slot["document_id"] != str(document.id):
+            raise drf.exceptions.ValidationError(
+                {"key": ["Unknown or expired upload slot."]}
+            )
+        if slot["owner"] != str(request.user.id):
+            raise drf.exceptions.PermissionDenied(
+                "Only the user who reserved this upload slot can confirm it."
+            )
+
+        s3_client = default_storage.connection.meta.client
+        bucket_name = default_storage.bucket_name
+
+        if slot["upload_id"]:
+            parts = serializer.validated_data.get("parts")
+            if not parts:
+                raise drf.exceptions.ValidationError(
+                    {"parts": ["This field is required for multipart uploads."]}
+                )
+            try:
+                s3_client.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=key,
+                    UploadId=slot["upload_id"],
+                    MultipartUpload={
+                        "Parts": [
+                            {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                            for part in parts
+                        ]
+                    },
+                )
+            except ClientError as err:
+                logger.error("Could not complete multipart upload of %s: %s", key, err)
+                raise drf.exceptions.ValidationError(
+                    {"parts": ["Could not complete the multipart upload."]}
+                ) from err
+
+        # Read the first few bytes to determine the MIME type accurately
+        try:
+            response = s3_client.get_object(
+                Bucket=bucket_name, Key=key, Range="bytes=0-1023"
+            )
+        except ClientError as err:
+            raise drf.exceptions.ValidationError(
+                {"key": ["The file was not uploaded."]}
+            ) from err
+        mime_type = magic.Magic(mime=True).from_buffer(response["Body"].read())
+        size = int(response["ContentRange"].rpartition("/")[-1])
+
+        if size > settings.DOCUMENT_IMAGE_MAX_SIZE:
+            s3_client.delete_object(Bucket=bucket_name, Key=key)
+            cache.delete(slot_cache_key)
+            max_size = settings.DOCUMENT_IMAGE_MAX_SIZE // (1024 * 1024)
+            raise drf.exceptions.ValidationError(
+                {"key": [f"File size exceeds the maximum limit of {max_size:d} MB."]}
+            )
+
+        cache.delete(slot_cache_key)
+
+        key = self._fix_uploaded_attachment(key, slot, mime_type)
+        file_url = self._register_attachment(
+            document,
+            key,
+            size=size,
+            content_type=mime_type,
+            file_name=slot["file_name"],
         )
-        parameters = urlencode({"key": key})
+        # The file did not go through the backend: hash it in the background
+        compute_attachment_digest.delay(key)
 
         return drf.response.Response(
+            {"file": file_url}, status=drf.status.HTTP_201_CREATED
+        )
+
+    @staticmethod
+    def _create_multipart_upload(key, size, params):
+        """
+        Initiate a multipart upload for a file of the given size and presign the
+        upload of each of its parts. Returns the upload id and the list of parts.
+        """
+        s3_client = default_storage.connection.meta.client
+        bucket_name = default_storage.bucket_name
+        part_size = settings.DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE
+
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=key, **params
+        )["UploadId"]
+        parts = [
             {
-                "file": f"{url:s}?{parameters:s}",
-            },
-            status=drf.status.HTTP_201_CREATED,
+                "part_number": part_number,
+                "url": s3_client.generate_presigned_url(
+                    "upload_part",
+                    Params={
+                        "Bucket": bucket_name,
+                        "Key": key,
+                        "UploadId": upload_id,
+                        "PartNumber": part_number,
+                    },
+                    ExpiresIn=settings.DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION,
+                ),
+            }
+            for part_number in range(1, -(-size // part_size) + 1)
+        ]
+        return upload_id, parts
+
+    def _fix_uploaded_attachment(self, key, slot, mime_type):
+        """
+        Fix the headers of a file uploaded directly to object storage if it does not
+        match the content type announced when reserving its slot, moving it to a key
+        with the extension of its actual content type. Unsafe files are moved to a key
+        marking them as such. Returns the final key of the file.
+        """
+        is_unsafe = utils.is_unsafe_attachment(slot["file_name"], mime_type)
+        if not is_unsafe and mime_type == slot["content_type"]:
+            return key
+
+        s3_client = default_storage.connection.meta.client
+        bucket_name = default_storage.bucket_name
+        source_key = key
+        base, _dot, ext = source_key.rpartition(".")
+        # The extension of the key was chosen for the announced content type
+        if mime_type != slot["content_type"]:
+            guessed_ext = mimetypes.guess_extension(mime_type)
+            ext = guessed_ext[1:] if guessed_ext else ext
+        file_unsafe = "-unsafe" if is_unsafe else ""
+        key = f"{base:s}{file_unsafe:s}.{ext:s}"
+
+        s3_client.copy_object(
+            Bucket=bucket_name,
+            Key=key,
+            CopySource={"Bucket": bucket_name, "Key": source_key},
+            MetadataDirective="REPLACE",
+            **self._get_attachment_storage_params(
+                slot["file_name"], mime_type, slot["owner"], is_unsafe
+            ),
         )
+        if key != source_key:
+            s3_client.delete_object(Bucket=bucket_name, Key=source_key)
+
+        return key
+
+    @staticmethod
+    def _get_upload_slot_cache_key(key):
+        """Cache key of the upload slot reserved for an attachment key."""
+        return f"attachment_upload_slot_{key:s}"
+
+    def _get_attachment_status_from_storage(self, key, default):
+        """
+        Read the status of an attachment from its metadata in object storage.
+        Returns None if the file can not be found.
+        """
+        s3_client = default_storage.connection.meta.client
+        try:
+            head_resp = s3_client.head_object(
+                Bucket=default_storage.bucket_name, Key=key
+            )
+        except ClientError as err:
+            logger.error("Client Error fetching file %s metadata: %s", key, err)
+            return None
+        return head_resp.get("Metadata", {}).get("status", default)
 
     def _auth_get_original_url(self, request):
         """
@@ -1272,55 +1845,108 @@ class DocumentViewSet(
 
         user = request.user
         key = f"{url_params['pk']:s}/{url_params['attachment']:s}"
+        # Resized variants of an image are authorized as the image itself
+        object_key = f"{key:s}{url_params['variant'] or '':s}"
+
+        # Images are often loaded several times in a row (e.g. within a page view):
+        # serve recent decisions from the cache. Anonymous users all share the same
+        # permissions so they share the same decisions. A decision is only valid until
+        # a change in the trees of the documents including the attachment or in the
+        # documents including it, tracked by generations read before computing it.
+        cache_key = generations = None
+        if settings.MEDIA_AUTH_CACHE_TIMEOUT:
+            cache_key = (
+                f"media_auth_{user.pk if user.is_authenticated else 'anonymous'!s}_"
+                f"{object_key:s}"
+            )
+            decision = cache.get(cache_key)
+            if (
+                decision is not None
+                and models.get_media_auth_generations(decision["generations"])
+                == decision["generations"]
+            ):
+                if not decision["allowed"]:
+                    raise drf.exceptions.PermissionDenied()
+                return drf.response.Response(
+                    "authorized", headers=decision["headers"], status=200
+                )
+            generations = models.get_media_auth_generations(
+                {
+                    models.MEDIA_AUTH_GENERATION_CACHE_KEY,
+                    *models.get_media_auth_generation_keys(keys=[key]),
+                }
+            )
 
         # Look for a document to which the user has access and that includes this attachment
-        # We must look into all descendants of any document to which the user has access per se
-        readable_per_se_paths = (
-            self.queryset.readable_per_se(user)
-            .order_by("path")
-            .values_list("path", flat=True)
-        )
-
-        attachments_documents = (
-            self.queryset.filter(attachments__contains=[key])
-            .only("path")
-            .order_by("path")
-        )
-        readable_attachments_paths = filter_descendants(
-            [doc.path for doc in attachments_documents],
-            readable_per_se_paths,
-            skip_sorting=True,
+        # Access can be given per se on any of these documents or any of their ancestors.
+        # The status of the attachment is read from the registry in the same query.
+        documents = (
+            models.Document.objects.filter(attachment_links__key=key)
+            .annotate(
+                attachment_status=db.Subquery(
+                    models.Attachment.objects.filter(key=key).values("status")[:1]
+                )
+            )
+            .values_list("path", "attachment_status")
         )
+        steplen = models.Document.steplen
+        ancestors_paths = {
+            path[:i]
+            for path, _attachment_status in documents
+            for i in range(steplen, len(path) + 1, steplen)
+        }
+        if cache_key:
+            generations |= models.get_media_auth_generations(
+                models.get_media_auth_generation_keys(paths=ancestors_paths)
+            )
 
-        if not readable_attachments_paths:
+        if (
+            not ancestors_paths
+            or not self.queryset.readable_per_se(user)
+            .filter(path__in=ancestors_paths)
+            .exists()
+        ):
             logger.debug("User '%s' lacks permission for attachment", user)
+            if cache_key:
+                cache.set(
+                    cache_key,
+                    {"allowed": False, "generations": generations},
+                    settings.MEDIA_AUTH_CACHE_TIMEOUT,
+                )
             raise drf.exceptions.PermissionDenied()
 
-        # Check if the attachment is ready
-        s3_client = default_storage.connection.meta.client
-        bucket_name = default_storage.bucket_name
-        try:
-            head_resp = s3_client.head_object(Bucket=bucket_name, Key=key)
-        except ClientError as err:
-            raise drf.exceptions.PermissionDenied() from err
-        metadata = head_resp.get("Metadata", {})
-        # In order to be compatible with existing upload without `status` metadata,
-        # we consider them as ready.
-        if (
-            metadata.get("status", enums.DocumentAttachmentStatus.READY)
-            != enums.DocumentAttachmentStatus.READY
-        ):
+        # Check if the attachment is ready. Attachments uploaded before the registry
+        # existed only have their status in the object storage metadata.
+        attachment_status = documents[0][1]
+        if attachment_status is None:
+            # In order to be compatible with existing upload without `status` metadata,
+            # we consider them as ready.
+            attachment_status = self._get_attachment_status_from_storage(
+                key, default=enums.DocumentAttachmentStatus.READY
+            )
+        if attachment_status != enums.DocumentAttachmentStatus.READY:
             raise drf.exceptions.PermissionDenied()
 
         # Generate S3 authorization headers using the extracted URL parameters
-        request = utils.generate_s3_authorization_headers(key)
+        request = utils.generate_s3_authorization_headers(object_key)
+        headers = dict(request.headers)
 
-        return drf.response.Response("authorized", headers=request.headers, status=200)
+        # The decision is only cached once the attachment is ready: its status is
+        # expected to change while it is processed
+        if cache_key:
+            cache.set(
+                cache_key,
+                {"allowed": True, "headers": headers, "generations": generations},
+                settings.MEDIA_AUTH_CACHE_TIMEOUT,
+            )
+
+        return drf.response.Response("authorized", headers=headers, status=200)
 
     @drf.decorators.action(detail=True, methods=["get"], url_path="media-check")
     def media_check(self, request, *args, **kwargs):
         """
-        Check if the media is ready to be served.
+        Check if the media is ready to be served. Once it is, the resized variants
+        generated for images are listed with their width and format.
         """
         document = self.get_object()
 
@@ -1337,27 +1963,38 @@ class DocumentViewSet(
                 status=drf.status.HTTP_404_NOT_FOUND,
             )
 
-        # Check if the attachment is ready
-        s3_client = default_storage.connection.meta.client
-        bucket_name = default_storage.bucket_name
-        try:
-            head_resp = s3_client.head_object(Bucket=bucket_name, Key=key)
-        except ClientError as err:
-            logger.error("Client Error fetching file %s metadata: %s", key, err)
-            return drf.response.Response(
-                {"detail": "Media not found"},
-                status=drf.status.HTTP_404_NOT_FOUND,
+        # Check if the attachment is ready, falling back to the object storage metadata
+        # for attachments uploaded before the registry existed
+        attachment_status, variants = (
+            models.Attachment.objects.filter(key=key)
+            .values_list("status", "variants")
+            .first()
+        ) or (None, [])
+        if attachment_status is None:
+            attachment_status = self._get_attachment_status_from_storage(
+                key, default=enums.DocumentAttachmentStatus.PROCESSING
             )
-        metadata = head_resp.get("Metadata", {})
+            if attachment_status is None:
+                return drf.response.Response(
+                    {"detail": "Media not found"},
+                    status=drf.status.HTTP_404_NOT_FOUND,
+                )
 
-        body = {
-            "status": metadata.get("status", enums.DocumentAttachmentStatus.PROCESSING),
-        }
-        if metadata.get("status") == enums.DocumentAttachmentStatus.READY:
+        body = {"status": attachment_status}
+        if attachment_status == enums.DocumentAttachmentStatus.READY:
             body = {
                 "status": enums.DocumentAttachmentStatus.READY,
                 "file": f"{settings.MEDIA_URL:s}{key:s}",
             }
+            if variants:
+                body["variants"] = [
+                    {
+                        "width": variant["width"],
+                        "format": variant["format"],
+                        "file": f"{settings.MEDIA_URL:s}{variant['key']:s}",
+                    }
+                    for variant in variants
+                ]
 
         return drf.response.Response(body, status=drf.status.HTTP_200_OK)
 
@@ -1491,13 +2128,19 @@ class DocumentAccessViewSet(
 
     GET /api/v1.0/documents/<resource_id>/accesses/:<document_access_id>
         Return list of all document accesses related to the logged-in user or one
-        document access if an id is provided.
+        document access if an id is provided. The list is paginated if the `page`
+        or `page_size` query parameter is passed.
 
     POST /api/v1.0/documents/<resource_id>/accesses/ with expected data:
         - user: str
         - role: str [administrator|editor|reader]
         Return newly created document access
 
+    POST /api/v1.0/documents/<resource_id>/accesses/bulk/ with expected data:
+        - accesses: list of {user_id: str, role: str} or {team: str, role: str}
+        - invitations: list of {email: str, role: str}
+        Return created or updated document accesses and invitations
+
     PUT /api/v1.0/documents/<resource_id>/accesses/<document_access_id>/ with expected data:
         - role: str [owner|admin|editor|reader]
         Return updated document access
@@ -1527,6 +2170,7 @@ class DocumentAccessViewSet(
         "document__depth",
     )
     resource_field_name = "document"
+    pagination_class = Pagination
 
     @cached_property
     def document(self):
@@ -1547,77 +2191,77 @@ class DocumentAccessViewSet(
         )
 
     def list(self, request, *args, **kwargs):
-        """Return accesses for the current document with filters and annotations."""
+        """
+        Return accesses for the current document and its ancestors, annotated in one
+        query with the roles computed on ancestors. The list is paginated only if a
+        page or a page size is requested.
+        """
         user = request.user
 
         role = self.document.get_role(user)
         if not role:
             return drf.response.Response([])
 
-        ancestors = (
-            self.document.get_ancestors()
-            | models.Document.objects.filter(pk=self.document.pk)
-        ).filter(ancestors_deleted_at__isnull=True)
-
-        queryset = self.get_queryset().filter(document__in=ancestors)
+        queryset = self.get_queryset().filter(
+            document__path__in=self.document.get_ancestors_paths(),
+            document__ancestors_deleted_at__isnull=True,
+        )
 
         if role not in choices.PRIVILEGED_ROLES:
             queryset = queryset.filter(role__in=choices.PRIVILEGED_ROLES)
 
-        accesses = list(queryset.order_by("document__path"))
-
-        # Annotate more information on roles
-        path_to_key_to_max_ancestors_role = defaultdict(
-            lambda: defaultdict(lambda: None)
-        )
-        path_to_ancestors_roles = defaultdict(list)
-        path_to_role = defaultdict(lambda: None)
-        for access in accesses:
-            key = access.target_key
-            path = access.document.path
-            parent_path = path[: -models.Document.steplen]
-
-            path_to_key_to_max_ancestors_role[path][key] = choices.RoleChoices.max(
-                path_to_key_to_max_ancestors_role[path][key], access.role
-            )
-
-            if parent_path:
-                path_to_key_to_max_ancestors_role[path][key] = choices.RoleChoices.max(
-                    path_to_key_to_max_ancestors_role[parent_path][key],
-                    path_to_key_to_max_ancestors_role[path][key],
+        # Compare roles by priority in window functions running over the accesses
+        # on ancestors, all of which are on one branch of the tree sorted by depth
+        priority = db.Case(
+            *[
+                db.When(
+                    role=choice, then=db.Value(choices.RoleChoices.get_priority(choice))
                 )
-                path_to_ancestors_roles[path].extend(
-                    path_to_ancestors_roles[parent_path]
-                )
-                path_to_ancestors_roles[path].append(path_to_role[parent_path])
-            else:
-                path_to_ancestors_roles[path] = []
-
-            if access.user_id == user.id or access.team in user.teams:
-                path_to_role[path] = choices.RoleChoices.max(
-                    path_to_role[path], access.role
-                )
-
-        # serialize and return the response
-        context = self.get_serializer_context()
-        serializer_class = self.get_serializer_class()
-        serialized_data = []
+                for choice in choices.RoleChoices
+            ],
+            output_field=db.IntegerField(),
+        )
+        user_priority = db.Case(
+            db.When(db.Q(user=user) | db.Q(team__in=user.teams), then=priority),
+            output_field=db.IntegerField(),
+        )
+        depth = db.F("document__depth").asc()
+        ancestors_frame = ValueRange(
+            start=None, end=0, exclusion=WindowFrameExclusion.GROUP
+        )
+        queryset = queryset.annotate(
+            max_ancestors_priority=Window(
+                db.Max(priority),
+                partition_by=[db.F("user"), db.F("team")],
+                order_by=depth,
+                frame=ancestors_frame,
+            ),
+            ancestors_user_priority=Window(
+                db.Max(user_priority), order_by=depth, frame=ancestors_frame
+            ),
+            current_user_priority=Window(
+                db.Max(user_priority), partition_by=[db.F("document")]
+            ),
+        ).order_by("document__path", "created_at")
+
+        is_paginated = bool({"page", "page_size"} & set(request.query_params))
+        accesses = self.paginate_queryset(queryset) if is_paginated else list(queryset)
+
+        roles = {
+            choices.RoleChoices.get_priority(choice): choice
+            for choice in choices.RoleChoices
+        }
         for access in accesses:
-            path = access.document.path
-            parent_path = path[: -models.Document.steplen]
-            access.max_ancestors_role = (
-                path_to_key_to_max_ancestors_role[parent_path][access.target_key]
-                if parent_path
-                else None
-            )
+            access.max_ancestors_role = roles.get(access.max_ancestors_priority)
             access.set_user_roles_tuple(
-                choices.RoleChoices.max(*path_to_ancestors_roles[path]),
-                path_to_role.get(path),
+                roles.get(access.ancestors_user_priority),
+                roles.get(access.current_user_priority),
             )
-            serializer = serializer_class(access, context=context)
-            serialized_data.append(serializer.data)
 
-        return drf.response.Response(serialized_data)
+        serializer = self.get_serializer(accesses, many=True)
+        if is_paginated:
+            return self.get_paginated_response(serializer.data)
+        return drf.response.Response(serializer.data)
 
     def perform_create(self, serializer):
         """
@@ -1671,6 +2315,204 @@ class DocumentAccessViewSet(
             str(instance.document.id), str(instance.user.id)
         )
 
+    @staticmethod
+    def _bulk_create_new(model, instances):
+        """
+        Create instances in bulk, skipping those conflicting with a row that another
+        request created meanwhile. Return the instances created and those skipped.
+        """
+        if not instances:
+            return [], []
+        model.objects.bulk_create(instances, ignore_conflicts=True)
+        created_ids = set(
+            model.objects.filter(
+                pk__in=[instance.pk for instance in instances]
+            ).values_list("pk", flat=True)
+        )
+        return (
+            [instance for instance in instances if instance.pk in created_ids],
+            [instance for instance in instances if instance.pk not in created_ids],
+        )
+
+    def _bulk_save_accesses(self, accesses_data, role):
+        """
+        Create the accesses targeting new users or teams and update the role of the
+        others, with the rules of the creation and update of an access. Accesses
+        granted meanwhile by a concurrent request are skipped.
+        """
+        user = self.request.user
+        now = timezone.now()
+        existing_accesses = {
+            access.target_key: access
+            for access in models.DocumentAccess.objects.select_for_update(of=("self",))
+            .select_related("user")
+            .filter(
+                db.Q(user__in=[item["user"] for item in accesses_data if item["user"]])
+                | db.Q(
+                    team__in=[item["team"] for item in accesses_data if item["team"]]
+                ),
+                document=self.document,
+            )
+        }
+
+        created_accesses, updated_accesses = [], []
+        for item in accesses_data:
+            target_key = (
+                f"user:{item['user'].id!s}"
+                if item["user"]
+                else f"team:{item['team']:s}"
+            )
+            access = existing_accesses.get(target_key)
+            if access is None:
+                created_accesses.append(
+                    models.DocumentAccess(document=self.document, **item)
+                )
+            elif access.role != item["role"]:
+                access.document = self.document
+                access.set_user_roles_tuple(None, role)
+                if item["role"] not in access.get_abilities(user)["set_role_to"]:
+                    raise drf.exceptions.PermissionDenied(
+                        "You are not allowed to set this role to this access."
+                    )
+                access.role = item["role"]
+                access.updated_at = now
+                updated_accesses.append(access)
+
+        created_accesses, skipped_accesses = self._bulk_create_new(
+            models.DocumentAccess, created_accesses
+        )
+        models.DocumentAccess.objects.bulk_update(
+            updated_accesses, ["role", "updated_at"]
+        )
+        return created_accesses, updated_accesses, skipped_accesses
+
+    def _bulk_save_invitations(self, invitations_data):
+        """
+        Create the invitations for new emails and update the role of the others.
+        Invitations sent meanwhile by a concurrent request are skipped.
+        """
+        now = timezone.now()
+        existing_invitations = {
+            invitation.email: invitation
+            for invitation in models.Invitation.objects.select_for_update().filter(
+                document=self.document,
+                email__in=[item["email"] for item in invitations_data],
+            )
+        }
+
+        created_invitations, updated_invitations = [], []
+        for item in invitations_data:
+            invitation = existing_invitations.get(item["email"])
+            if invitation is None:
+                created_invitations.append(
+                    models.Invitation(
+                        document=self.document, issuer=self.request.user, **item
+                    )
+                )
+            elif invitation.role != item["role"]:
+                invitation.role = item["role"]
+                invitation.updated_at = now
+                updated_invitations.append(invitation)
+
+        created_invitations, skipped_invitations = self._bulk_create_new(
+            models.Invitation, created_invitations
+        )
+        models.Invitation.objects.bulk_update(
+            updated_invitations, ["role", "updated_at"]
+        )
+        return created_invitations, updated_invitations, skipped_invitations
+
+    @drf.decorators.action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create or update many accesses and invitations on the document at once:
+        - All of them are written in one transaction with bulk queries,
+        - Cached media authorization decisions are cleared once,
+        - Connections to the collaboration server are reset once if roles changed,
+        - Invitation emails are sent by a background task after the transaction,
+        - Users, teams and emails given an access or invited meanwhile by a concurrent
+          request are skipped and reported as such, their access being left as is.
+        """
+        user = request.user
+        serializer = serializers.DocumentAccessBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        role = self.document.get_role(user)
+        if role != choices.RoleChoices.OWNER and any(
+            item["role"] == choices.RoleChoices.OWNER
+            for item in data["accesses"] + data["invitations"]
+        ):
+            raise drf.exceptions.PermissionDenied(
+                "Only owners of a document can assign other users as owners."
+            )
+
+        with transaction.atomic():
+            created_accesses, updated_accesses, skipped_accesses = (
+                self._bulk_save_accesses(data["accesses"], role)
+            )
+            created_invitations, updated_invitations, skipped_invitations = (
+                self._bulk_save_invitations(data["invitations"])
+            )
+
+            # Send invitation emails only once the accesses are committed
+            language = user.language or settings.LANGUAGE_CODE
+            emails = [
+                (access.user.email, access.role, access.user.language or language)
+                for access in created_accesses
+                if access.user
+            ] + [
+                (invitation.email, invitation.role, language)
+                for invitation in created_invitations
+            ]
+            if emails:
+                transaction.on_commit(
+                    lambda: send_invitation_mails.delay(
+                        str(self.document.id), str(user.id), emails
+                    )
+                )
+
+        if created_accesses or updated_accesses:
+            models.invalidate_media_auth_cache(paths=[self.document.path])
+
+        # Notify collaboration server about the access changes
+        if updated_accesses:
+            CollaborationService().reset_connections(str(self.document.id))
+
+        # Serialize with the roles of the logged-in user, known from the document
+        accesses = created_accesses + updated_accesses
+        for access in accesses:
+            access.set_user_roles_tuple(None, role)
+        invitations = created_invitations + updated_invitations
+        for invitation in invitations:
+            invitation.user_roles = self.document.user_roles
+
+        context = self.get_serializer_context()
+        return drf.response.Response(
+            {
+                "accesses": self.get_serializer_class()(
+                    accesses, many=True, context=context
+                ).data,
+                "invitations": serializers.InvitationSerializer(
+                    invitations, many=True, context=context
+                ).data,
+                "skipped": {
+                    "accesses": [
+                        {
+                            "user_id": str(access.user.id) if access.user else None,
+                            "team": access.team,
+                        }
+                        for access in skipped_accesses
+                    ],
+                    "invitations": [
+                        {"email": invitation.email}
+                        for invitation in skipped_invitations
+                    ],
+                },
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
 
 class TemplateViewSet(
     drf.mixins.CreateModelMixin,
@@ -3,7 +3,6 @@ Core application enums declaration
 """
 
 import re
-from enum import StrEnum
 
 from django.conf import global_settings, settings
 from django.db import models
@@ -14,9 +13,12 @@ UUID_REGEX = (
     r"[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}"
 )
 FILE_EXT_REGEX = r"\.[a-zA-Z0-9]{1,10}"
+# Resized variants of an image are stored next to it, suffixed by their width and format
+IMAGE_VARIANT_SUFFIX_REGEX = r"-[0-9]{1,5}w\.(?:webp|avif)"
 MEDIA_STORAGE_URL_PATTERN = re.compile(
     f"{settings.MEDIA_URL:s}(?P<pk>{UUID_REGEX:s})/"
-    f"(?P<attachment>{ATTACHMENTS_FOLDER:s}/{UUID_REGEX:s}(?:-unsafe)?{FILE_EXT_REGEX:s})$"
+    f"(?P<attachment>{ATTACHMENTS_FOLDER:s}/{UUID_REGEX:s}(?:-unsafe)?{FILE_EXT_REGEX:s})"
+    f"(?P<variant>{IMAGE_VARIANT_SUFFIX_REGEX:s})?$"
 )
 MEDIA_STORAGE_URL_EXTRACT = re.compile(
     f"{settings.MEDIA_URL:s}({UUID_REGEX}/{ATTACHMENTS_FOLDER}/{UUID_REGEX}{FILE_EXT_REGEX})"
@@ -41,8 +43,8 @@ class MoveNodePositionChoices(models.TextChoices):
     RIGHT = "right", _("Right")
 
 
-class DocumentAttachmentStatus(StrEnum):
+class DocumentAttachmentStatus(models.TextChoices):
     """Defines the possible statuses for an attachment."""
 
-    PROCESSING = "processing"
-    READY = "ready"
+    PROCESSING = "processing", _("Processing")
+    READY = "ready", _("Ready")
@@ -202,6 +202,21 @@ class DocumentAskForAccessFactory(factory.django.DjangoModelFactory):
     role = factory.fuzzy.FuzzyChoice([r[0] for r in models.RoleChoices.choices])
 
 
+class AttachmentFactory(factory.django.DjangoModelFactory):
+    """Register fake attachments for testing."""
+
+    class Meta:
+        model = models.Attachment
+
+    document = factory.SubFactory(DocumentFactory)
+    key = factory.LazyAttribute(
+        lambda o: f"{o.document.id!s}/attachments/{fake.uuid4():s}.png"
+    )
+    size = factory.fuzzy.FuzzyInteger(1, 2**20)
+    content_type = "image/png"
+    digest = factory.Faker("sha256")
+
+
 class TemplateFactory(factory.django.DjangoModelFactory):
     """A factory to create templates"""
 
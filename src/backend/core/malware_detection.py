@@ -3,11 +3,13 @@
 import logging
 
 from django.core.files.storage import default_storage
+from django.db.models import Q
 
 from lasuite.malware_detection.enums import ReportStatus
 
 from core.enums import DocumentAttachmentStatus
-from core.models import Document
+from core.models import Attachment, Document
+from core.tasks.attachments import generate_image_variants
 
 logger = logging.getLogger(__name__)
 security_logger = logging.getLogger("docs.security")
@@ -18,7 +20,14 @@ def malware_detection_callback(file_path, status, error_info, **kwargs):
 
     if status == ReportStatus.SAFE:
         logger.info("File %s is safe", file_path)
-        # Get existing metadata
+        if Attachment.objects.filter(key=file_path).update(
+            status=DocumentAttachmentStatus.READY
+        ):
+            generate_image_variants.delay(file_path)
+            return
+
+        # The file was uploaded before the attachment registry existed:
+        # its status is only kept in its metadata.
         s3_client = default_storage.connection.meta.client
         bucket_name = default_storage.bucket_name
         head_resp = s3_client.head_object(Bucket=bucket_name, Key=file_path)
@@ -43,10 +52,15 @@ def malware_detection_callback(file_path, status, error_info, **kwargs):
         error_info,
     )
 
-    # Remove the file from the document and change the status to unsafe
-    document = Document.objects.get(pk=document_id)
-    document.attachments.remove(file_path)
-    document.save(update_fields=["attachments"])
+    # Remove the file from the documents including it: identical files uploaded
+    # to several documents share the same key
+    for document in Document.objects.filter(
+        Q(pk=document_id) | Q(attachment_links__key=file_path)
+    ).distinct():
+        if file_path in document.attachments:
+            document.attachments.remove(file_path)
+            document.save(update_fields=["attachments"])
 
-    # Delete the file from the storage
+    # Delete the file from the storage and from the attachment registry
     default_storage.delete(file_path)
+    Attachment.objects.filter(key=file_path).delete()
@@ -0,0 +1,93 @@
+"""Management command benchmarking the extraction of text from document contents."""
+
+import base64
+import timeit
+from functools import partial
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+import pycrdt
+from bs4 import BeautifulSoup
+
+from core import utils
+
+
+def build_content(nb_blocks):
+    """Build a base64 yjs document shaped like BlockNote's with formatted paragraphs."""
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = fragment = pycrdt.XmlFragment()
+    block_group = fragment.children.append(pycrdt.XmlElement("blockGroup"))
+    for index in range(nb_blocks):
+        text = pycrdt.XmlText()
+        block_group.children.append(
+            pycrdt.XmlElement(
+                "blockContainer",
+                {"id": f"block-{index:d}"},
+                [pycrdt.XmlElement("paragraph", {"textAlignment": "left"}, [text])],
+            )
+        )
+        prefix = f"Paragraph {index:d} with some "
+        text.insert(0, f"{prefix:s}bold words.")
+        text.format(len(prefix), len(prefix) + 4, {"bold": {}})
+    return base64.b64encode(ydoc.get_update()).decode("utf-8")
+
+
+def serialize_and_parse(base64_string):
+    """Former implementation: serialize the document to xml and parse it again."""
+    soup = BeautifulSoup(utils.compute_content_xml(base64_string), "lxml-xml")
+    return soup.get_text(separator=" ", strip=True)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the extraction of text from document contents: the former
+    implementation is compared with `base64_yjs_to_text` as callers run it, through
+    the yjs executor, the text being dropped from the artifact store before each run.
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--blocks",
+            type=int,
+            nargs="+",
+            default=[10, 1000, 20000],
+            help="Number of blocks of each document benchmarked.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of extractions timed for each document (the best is kept).",
+        )
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        self.stdout.write(
+            f"{'blocks':>8} {'size (kB)':>10} {'parse (ms)':>11} "
+            f"{'walk (ms)':>10} {'speedup':>8}"
+        )
+        for nb_blocks in options["blocks"]:
+            content = build_content(nb_blocks)
+            drop_text = partial(
+                cache.delete, utils.get_content_artifacts_cache_keys(content)["text"]
+            )
+            durations = [
+                min(
+                    timeit.repeat(
+                        partial(extract, content),
+                        setup=drop_text,
+                        number=1,
+                        repeat=options["repeat"],
+                    )
+                )
+                for extract in (serialize_and_parse, utils.base64_yjs_to_text)
+            ]
+            self.stdout.write(
+                f"{nb_blocks:>8d} {len(content) / 1024:>10.1f} "
+                f"{durations[0] * 1000:>11.2f} {durations[1] * 1000:>10.2f} "
+                f"{durations[0] / durations[1]:>7.1f}x"
+            )
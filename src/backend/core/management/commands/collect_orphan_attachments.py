@@ -0,0 +1,37 @@
+"""Management command deleting the attachments not included in any document."""
+
+from django.core.management.base import BaseCommand
+
+from core.tasks.attachments import collect_orphan_attachments
+
+
+class Command(BaseCommand):
+    """Delete the attachments not included in any document."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the attachments that would be deleted without deleting them.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Reconcile all documents, not only those modified since the last run.",
+        )
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        report = collect_orphan_attachments(
+            dry_run=options["dry_run"], full=options["full"]
+        )
+
+        action = "Would delete" if report["dry_run"] else "Deleted"
+        self.stdout.write(
+            f"[INFO] {action} {report['attachments']} attachments "
+            f"({report['objects']} objects) and {report['keys']} keys from the "
+            f"attachments of {report['documents']} documents."
+        )
@@ -0,0 +1,40 @@
+"""Management command compacting the yjs state of documents."""
+
+from django.core.management.base import BaseCommand
+
+from core.tasks.documents import compact_document_contents
+
+
+class Command(BaseCommand):
+    """Compact the yjs state of documents to reduce their size."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the bytes that would be saved without saving anything.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Compact all documents, not only those modified since the last run.",
+        )
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        report = compact_document_contents(
+            dry_run=options["dry_run"], full=options["full"]
+        )
+
+        action = "Would compact" if report["dry_run"] else "Compacted"
+        self.stdout.write(
+            f"[INFO] {action} {report['compacted']} of {report['documents']} "
+            f"documents, saving {report['saved']} bytes."
+        )
+        if not report["complete"]:
+            self.stdout.write(
+                "[INFO] Stopped before the end: the next run resumes where it stopped."
+            )
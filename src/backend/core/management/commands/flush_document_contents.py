@@ -0,0 +1,24 @@
+"""Management command flushing the document contents left pending in the cache."""
+
+from django.core.management.base import BaseCommand
+
+from core.tasks.documents import flush_stale_document_contents
+
+
+class Command(BaseCommand):
+    """Write to object storage the content of documents which flush was lost."""
+
+    help = __doc__
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        report = flush_stale_document_contents()
+
+        self.stdout.write(
+            f"[INFO] Flushed the pending content of {report['flushed']} documents."
+        )
+        if report["lost"]:
+            self.stderr.write(
+                f"[ERROR] The pending content of {report['lost']} documents was lost "
+                "from the cache."
+            )
@@ -0,0 +1,50 @@
+"""Management command indexing the title and content of documents for full-text search."""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.models import Document
+from core.tasks.documents import compute_document_content_artifacts
+
+
+class Command(BaseCommand):
+    """Index the title and content of documents for full-text search."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Index again the documents that are already indexed.",
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="run_async",
+            help="Queue a celery task for each document instead of indexing inline.",
+        )
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        documents = Document.objects.filter(ancestors_deleted_at__isnull=True)
+        if not options["all"]:
+            # Documents indexed before their text was stored are indexed again
+            documents = documents.filter(
+                Q(search_vector__isnull=True) | Q(search_text__isnull=True)
+            )
+
+        self.stdout.write(
+            f"[INFO] Found {documents.count()} documents. Starting indexing..."
+        )
+
+        total_indexed = 0
+        for document_id in documents.values_list("id", flat=True).iterator():
+            if options["run_async"]:
+                compute_document_content_artifacts.delay(str(document_id))
+            else:
+                compute_document_content_artifacts(str(document_id))
+            total_indexed += 1
+
+        self.stdout.write(f"[INFO] -> Indexed {total_indexed} documents.")
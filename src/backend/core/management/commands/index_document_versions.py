@@ -0,0 +1,45 @@
+"""Management command indexing in database the versions of documents kept in the bucket."""
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.models import Document, DocumentVersion
+
+
+class Command(BaseCommand):
+    """Index in database the versions of documents kept in the bucket."""
+
+    help = __doc__
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        s3_client = default_storage.connection.meta.client
+        paginator = s3_client.get_paginator("list_object_versions")
+
+        documents = Document.objects.only("id", "attachments")
+        self.stdout.write(
+            f"[INFO] Found {documents.count()} documents. Starting indexing..."
+        )
+
+        total_indexed = 0
+        for document in documents.iterator():
+            versions = [
+                DocumentVersion(
+                    document=document,
+                    version_id=version["VersionId"],
+                    etag=version["ETag"],
+                    size=version["Size"],
+                    last_modified=version["LastModified"],
+                    attachments=document.attachments or [],
+                )
+                for page in paginator.paginate(
+                    Bucket=default_storage.bucket_name, Prefix=document.file_key
+                )
+                for version in page.get("Versions", [])
+            ]
+            DocumentVersion.objects.bulk_create(
+                versions, batch_size=1000, ignore_conflicts=True
+            )
+            total_indexed += len(versions)
+
+        self.stdout.write(f"[INFO] -> Indexed {total_indexed} document versions.")
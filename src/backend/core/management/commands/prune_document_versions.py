@@ -0,0 +1,29 @@
+"""Management command applying the retention policy to document versions."""
+
+from django.core.management.base import BaseCommand
+
+from core.tasks.versions import prune_document_versions
+
+
+class Command(BaseCommand):
+    """Apply the retention policy to document versions."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the versions that would be deleted without deleting them.",
+        )
+
+    def handle(self, *args, **options):
+        """Execute management command."""
+        report = prune_document_versions(dry_run=options["dry_run"])
+
+        action = "Would delete" if report["dry_run"] else "Deleted"
+        count = report["versions"] if report["dry_run"] else report["deleted"]
+        self.stdout.write(
+            f"[INFO] {action} {count} versions of {report['documents']} documents."
+        )
@@ -1,95 +1,183 @@
 """Management command updating the metadata for all the files in the MinIO bucket."""
 
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.management.base import BaseCommand
 
 import magic
 
-from core.models import Document
-
-# pylint: disable=too-many-locals, broad-exception-caught
+from core.models import Attachment
+from core.tasks.attachments import VARIANT_SUFFIX
 
+# pylint: disable=broad-exception-caught
 
-class Command(BaseCommand):
-    """Update the metadata for all the files in the MinIO bucket."""
-
-    help = __doc__
+# Last key of the listing up to which all objects were processed without error, per
+# prefix
+CHECKPOINT_CACHE_KEY = "update_files_content_type_metadata_checkpoint"
 
-    def handle(self, *args, **options):
-        """Execute management command."""
-        s3_client = default_storage.connection.meta.client
-        bucket_name = default_storage.bucket_name
+ATTACHMENT_KEY = re.compile(r"^[0-9a-f-]{36}/attachments/[^/]+$")
 
-        mime_detector = magic.Magic(mime=True)
 
-        documents = Document.objects.all()
-        self.stdout.write(
-            f"[INFO] Found {documents.count()} documents. Starting ContentType fix..."
+def fix_content_type(s3_client, mime_detector, key, dry_run=False):
+    """
+    Detect the type of a file from its first bytes and fix its ContentType if it is
+    wrong. Returns a (key, fixed content type, error) tuple.
+    """
+    bucket_name = default_storage.bucket_name
+    try:
+        # Read first ~1KB for MIME detection, along with the current headers
+        partial_obj = s3_client.get_object(
+            Bucket=bucket_name, Key=key, Range="bytes=0-1023"
         )
-
-        for doc in documents:
-            doc_id_str = str(doc.id)
-            prefix = f"{doc_id_str}/attachments/"
-            self.stdout.write(
-                f"[INFO] Processing attachments under prefix '{prefix}' ..."
+        magic_mime_type = mime_detector.from_buffer(partial_obj["Body"].read())
+        if partial_obj.get("ContentType") == magic_mime_type:
+            return key, None, None
+
+        if not dry_run:
+            extra_args = {}
+            if partial_obj.get("ContentDisposition"):
+                extra_args["ContentDisposition"] = partial_obj["ContentDisposition"]
+            s3_client.copy_object(
+                Bucket=bucket_name,
+                CopySource={"Bucket": bucket_name, "Key": key},
+                Key=key,
+                ContentType=magic_mime_type,
+                Metadata=partial_obj.get("Metadata", {}),
+                MetadataDirective="REPLACE",
+                **extra_args,
             )
+    except Exception as exc:  # noqa
+        return key, None, exc
+    return key, magic_mime_type, None
 
-            continuation_token = None
-            total_updated = 0
 
-            while True:
-                list_kwargs = {"Bucket": bucket_name, "Prefix": prefix}
-                if continuation_token:
-                    list_kwargs["ContinuationToken"] = continuation_token
+class Command(BaseCommand):
+    """Update the metadata for all the files in the MinIO bucket."""
 
-                response = s3_client.list_objects_v2(**list_kwargs)
+    help = __doc__
 
-                # If no objects found under this prefix, break out of the loop
-                if "Contents" not in response:
-                    break
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the files that would be updated without updating them.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of files processed concurrently.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Maximum number of files processed per second (0 for no limit).",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="",
+            help="Only process the files which key starts with this prefix.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the progress recorded by a previous interrupted run.",
+        )
 
-                for obj in response["Contents"]:
+    def handle(self, *args, **options):
+        """Execute management command."""
+        s3_client = default_storage.connection.meta.client
+        mime_detector = magic.Magic(mime=True)
+        dry_run = options["dry_run"]
+
+        list_kwargs = {
+            "Bucket": default_storage.bucket_name,
+            "Prefix": options["prefix"],
+        }
+        checkpoint_cache_key = f"{CHECKPOINT_CACHE_KEY:s}_{options['prefix']:s}"
+        checkpoint = None if options["restart"] else cache.get(checkpoint_cache_key)
+        if checkpoint:
+            list_kwargs["StartAfter"] = checkpoint
+            self.stdout.write(f"[INFO] Resuming after '{checkpoint}' ...")
+
+        start = time.monotonic()
+        totals = {"processed": 0, "updated": 0, "errors": 0}
+        failed_keys = []
+        paginator = s3_client.get_paginator("list_objects_v2")
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for page in paginator.paginate(**list_kwargs):
+                contents = page.get("Contents", [])
+                futures = []
+                for obj in contents:
+                    # Variants of images are generated with the right ContentType
                     key = obj["Key"]
-
-                    # Skip if it's a folder
-                    if key.endswith("/"):
+                    if not ATTACHMENT_KEY.match(key) or VARIANT_SUFFIX.search(key):
                         continue
-
-                    try:
-                        # Get existing metadata
-                        head_resp = s3_client.head_object(Bucket=bucket_name, Key=key)
-
-                        # Read first ~1KB for MIME detection
-                        partial_obj = s3_client.get_object(
-                            Bucket=bucket_name, Key=key, Range="bytes=0-1023"
+                    if options["rate"]:
+                        # Throttle submissions to respect the rate limit
+                        delay = totals["processed"] / options["rate"] - (
+                            time.monotonic() - start
                         )
-                        partial_data = partial_obj["Body"].read()
-
-                        # Detect MIME type
-                        magic_mime_type = mime_detector.from_buffer(partial_data)
-
-                        # Update ContentType
-                        s3_client.copy_object(
-                            Bucket=bucket_name,
-                            CopySource={"Bucket": bucket_name, "Key": key},
-                            Key=key,
-                            ContentType=magic_mime_type,
-                            Metadata=head_resp.get("Metadata", {}),
-                            MetadataDirective="REPLACE",
-                        )
-                        total_updated += 1
-
-                    except Exception as exc:  # noqa
-                        self.stderr.write(
-                            f"[ERROR] Could not update ContentType for {key}: {exc}"
+                        if delay > 0:
+                            time.sleep(delay)
+                    futures.append(
+                        executor.submit(
+                            fix_content_type, s3_client, mime_detector, key, dry_run
                         )
+                    )
+                    totals["processed"] += 1
 
-                if response.get("IsTruncated"):
-                    continuation_token = response.get("NextContinuationToken")
-                else:
-                    break
+                failed_keys.extend(
+                    self.record_results(
+                        [future.result() for future in futures], totals, dry_run
+                    )
+                )
+                # Don't resume after files that could not be updated
+                if not dry_run and contents and not failed_keys:
+                    cache.set(checkpoint_cache_key, contents[-1]["Key"], None)
 
-            if total_updated > 0:
+                elapsed = time.monotonic() - start
                 self.stdout.write(
-                    f"[INFO] -> Updated {total_updated} objects for Document {doc_id_str}."
+                    f"[INFO] Processed {totals['processed']} files in {elapsed:.1f}s "
+                    f"({totals['processed'] / max(elapsed, 0.001):.1f} files/s), "
+                    f"{'would update' if dry_run else 'updated'} {totals['updated']}, "
+                    f"{totals['errors']} errors."
+                )
+
+        if failed_keys:
+            self.stderr.write(
+                f"[ERROR] {len(failed_keys)} files could not be updated, run the "
+                "command again to retry them:\n" + "\n".join(failed_keys)
+            )
+        elif not dry_run:
+            cache.delete(checkpoint_cache_key)
+
+    def record_results(self, results, totals, dry_run=False):
+        """
+        Report errors, count the files updated and reflect their new content type in
+        the attachment registry. Returns the keys of the files that could not be
+        processed.
+        """
+        updated = {}
+        failed_keys = []
+        for key, mime_type, exc in results:
+            if exc is not None:
+                totals["errors"] += 1
+                failed_keys.append(key)
+                self.stderr.write(
+                    f"[ERROR] Could not update ContentType for {key}: {exc}"
                 )
+            elif mime_type is not None:
+                updated.setdefault(mime_type, []).append(key)
+                totals["updated"] += 1
+
+        if not dry_run:
+            for mime_type, keys in updated.items():
+                Attachment.objects.filter(key__in=keys).update(content_type=mime_type)
+        return failed_keys
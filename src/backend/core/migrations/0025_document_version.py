@@ -0,0 +1,98 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:11
+
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0024_add_is_masked_field_to_link_trace"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentVersion",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="primary key for the record as UUID",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="id",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="date and time at which a record was created",
+                        verbose_name="created on",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True,
+                        help_text="date and time at which a record was last updated",
+                        verbose_name="updated on",
+                    ),
+                ),
+                (
+                    "version_id",
+                    models.CharField(max_length=1024, verbose_name="version id"),
+                ),
+                (
+                    "etag",
+                    models.CharField(blank=True, max_length=255, verbose_name="etag"),
+                ),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(default=0, verbose_name="size"),
+                ),
+                ("last_modified", models.DateTimeField(verbose_name="last modified")),
+                (
+                    "author",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="document_versions",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="versions",
+                        to="core.document",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Document version",
+                "verbose_name_plural": "Document versions",
+                "db_table": "impress_document_version",
+                "ordering": ("-last_modified", "-id"),
+                "indexes": [
+                    models.Index(
+                        fields=["document", "-last_modified", "-id"],
+                        name="document_version_history_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("document", "version_id"),
+                        name="unique_document_version",
+                        violation_error_message="This version is already indexed for this document.",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:39
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0025_document_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentAttachment",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="primary key for the record as UUID",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="id",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="date and time at which a record was created",
+                        verbose_name="created on",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True,
+                        help_text="date and time at which a record was last updated",
+                        verbose_name="updated on",
+                    ),
+                ),
+                ("key", models.CharField(max_length=255, verbose_name="key")),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attachment_links",
+                        to="core.document",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Document attachment",
+                "verbose_name_plural": "Document attachments",
+                "db_table": "impress_document_attachment",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("key", "document"),
+                        name="unique_document_attachment_key",
+                        violation_error_message="This attachment is already included in this document.",
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            INSERT INTO impress_document_attachment
+                (id, created_at, updated_at, document_id, key)
+            SELECT gen_random_uuid(), NOW(), NOW(), id, UNNEST(attachments)
+            FROM impress_document
+            WHERE attachments IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0027_attachment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="variants",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Resized variants of the image as a list of width, format and key",
+                verbose_name="variants",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-19 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0028_attachment_variants"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="attachment",
+            index=models.Index(
+                condition=models.Q(("digest", ""), _negated=True),
+                fields=["digest"],
+                name="attachment_digest_idx",
+            ),
+        ),
+    ]
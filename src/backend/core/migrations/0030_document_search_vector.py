@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:32
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Accent insensitive copies of the text search configurations of the languages
+# supported by the application, and of the "simple" configuration
+SEARCH_CONFIGS = {
+    "simple": "simple",
+    "english": "english_stem",
+    "french": "french_stem",
+    "german": "german_stem",
+    "dutch": "dutch_stem",
+    "spanish": "spanish_stem",
+}
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0029_attachment_digest_idx"),
+    ]
+
+    operations = [
+        *[
+            migrations.RunSQL(
+                sql=(
+                    f"CREATE TEXT SEARCH CONFIGURATION impress_{config} "
+                    f"(COPY = {config});"
+                    f"ALTER TEXT SEARCH CONFIGURATION impress_{config} "
+                    "ALTER MAPPING FOR hword, hword_part, word "
+                    f"WITH unaccent, {dictionary};"
+                ),
+                reverse_sql=f"DROP TEXT SEARCH CONFIGURATION impress_{config};",
+            )
+            for config, dictionary in SEARCH_CONFIGS.items()
+        ],
+        migrations.AddField(
+            model_name="document",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="document_search_vector_idx"
+            ),
+        ),
+    ]
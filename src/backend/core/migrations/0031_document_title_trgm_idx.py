@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:01
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+import core.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0030_document_search_vector"),
+    ]
+
+    operations = [
+        # "unaccent" is only stable as it depends on the dictionary configured: wrap it
+        # with an explicit dictionary in an immutable function that can be indexed
+        migrations.RunSQL(
+            sql=(
+                "CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text AS "
+                "$$SELECT public.unaccent('public.unaccent'::regdictionary, $1)$$ "
+                "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;"
+            ),
+            reverse_sql="DROP FUNCTION IF EXISTS immutable_unaccent(text);",
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        core.models.ImmutableUnaccent("title")
+                    ),
+                    name="gin_trgm_ops",
+                ),
+                name="document_title_trgm_idx",
+            ),
+        ),
+    ]
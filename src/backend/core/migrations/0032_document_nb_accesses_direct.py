@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:55
+
+from django.db import migrations
+
+import core.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0031_document_title_trgm_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="nb_accesses_direct",
+            field=core.models.DatabaseCounterField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE impress_document
+                SET nb_accesses_direct = counts.nb_accesses
+                FROM (
+                    SELECT document_id, count(*) AS nb_accesses
+                    FROM impress_document_access
+                    GROUP BY document_id
+                ) AS counts
+                WHERE impress_document.id = counts.document_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        # Count accesses in the transaction creating or deleting them, whatever the way
+        # they are created or deleted (bulk creation, cascade deletion...)
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION impress_document_count_accesses()
+                RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        UPDATE impress_document
+                        SET nb_accesses_direct = nb_accesses_direct + 1
+                        WHERE id = NEW.document_id;
+                        RETURN NEW;
+                    END IF;
+                    UPDATE impress_document
+                    SET nb_accesses_direct = nb_accesses_direct - 1
+                    WHERE id = OLD.document_id;
+                    RETURN OLD;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER impress_document_access_count
+                AFTER INSERT OR DELETE ON impress_document_access
+                FOR EACH ROW EXECUTE FUNCTION impress_document_count_accesses();
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS impress_document_access_count
+                ON impress_document_access;
+                DROP FUNCTION IF EXISTS impress_document_count_accesses();
+            """,
+        ),
+    ]
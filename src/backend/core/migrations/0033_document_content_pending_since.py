@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0032_document_nb_accesses_direct"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="content_pending_since",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(("content_pending_since__isnull", False)),
+                fields=["content_pending_since"],
+                name="document_content_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0033_document_content_pending_since"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="file_name",
+            field=models.CharField(
+                blank=True,
+                help_text="Name of the file in the Content-Disposition it is stored with",
+                max_length=255,
+                verbose_name="file name",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:02
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0034_attachment_file_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentversion",
+            name="attachments",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=255),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        # Attachments were never removed from documents before versions recorded
+        # theirs: the current attachments of a document include those of its versions
+        migrations.RunSQL(
+            sql="""
+            UPDATE impress_document_version AS version
+            SET attachments = document.attachments
+            FROM impress_document AS document
+            WHERE version.document_id = document.id
+                AND document.attachments IS NOT NULL;
+        """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="documentversion",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["attachments"], name="document_version_attachments_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0035_document_version_attachments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="search_text",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
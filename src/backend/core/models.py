@@ -5,7 +5,9 @@ Declare and configure the models for the impress core application
 
 import hashlib
 import smtplib
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from logging import getLogger
 
@@ -13,21 +15,28 @@ from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.sites.models import Site
 from django.core import mail, validators
 from django.core.cache import cache
-from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.core.mail import send_mail
 from django.db import models, transaction
-from django.db.models.functions import Left, Length
+from django.db.models.functions import Coalesce, Left, Length, Upper
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import get_language, override
 from django.utils.translation import gettext_lazy as _
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import (
+    BotoCoreError,
+    ClientError,
+    HTTPClientError,
+    IncompleteReadError,
+)
+from botocore.exceptions import ConnectionError as StorageConnectionError
 from rest_framework.exceptions import ValidationError
 from timezone_field import TimeZoneField
 from treebeard.mp_tree import MP_Node, MP_NodeManager, MP_NodeQuerySet
@@ -39,6 +48,7 @@ from .choices import (
     RoleChoices,
     get_equivalent_link_definition,
 )
+from .enums import DocumentAttachmentStatus
 
 logger = getLogger(__name__)
 
@@ -57,6 +67,79 @@ def get_trashbin_cutoff():
     return timezone.now() - timedelta(days=settings.TRASHBIN_CUTOFF_DAYS)
 
 
+# Error codes of object storage asking to slow down or to try again later
+STORAGE_THROTTLING_ERROR_CODES = {
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequests",
+}
+
+
+def is_transient_storage_error(error):
+    """
+    Tell whether an error raised by object storage may go away if the call is retried:
+    throttling, server and connection errors. Other errors, like a denied access or a
+    missing object, are permanent.
+    """
+    if isinstance(error, ClientError):
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return (
+            error.response.get("Error", {}).get("Code")
+            in STORAGE_THROTTLING_ERROR_CODES
+            or (status_code or 0) >= 500
+        )
+    return isinstance(
+        error, (StorageConnectionError, HTTPClientError, IncompleteReadError, OSError)
+    )
+
+
+MEDIA_AUTH_GENERATION_CACHE_KEY = "media_auth_generation"
+
+
+def get_media_auth_generation_keys(paths=(), keys=()):
+    """
+    Return the cache keys of the generations of the media authorization decisions
+    depending on the trees of the documents at the given paths (a tree being
+    identified by the path of its root) or on the attachments with the given keys.
+    """
+    steplen = Document.steplen
+    return {
+        f"{MEDIA_AUTH_GENERATION_CACHE_KEY:s}_tree_{path[:steplen]:s}" for path in paths
+    } | {f"{MEDIA_AUTH_GENERATION_CACHE_KEY:s}_attachment_{key:s}" for key in keys}
+
+
+def get_media_auth_generations(cache_keys):
+    """
+    Return the current generations stored under the given cache keys. A cached media
+    authorization decision stores the generations it depends on and is only valid
+    as long as they did not change.
+    """
+    generations = cache.get_many(list(cache_keys))
+    return {cache_key: generations.get(cache_key, "0") for cache_key in cache_keys}
+
+
+def invalidate_media_auth_cache(paths=(), keys=()):
+    """
+    Discard the cached media authorization decisions depending on the trees of the
+    documents at the given paths or on the attachments with the given keys, after a
+    change that may affect them (accesses, link configuration, attachments...). All
+    decisions are discarded if no path or key is given, e.g. after a move in the tree.
+
+    Generations are only changed once the current transaction is committed, so that
+    a decision computed concurrently from the former state is not stored as current.
+    """
+    cache_keys = get_media_auth_generation_keys(paths, keys) or {
+        MEDIA_AUTH_GENERATION_CACHE_KEY
+    }
+    generation = uuid.uuid4().hex
+    transaction.on_commit(
+        lambda: cache.set_many(dict.fromkeys(cache_keys, generation), None)
+    )
+
+
 class DuplicateEmailError(Exception):
     """Raised when an email is already associated with a pre-existing user."""
 
@@ -67,6 +150,31 @@ class DuplicateEmailError(Exception):
         super().__init__(self.message)
 
 
+@models.CharField.register_lookup
+class ImmutableUnaccent(models.Transform):  # pylint: disable=abstract-method
+    """
+    Remove accents with the immutable wrapper of the "unaccent" function created by
+    migration 0031. Contrary to the built-in "unaccent" lookup, it can be indexed.
+    """
+
+    bilateral = True
+    lookup_name = "immutable_unaccent"
+    function = "immutable_unaccent"
+
+
+class DatabaseCounterField(models.PositiveIntegerField):
+    """
+    Counter maintained by the database. Saving an instance only writes it on creation,
+    so that a stale value held in memory never overwrites the counter.
+    """
+
+    def pre_save(self, model_instance, add):
+        """Leave the counter unchanged when updating the instance."""
+        if add:
+            return super().pre_save(model_instance, add)
+        return models.F(self.attname)
+
+
 class BaseModel(models.Model):
     """
     Serves as an abstract base model for other models, ensuring that records are validated
@@ -314,6 +422,30 @@ class DocumentQuerySet(MP_NodeQuerySet):
 
         return self.filter(link_reach=LinkReachChoices.PUBLIC)
 
+    def readable_in_tree(self, user):
+        """
+        Filters the queryset to return documents that the given authenticated user can
+        read through the document tree, leaving out the documents they never came
+        across: documents on which they or their teams have an access on the document
+        or one of its ancestors, and documents they visited whose link reach, computed
+        from their ancestors, is not restricted, along with the descendants of those.
+        :param user: The user for whom readable documents are to be fetched.
+        :return: A queryset of documents readable by the user through the tree.
+        """
+        accesses = DocumentAccess.objects.filter(
+            models.Q(user=user) | models.Q(team__in=user.teams),
+            document__path=Left(models.OuterRef("path"), Length("document__path")),
+        )
+        reachable_ancestors = self.model.objects.filter(
+            path=Left(models.OuterRef("path"), Length("path"))
+        ).exclude(link_reach=LinkReachChoices.RESTRICTED)
+        traced_ancestors = self.model.objects.filter(
+            models.Exists(reachable_ancestors),
+            path=Left(models.OuterRef("path"), Length("path")),
+            link_traces__user=user,
+        )
+        return self.filter(models.Exists(accesses) | models.Exists(traced_ancestors))
+
     def annotate_is_favorite(self, user):
         """
         Annotate document queryset with the favorite status for the current user.
@@ -349,6 +481,96 @@ class DocumentQuerySet(MP_NodeQuerySet):
             user_roles=models.Value([], output_field=output_field),
         )
 
+    def fetch_contents(self, ids, max_workers=None, max_retries=None):
+        """
+        Fetch the content of many documents from object storage concurrently.
+
+        Objects are downloaded by a bounded pool of threads sharing the storage client
+        (boto3 clients are thread-safe). Throttling, server and connection errors are
+        retried with an exponential backoff, other errors are raised at once, and the
+        duration of each call is logged.
+
+        Args:
+            ids (iterable): Ids of the documents for which content should be fetched.
+            max_workers (int): Number of concurrent downloads, defaults to the
+                DOCUMENT_CONTENT_FETCH_MAX_WORKERS setting.
+            max_retries (int): Number of retries on transient errors, defaults to the
+                DOCUMENT_CONTENT_FETCH_MAX_RETRIES setting.
+
+        Returns:
+            dict: Content of each document (None if the document has no content in
+                object storage) keyed by document id.
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+
+        max_workers = max_workers or settings.DOCUMENT_CONTENT_FETCH_MAX_WORKERS
+        if max_retries is None:
+            max_retries = settings.DOCUMENT_CONTENT_FETCH_MAX_RETRIES
+
+        s3_client = default_storage.connection.meta.client
+        bucket_name = default_storage.bucket_name
+
+        def fetch(document_id):
+            key = self.model(pk=document_id).file_key
+            attempt = 0
+            while True:
+                start = time.monotonic()
+                try:
+                    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+                    content = response["Body"].read().decode("utf-8")
+                except ClientError as excpt:
+                    if excpt.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                        return None, time.monotonic() - start
+                    if attempt >= max_retries or not is_transient_storage_error(excpt):
+                        raise
+                except (BotoCoreError, OSError) as excpt:
+                    if attempt >= max_retries or not is_transient_storage_error(excpt):
+                        raise
+                else:
+                    duration = time.monotonic() - start
+                    logger.debug(
+                        "Fetched content of document %s in %.3fs (attempt %d)",
+                        document_id,
+                        duration,
+                        attempt + 1,
+                    )
+                    return content, duration
+                time.sleep(0.1 * 2**attempt)
+                attempt += 1
+
+        start = time.monotonic()
+        contents = {}
+        if settings.DOCUMENT_CONTENT_COALESCING_WINDOW:
+            # Content waiting to be flushed is more recent than object storage
+            cache_keys = {
+                self.model(pk=document_id).get_pending_content_cache_key(): document_id
+                for document_id in ids
+            }
+            for cache_key, pending in cache.get_many(cache_keys).items():
+                contents[cache_keys[cache_key]] = pending["content"]
+            ids = [document_id for document_id in ids if document_id not in contents]
+            if not ids:
+                return contents
+
+        durations = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ids))) as executor:
+            for document_id, (content, duration) in zip(
+                ids, executor.map(fetch, ids), strict=True
+            ):
+                contents[document_id] = content
+                durations.append(duration)
+
+        logger.info(
+            "Fetched content of %d documents in %.3fs (mean %.3fs, max %.3fs per call)",
+            len(ids),
+            time.monotonic() - start,
+            sum(durations) / len(durations),
+            max(durations),
+        )
+        return contents
+
 
 class DocumentManager(MP_NodeManager.from_queryset(DocumentQuerySet)):
     """
@@ -357,12 +579,20 @@ class DocumentManager(MP_NodeManager.from_queryset(DocumentQuerySet)):
     """
 
     def get_queryset(self):
-        """Sets the custom queryset as the default."""
-        return self._queryset_class(self.model).order_by("path")
+        """
+        Sets the custom queryset as the default. The search vector and text and the
+        pending content marker are only loaded when asked for so that saving a
+        document never overwrites them with a stale value.
+        """
+        return (
+            self._queryset_class(self.model)
+            .defer("search_vector", "search_text", "content_pending_since")
+            .order_by("path")
+        )
 
 
 # pylint: disable=too-many-public-methods
-class Document(MP_Node, BaseModel):
+class Document(MP_Node, BaseModel):  # pylint: disable=too-many-instance-attributes
     """Pad document carrying the content."""
 
     title = models.CharField(_("title"), max_length=255, null=True, blank=True)
@@ -400,6 +630,13 @@ class Document(MP_Node, BaseModel):
         blank=True,
         null=True,
     )
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    # Escaped text of the content, highlighted in search results
+    search_text = models.TextField(null=True, blank=True, editable=False)
+    # Maintained by a trigger on document accesses created by migration 0032
+    nb_accesses_direct = DatabaseCounterField(default=0, editable=False)
+    # Set while content buffered in the cache waits to be written to object storage
+    content_pending_since = models.DateTimeField(null=True, blank=True, editable=False)
 
     _content = None
 
@@ -417,6 +654,19 @@ class Document(MP_Node, BaseModel):
         ordering = ("path",)
         verbose_name = _("Document")
         verbose_name_plural = _("Documents")
+        indexes = [
+            GinIndex(fields=["search_vector"], name="document_search_vector_idx"),
+            # Accent and case insensitive search of documents by title
+            GinIndex(
+                OpClass(Upper(ImmutableUnaccent("title")), name="gin_trgm_ops"),
+                name="document_title_trgm_idx",
+            ),
+            models.Index(
+                fields=["content_pending_since"],
+                condition=models.Q(content_pending_since__isnull=False),
+                name="document_content_pending_idx",
+            ),
+        ]
         constraints = [
             models.CheckConstraint(
                 condition=(
@@ -435,36 +685,244 @@ class Document(MP_Node, BaseModel):
         super().__init__(*args, **kwargs)
         self._ancestors_link_definition = None
         self._computed_link_definition = None
+        # User to whom the next version of the content will be attributed
+        self.content_author = None
+        # Attachments known to be in the attachment index (None if unknown)
+        self._indexed_attachments = set()
+        # Title as loaded from the database, to index it again when it changes
+        self._loaded_title = None
+        self._nb_accesses_ancestors = None
 
     def save(self, *args, **kwargs):
-        """Write content to object storage only if _content has changed."""
+        """
+        Write content to object storage only if _content has changed. When write
+        coalescing is enabled, updates of the content of an existing document are
+        buffered and written once at the end of the coalescing window.
+        """
+        is_creation = self._state.adding
+        # Validation loads deferred fields: check if attachments were set beforehand
+        update_fields = kwargs.get("update_fields")
+        has_attachments = "attachments" in self.__dict__ and (
+            update_fields is None or "attachments" in update_fields
+        )
+        has_new_title = (
+            "title" in self.__dict__
+            and self.title != self._loaded_title
+            and (update_fields is None or "title" in update_fields)
+        )
         super().save(*args, **kwargs)
 
+        if has_attachments:
+            self.sync_attachment_index()
+
+        # Index the title of documents which content is not written along with it
+        if has_new_title and not (is_creation and self._content):
+            self.schedule_content_artifacts()
+        if has_new_title:
+            self._loaded_title = self.title
+
         if self._content:
-            file_key = self.file_key
-            bytes_content = self._content.encode("utf-8")
+            if self.content_author:
+                author_id = self.content_author.pk
+            else:
+                author_id = self.creator_id if is_creation else None
 
-            # Attempt to directly check if the object exists using the storage client.
-            try:
-                response = default_storage.connection.meta.client.head_object(
-                    Bucket=default_storage.bucket_name, Key=file_key
-                )
-            except ClientError as excpt:
-                # If the error is a 404, the object doesn't exist, so we should create it.
-                if excpt.response["Error"]["Code"] == "404":
-                    has_changed = True
-                else:
-                    raise
+            if settings.DOCUMENT_CONTENT_COALESCING_WINDOW and not is_creation:
+                self.buffer_content(self._content, author_id)
+            else:
+                self.write_content(self._content, author_id)
+
+    def full_clean(self, exclude=None, validate_unique=True, validate_constraints=True):
+        """
+        Skip the fields that were not loaded, like the search vector: saving does not
+        write them and validating them would load them from the database.
+        """
+        super().full_clean(
+            exclude={*(exclude or []), *self.get_deferred_fields()},
+            validate_unique=validate_unique,
+            validate_constraints=validate_constraints,
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the attachments and the title loaded from the database to sync the
+        attachment index and the search vector on save.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_title = instance.__dict__.get("title")  # noqa: SLF001 # pylint: disable=protected-access
+        instance._indexed_attachments = (  # noqa: SLF001 # pylint: disable=protected-access
+            set(instance.__dict__["attachments"] or [])
+            if "attachments" in instance.__dict__
+            else None
+        )
+        return instance
+
+    def sync_attachment_index(self):
+        """Reflect changes of the "attachments" field in the attachment index."""
+        attachments = set(self.attachments or [])
+        if attachments == self._indexed_attachments:
+            return
+
+        if self._indexed_attachments is None:
+            self._indexed_attachments = set(
+                self.attachment_links.values_list("key", flat=True)
+            )
+
+        removed_keys = self._indexed_attachments - attachments
+        added_keys = attachments - self._indexed_attachments
+        if removed_keys:
+            self.attachment_links.filter(key__in=removed_keys).delete()
+        if added_keys:
+            DocumentAttachment.objects.bulk_create(
+                [DocumentAttachment(document=self, key=key) for key in added_keys],
+                ignore_conflicts=True,
+            )
+        if removed_keys or added_keys:
+            invalidate_media_auth_cache(keys=removed_keys | added_keys)
+        self._indexed_attachments = attachments
+
+    def write_content(self, content, author_id=None, if_match=None):
+        """
+        Write content to object storage and index the new version if it has changed.
+        If `if_match` is set, the content is only written if the stored object still has
+        this ETag, a "PreconditionFailed" ClientError being raised otherwise.
+        """
+        file_key = self.file_key
+        bytes_content = content.encode("utf-8")
+
+        # Attempt to directly check if the object exists using the storage client.
+        try:
+            response = default_storage.connection.meta.client.head_object(
+                Bucket=default_storage.bucket_name, Key=file_key
+            )
+        except ClientError as excpt:
+            # If the error is a 404, the object doesn't exist, so we should create it.
+            if excpt.response["Error"]["Code"] == "404":
+                has_changed = True
             else:
-                # Compare the existing ETag with the MD5 hash of the new content.
-                has_changed = (
-                    response["ETag"].strip('"')
-                    != hashlib.md5(bytes_content).hexdigest()  # noqa: S324
+                raise
+        else:
+            # Compare the existing ETag with the MD5 hash of the new content.
+            has_changed = (
+                response["ETag"].strip('"') != hashlib.md5(bytes_content).hexdigest()  # noqa: S324
+            )
+
+        if has_changed:
+            write_parameters = default_storage._get_write_parameters(file_key)  # noqa: SLF001  # pylint: disable=protected-access
+            if if_match:
+                write_parameters["IfMatch"] = if_match
+            response = default_storage.connection.meta.client.put_object(
+                Bucket=default_storage.bucket_name,
+                Key=file_key,
+                Body=bytes_content,
+                **write_parameters,
+            )
+
+            self.schedule_content_artifacts()
+
+            # Index the new version unless the bucket is not versioned
+            if version_id := response.get("VersionId"):
+                # Values come from the storage backend: skip `full_clean` queries
+                DocumentVersion.objects.bulk_create(
+                    [
+                        DocumentVersion(
+                            document=self,
+                            version_id=version_id,
+                            etag=response["ETag"],
+                            size=len(bytes_content),
+                            last_modified=timezone.now(),
+                            author_id=author_id,
+                            attachments=self.attachments or [],
+                        )
+                    ]
                 )
 
-            if has_changed:
-                content_file = ContentFile(bytes_content)
-                default_storage.save(file_key, content_file)
+    def schedule_content_artifacts(self, restore_attachments=False):
+        """
+        Compute the artifacts derived from the content in the background once the
+        transaction writing it is committed. If `restore_attachments` is set, media
+        included in the content are attached again to the document.
+        """
+        # pylint: disable=import-outside-toplevel
+        from core.tasks.documents import (  # noqa: PLC0415
+            compute_document_content_artifacts,
+        )
+
+        document_id = str(self.pk)
+        transaction.on_commit(
+            lambda: compute_document_content_artifacts.delay(
+                document_id, restore_attachments=restore_attachments
+            )
+        )
+
+    def get_pending_content_cache_key(self):
+        """Cache key of the content waiting to be written to object storage."""
+        return f"document_{self.pk!s}_pending_content"
+
+    def get_attachments_digest_cache_key(self):
+        """Cache key of the digest of the content last extracted for attachments."""
+        return f"document_{self.pk!s}_attachments_digest"
+
+    def get_content_flush_cache_key(self):
+        """Cache key flagging that a flush of the pending content is scheduled."""
+        return f"document_{self.pk!s}_content_flush"
+
+    def buffer_content(self, content, author_id=None):
+        """
+        Keep the latest content in the shared cache and schedule a single flush to
+        object storage at the end of the coalescing window. The pending content is
+        kept in the cache until it is flushed so it survives the shutdown of the
+        process that received it, and the document is marked in the database so that
+        content whose flush was lost is written by `flush_stale_document_contents`.
+        """
+        # pylint: disable=import-outside-toplevel
+        from core.tasks.documents import flush_document_content  # noqa: PLC0415
+
+        window = settings.DOCUMENT_CONTENT_COALESCING_WINDOW
+        # Updating the document locks it until the content is in the cache, so that a
+        # flush can not drop this content between checking and deleting its own
+        with transaction.atomic():
+            Document.objects.filter(pk=self.pk).update(
+                content_pending_since=Coalesce("content_pending_since", timezone.now())
+            )
+            cache.set(
+                self.get_pending_content_cache_key(),
+                {"content": content, "author_id": author_id, "token": uuid.uuid4().hex},
+                timeout=None,
+            )
+        # Only the first update of the window schedules a flush. The flag expires in
+        # case the task is lost so that a later update schedules a new one.
+        if cache.add(self.get_content_flush_cache_key(), True, timeout=window * 2):
+            flush_document_content.apply_async((str(self.pk),), countdown=window)
+
+    def flush_content(self):
+        """
+        Write the pending content, if any, to object storage.
+        Returns True if pending content was found.
+        """
+        cache.delete(self.get_content_flush_cache_key())
+        pending_content_cache_key = self.get_pending_content_cache_key()
+        pending = cache.get(pending_content_cache_key)
+        if pending is not None:
+            self.write_content(pending["content"], pending["author_id"])
+
+        # Lock the document, like `buffer_content` does, so that no content can be
+        # buffered between checking the pending content and deleting it. Content
+        # buffered while we were writing is kept: a new flush was scheduled for it.
+        with transaction.atomic():
+            Document.objects.select_for_update().filter(pk=self.pk).exists()
+            current = cache.get(pending_content_cache_key)
+            if current is None or (
+                pending is not None and current["token"] == pending["token"]
+            ):
+                self.clear_content_pending()
+                cache.delete(pending_content_cache_key)
+        return pending is not None
+
+    def clear_content_pending(self):
+        """Unmark the document as having content waiting to be flushed."""
+        Document.objects.filter(pk=self.pk).update(content_pending_since=None)
 
     def is_leaf(self):
         """
@@ -490,6 +948,11 @@ class Document(MP_Node, BaseModel):
     def content(self):
         """Return the json content from object storage if available"""
         if self._content is None and self.id:
+            if settings.DOCUMENT_CONTENT_COALESCING_WINDOW:
+                pending = cache.get(self.get_pending_content_cache_key())
+                if pending is not None:
+                    self._content = pending["content"]
+                    return self._content
             try:
                 response = self.get_content_response()
             except (FileNotFoundError, ClientError):
@@ -517,45 +980,45 @@ class Document(MP_Node, BaseModel):
         return default_storage.connection.meta.client.get_object(**params)
 
     def get_versions_slice(self, from_version_id="", min_datetime=None, page_size=None):
-        """Get document versions from object storage with pagination and starting conditions"""
-        # /!\ Trick here /!\
-        # The "KeyMarker" and "VersionIdMarker" fields must either be both set or both not set.
-        # The error we get otherwise is not helpful at all.
-        markers = {}
-        if from_version_id:
-            markers.update(
-                {"KeyMarker": self.file_key, "VersionIdMarker": from_version_id}
-            )
-
+        """
+        Get document versions from the version index with keyset pagination and
+        starting conditions. The current version is excluded.
+        """
         real_page_size = (
             min(page_size, settings.DOCUMENT_VERSIONS_PAGE_SIZE)
             if page_size
             else settings.DOCUMENT_VERSIONS_PAGE_SIZE
         )
 
-        response = default_storage.connection.meta.client.list_object_versions(
-            Bucket=default_storage.bucket_name,
-            Prefix=self.file_key,
-            # compensate the latest version that we exclude below and get one more to
-            # know if there are more pages
-            MaxKeys=real_page_size + 2,
-            **markers,
-        )
+        queryset = self.versions.filter(
+            last_modified__gte=min_datetime or self.created_at
+        ).order_by("-last_modified", "-id")
 
-        min_last_modified = min_datetime or self.created_at
+        if from_version_id:
+            # Resume right after the marker version, in the same database query
+            marker = self.versions.filter(version_id=from_version_id)
+            marker_last_modified = models.Subquery(marker.values("last_modified")[:1])
+            queryset = queryset.filter(
+                models.Q(last_modified__lt=marker_last_modified)
+                | models.Q(
+                    last_modified=marker_last_modified,
+                    id__lt=models.Subquery(marker.values("id")[:1]),
+                )
+            )
+            offset = 0
+        else:
+            # The most recent version is the current version of the document
+            offset = 1
+
+        # Get one more version to know if there are more pages
         versions = [
             {
-                key_snake: version[key_camel]
-                for key_snake, key_camel in [
-                    ("etag", "ETag"),
-                    ("is_latest", "IsLatest"),
-                    ("last_modified", "LastModified"),
-                    ("version_id", "VersionId"),
-                ]
+                "etag": version.etag,
+                "is_latest": False,
+                "last_modified": version.last_modified,
+                "version_id": version.version_id,
             }
-            for version in response.get("Versions", [])
-            if version["LastModified"] >= min_last_modified
-            and version["IsLatest"] is False
+            for version in queryset[offset : offset + real_page_size + 1]
         ]
         results = versions[:real_page_size]
 
@@ -575,59 +1038,98 @@ class Document(MP_Node, BaseModel):
         }
 
     def delete_version(self, version_id):
-        """Delete a version from object storage given its version id"""
-        return default_storage.connection.meta.client.delete_object(
+        """Delete a version from object storage and from the version index"""
+        response = default_storage.connection.meta.client.delete_object(
             Bucket=default_storage.bucket_name, Key=self.file_key, VersionId=version_id
         )
+        self.versions.filter(version_id=version_id).delete()
+        return response
 
-    def get_nb_accesses_cache_key(self):
-        """Generate a unique cache key for each document."""
-        return f"document_{self.id!s}_nb_accesses"
-
-    def get_nb_accesses(self):
+    def restore_version(self, version, author_id=None):
         """
-        Calculate the number of accesses:
-        - directly attached to the document
-        - attached to any of the document's ancestors
+        Make a previous version the current version of the document by copying it
+        in object storage, without transferring its content through the application.
+        Returns the indexed new version.
         """
-        cache_key = self.get_nb_accesses_cache_key()
-        nb_accesses = cache.get(cache_key)
+        # The restored version supersedes content waiting to be flushed
+        cache.delete_many(
+            [self.get_pending_content_cache_key(), self.get_content_flush_cache_key()]
+        )
 
-        if nb_accesses is None:
-            nb_accesses = (
-                DocumentAccess.objects.filter(document=self).count(),
-                DocumentAccess.objects.filter(
-                    document__path=Left(
-                        models.Value(self.path), Length("document__path")
-                    ),
-                    document__ancestors_deleted_at__isnull=True,
-                ).count(),
-            )
-            cache.set(cache_key, nb_accesses)
+        file_key = self.file_key
+        s3_client = default_storage.connection.meta.client
+        response = s3_client.copy_object(
+            Bucket=default_storage.bucket_name,
+            Key=file_key,
+            CopySource={
+                "Bucket": default_storage.bucket_name,
+                "Key": file_key,
+                "VersionId": version.version_id,
+            },
+            MetadataDirective="COPY",
+        )
+        new_version = DocumentVersion.objects.bulk_create(
+            [
+                DocumentVersion(
+                    document=self,
+                    version_id=response["VersionId"],
+                    etag=response["CopyObjectResult"]["ETag"],
+                    size=version.size,
+                    last_modified=timezone.now(),
+                    author_id=author_id,
+                    attachments=version.attachments,
+                )
+            ]
+        )[0]
 
-        return nb_accesses
+        self._content = None
+        self.updated_at = new_version.last_modified
+        self.content_pending_since = None
+        Document.objects.filter(pk=self.pk).update(
+            updated_at=self.updated_at, content_pending_since=None
+        )
+        # Media removed from the content since the restored version may have been
+        # removed from the attachments of the document by the orphan attachments
+        # collector: they are attached again along with the content artifacts
+        self.schedule_content_artifacts(restore_attachments=True)
 
-    @property
-    def nb_accesses_direct(self):
-        """Returns the number of accesses related to the document or one of its ancestors."""
-        return self.get_nb_accesses()[0]
+        return new_version
 
-    @property
-    def nb_accesses_ancestors(self):
-        """Returns the number of accesses related to the document or one of its ancestors."""
-        return self.get_nb_accesses()[1]
+    def get_ancestors_paths(self):
+        """Paths of the document's ancestors and of the document itself."""
+        return [
+            self.path[:i] for i in range(self.steplen, len(self.path) + 1, self.steplen)
+        ]
 
-    def invalidate_nb_accesses_cache(self):
+    @classmethod
+    def compute_nb_accesses_ancestors(cls, documents):
         """
-        Invalidate the cache for number of accesses, including on affected descendants.
-        Args:
-            path: can optionally be passed as argument (useful when invalidating cache for a
-                document we just deleted)
+        Set the number of accesses related to each document or one of its ancestors,
+        summing the counters of all their ancestors in one query on indexed paths.
         """
+        ancestors_paths = [document.get_ancestors_paths() for document in documents]
+        counters = dict(
+            cls.objects.filter(
+                path__in={path for paths in ancestors_paths for path in paths},
+                ancestors_deleted_at__isnull=True,
+            ).values_list("path", "nb_accesses_direct")
+        )
+        for document, paths in zip(documents, ancestors_paths, strict=True):
+            document.nb_accesses_ancestors = sum(
+                counters.get(path, 0) for path in paths
+            )
+
+    @property
+    def nb_accesses_ancestors(self):
+        """Returns the number of accesses related to the document or one of its ancestors."""
+        if self._nb_accesses_ancestors is None:
+            self.compute_nb_accesses_ancestors([self])
+        return self._nb_accesses_ancestors
 
-        for document in Document.objects.filter(path__startswith=self.path).only("id"):
-            cache_key = document.get_nb_accesses_cache_key()
-            cache.delete(cache_key)
+    @nb_accesses_ancestors.setter
+    def nb_accesses_ancestors(self, nb_accesses):
+        """Cache the number of accesses, None to compute it again."""
+        self._nb_accesses_ancestors = nb_accesses
 
     def get_role(self, user):
         """Return the roles a user has on a document."""
@@ -804,6 +1306,7 @@ class Document(MP_Node, BaseModel):
             "update": can_update,
             "versions_destroy": is_owner_or_admin,
             "versions_list": has_access_role,
+            "versions_restore": can_update_from_access,
             "versions_retrieve": has_access_role,
         }
 
@@ -890,7 +1393,8 @@ class Document(MP_Node, BaseModel):
 
         self.ancestors_deleted_at = self.deleted_at = timezone.now()
         self.save()
-        self.invalidate_nb_accesses_cache()
+        self.nb_accesses_ancestors = None
+        invalidate_media_auth_cache(paths=[self.path])
 
         if self.depth > 1:
             self._meta.model.objects.filter(pk=self.get_parent().pk).update(
@@ -933,7 +1437,8 @@ class Document(MP_Node, BaseModel):
         )
         self.ancestors_deleted_at = ancestors_deleted_at
         self.save(update_fields=["deleted_at", "ancestors_deleted_at"])
-        self.invalidate_nb_accesses_cache()
+        self.nb_accesses_ancestors = None
+        invalidate_media_auth_cache(paths=[self.path])
 
         self.get_descendants().exclude(
             models.Q(deleted_at__isnull=False)
@@ -946,6 +1451,170 @@ class Document(MP_Node, BaseModel):
             )
 
 
+class DocumentVersion(BaseModel):
+    """
+    Index of the versions of a document's content kept in object storage. A record is
+    written each time a new version of the content is saved so that the version history
+    can be listed from the database instead of object storage.
+    """
+
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="versions",
+    )
+    version_id = models.CharField(_("version id"), max_length=1024)
+    etag = models.CharField(_("etag"), max_length=255, blank=True)
+    size = models.PositiveBigIntegerField(_("size"), default=0)
+    last_modified = models.DateTimeField(_("last modified"))
+    author = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="document_versions",
+        null=True,
+        blank=True,
+    )
+    # Attachments of the document when the version was saved, kept by the orphan
+    # attachments collector for as long as the version is retained
+    attachments = ArrayField(
+        models.CharField(max_length=255),
+        default=list,
+        editable=False,
+        blank=True,
+    )
+
+    class Meta:
+        db_table = "impress_document_version"
+        ordering = ("-last_modified", "-id")
+        verbose_name = _("Document version")
+        verbose_name_plural = _("Document versions")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["document", "version_id"],
+                name="unique_document_version",
+                violation_error_message=_(
+                    "This version is already indexed for this document."
+                ),
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["document", "-last_modified", "-id"],
+                name="document_version_history_idx",
+            ),
+            GinIndex(fields=["attachments"], name="document_version_attachments_idx"),
+        ]
+
+    def __str__(self):
+        return f"Version {self.version_id:s} of document {self.document_id!s}"
+
+
+class DocumentAttachment(BaseModel):
+    """
+    Index of the attachment keys included in documents, mirroring the "attachments"
+    field of documents, to find the documents including a media efficiently.
+    """
+
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="attachment_links",
+    )
+    key = models.CharField(_("key"), max_length=255)
+
+    class Meta:
+        db_table = "impress_document_attachment"
+        verbose_name = _("Document attachment")
+        verbose_name_plural = _("Document attachments")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["key", "document"],
+                name="unique_document_attachment_key",
+                violation_error_message=_(
+                    "This attachment is already included in this document."
+                ),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Attachment {self.key:s} of document {self.document_id!s}"
+
+
+class AttachmentQuerySet(models.QuerySet):
+    """Custom queryset for the attachment registry."""
+
+    def unreferenced(self):
+        """Restrict to the attachments that are not included in any document."""
+        return self.exclude(
+            models.Exists(DocumentAttachment.objects.filter(key=models.OuterRef("key")))
+        )
+
+
+class Attachment(BaseModel):
+    """
+    Registry of the files uploaded as attachments of documents. Their status and
+    metadata are kept in database to avoid reading them from object storage.
+
+    Files are content-addressed by their digest: identical files uploaded again
+    under the same name reuse the key under which they were first stored, so a file
+    may be included in many documents and is only deleted when no document
+    references it anymore.
+    """
+
+    key = models.CharField(_("key"), max_length=255, unique=True)
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.SET_NULL,
+        related_name="uploaded_attachments",
+        null=True,
+        blank=True,
+        help_text=_("Document to which the file was uploaded"),
+    )
+    size = models.PositiveBigIntegerField(_("size"), null=True, blank=True)
+    content_type = models.CharField(_("content type"), max_length=255)
+    file_name = models.CharField(
+        _("file name"),
+        max_length=255,
+        blank=True,
+        help_text=_("Name of the file in the Content-Disposition it is stored with"),
+    )
+    status = models.CharField(
+        _("status"),
+        max_length=20,
+        choices=DocumentAttachmentStatus.choices,
+        default=DocumentAttachmentStatus.PROCESSING,
+    )
+    digest = models.CharField(
+        _("digest"),
+        max_length=64,
+        blank=True,
+        help_text=_("SHA-256 hex digest of the file"),
+    )
+    variants = models.JSONField(
+        _("variants"),
+        default=list,
+        blank=True,
+        help_text=_("Resized variants of the image as a list of width, format and key"),
+    )
+
+    objects = AttachmentQuerySet.as_manager()
+
+    class Meta:
+        db_table = "impress_attachment"
+        verbose_name = _("Attachment")
+        verbose_name_plural = _("Attachments")
+        indexes = [
+            models.Index(
+                fields=["digest"],
+                name="attachment_digest_idx",
+                condition=~models.Q(digest=""),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Attachment {self.key:s}"
+
+
 class LinkTrace(BaseModel):
     """
     Relation model to trace accesses to a document via a link by a logged-in user.
@@ -1049,9 +1718,16 @@ class DocumentAccess(BaseAccess):
         return f"{self.user!s} is {self.role:s} in document {self.document!s}"
 
     def save(self, *args, **kwargs):
-        """Override save to clear the document's cache for number of accesses."""
+        """
+        Override save to keep the document's number of accesses, incremented by the
+        database, up to date in memory and clear the cached media authorization decisions.
+        """
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        self.document.invalidate_nb_accesses_cache()
+        if adding:
+            self.document.nb_accesses_direct += 1
+            self.document.nb_accesses_ancestors = None
+        invalidate_media_auth_cache(paths=[self.document.path])
 
     @property
     def target_key(self):
@@ -1059,9 +1735,14 @@ class DocumentAccess(BaseAccess):
         return f"user:{self.user_id!s}" if self.user_id else f"team:{self.team:s}"
 
     def delete(self, *args, **kwargs):
-        """Override delete to clear the document's cache for number of accesses."""
+        """
+        Override delete to keep the document's number of accesses, decremented by the
+        database, up to date in memory and clear the cached media authorization decisions.
+        """
         super().delete(*args, **kwargs)
-        self.document.invalidate_nb_accesses_cache()
+        self.document.nb_accesses_direct -= 1
+        self.document.nb_accesses_ancestors = None
+        invalidate_media_auth_cache(paths=[self.document.path])
 
     def set_user_roles_tuple(self, ancestors_role, current_role):
         """
@@ -0,0 +1,91 @@
+"""Full-text search of documents with the text search engine of PostgreSQL."""
+
+import html
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchVector
+from django.db.models import Value
+from django.db.models.functions import NullIf
+
+# Accent insensitive text search configurations created by migration 0030, by
+# language of the application
+SEARCH_CONFIGS = {
+    "en": "impress_english",
+    "fr": "impress_french",
+    "de": "impress_german",
+    "nl": "impress_dutch",
+    "es": "impress_spanish",
+}
+DEFAULT_SEARCH_CONFIG = "impress_simple"
+
+# A tsvector can not exceed 1MB: only the beginning of long documents is indexed
+SEARCH_TEXT_MAX_LENGTH = 200_000
+
+
+def get_search_config(language=None):
+    """Return the text search configuration to use for a language."""
+    language = language or settings.LANGUAGE_CODE
+    return SEARCH_CONFIGS.get(language.split("-")[0], DEFAULT_SEARCH_CONFIG)
+
+
+def get_search_configs():
+    """Return all the text search configurations, in a stable order."""
+    return [DEFAULT_SEARCH_CONFIG, *SEARCH_CONFIGS.values()]
+
+
+def get_search_vector(title, text, config):
+    """
+    Return an expression computing the search vector of a document from its title,
+    weighted as more relevant, and from the text of its content.
+    """
+    return SearchVector(Value(title or ""), weight="A", config=config) + SearchVector(
+        Value((text or "")[:SEARCH_TEXT_MAX_LENGTH]), weight="B", config=config
+    )
+
+
+def get_search_query(text):
+    """
+    Return a query matching the text typed by a user. Documents are indexed in the
+    language of their creator, which may not be the one of the user searching them:
+    the query is parsed with each configuration and any of them may match.
+    """
+    return reduce(
+        or_,
+        [
+            SearchQuery(text, config=config, search_type="websearch")
+            for config in get_search_configs()
+        ],
+    )
+
+
+def get_search_text(text):
+    """
+    Return the text of a document as stored to highlight it in search results: only
+    the indexed beginning of the text is kept and it is escaped so that highlights
+    computed from it are safe html.
+    """
+    return html.escape((text or "")[:SEARCH_TEXT_MAX_LENGTH])
+
+
+def get_search_headline(query_text, config):
+    """
+    Return an expression computing the fragments of the stored text of a document
+    best matching a query, matched words being enclosed in <mark> tags, or None if
+    the document has no text.
+    """
+    return NullIf(
+        SearchHeadline(
+            "search_text",
+            SearchQuery(query_text, config=config, search_type="websearch"),
+            config=config,
+            start_sel="<mark>",
+            stop_sel="</mark>",
+            max_words=30,
+            min_words=10,
+            max_fragments=2,
+            fragment_delimiter=" … ",
+        ),
+        Value(""),
+    )
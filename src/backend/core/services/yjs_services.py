@@ -0,0 +1,190 @@
+"""Yjs services."""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class YjsProcessingError(ValueError):
+    """A yjs document could not be processed."""
+
+
+class YjsContentTooLargeError(YjsProcessingError):
+    """The yjs document is larger than the size allowed for processing."""
+
+
+class YjsTimeoutError(YjsProcessingError):
+    """Processing the yjs document took longer than allowed."""
+
+
+def call_yjs_function(function, *args):
+    """
+    Call a function processing a yjs document. Pycrdt reports some invalid documents
+    by panicking, which raises an exception not deriving from `Exception` that would
+    kill a worker process: all failures are reported as a ValueError instead.
+    """
+    try:
+        return function(*args)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as err:  # noqa: BLE001 pylint: disable=broad-exception-caught
+        raise ValueError(str(err)) from None
+
+
+def setup_worker():
+    """Set up Django in a worker process of the yjs executor."""
+    # pylint: disable=import-outside-toplevel
+    import configurations  # noqa: PLC0415
+
+    configurations.setup()
+
+
+class PoolOperation:
+    """
+    An operation running in a pool of worker processes, completed when its result is
+    available or aborted when the pool is reset.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.aborted = False
+        self.result = None
+        self.error = None
+
+    def complete(self, result):
+        """Store the result of the operation."""
+        self.result = result
+        self.done.set()
+
+    def fail(self, error):
+        """Store the error raised by the operation."""
+        self.error = error
+        self.done.set()
+
+    def abort(self):
+        """Release the caller waiting for the operation, which can not complete."""
+        if not self.done.is_set():
+            self.aborted = True
+            self.done.set()
+
+
+class YjsExecutor:
+    """
+    Run CPU-bound operations on yjs documents in a pool of worker processes, so that
+    decoding a pathological document can not stall the API or Celery workers calling
+    them. Operations block until their result is available, get the content of the
+    document as first argument and must be module level functions.
+    """
+
+    _pool = None
+    _pool_pid = None
+    _pool_operations = set()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, operation):
+        """
+        Get the pool of worker processes and register an operation running on it. The
+        pool is created on first use in each process so that processes forked by the
+        web server or Celery don't share their parent's. Workers are started by a fork
+        server rather than forked from the calling process, which may be running other
+        threads holding locks, and set up Django from the environment.
+        """
+        with cls._lock:
+            if cls._pool is None or cls._pool_pid != os.getpid():
+                cls._pool = multiprocessing.get_context("forkserver").Pool(
+                    settings.YJS_EXECUTOR_MAX_WORKERS, initializer=setup_worker
+                )
+                cls._pool_pid = os.getpid()
+                cls._pool_operations = set()
+            cls._pool_operations.add(operation)
+            return cls._pool
+
+    @classmethod
+    def release_operation(cls, operation):
+        """Unregister an operation that completed or was aborted."""
+        with cls._lock:
+            cls._pool_operations.discard(operation)
+
+    @classmethod
+    def reset_pool(cls, pool):
+        """
+        Terminate a pool, killing the operations it is running: their callers run them
+        again on the pool replacing it, within what remains of their own timeout.
+        """
+        with cls._lock:
+            if cls._pool is not pool:
+                # The pool was already reset
+                return
+            operations = cls._pool_operations
+            cls._pool = None
+            cls._pool_operations = set()
+        pool.terminate()
+        for operation in operations:
+            operation.abort()
+
+    def run(self, function, content, *args, timeout=None):
+        """
+        Run a function on the content of a yjs document and return its result.
+
+        Raises YjsContentTooLargeError without running the function if the content is
+        larger than `YJS_EXECUTOR_MAX_CONTENT_SIZE`, YjsTimeoutError if it did not
+        complete within `timeout` seconds (`YJS_EXECUTOR_TIMEOUT` by default) and
+        ValueError if it failed. An operation killed because another one timed out is
+        run again. The operation runs in the calling process if
+        `YJS_EXECUTOR_MAX_WORKERS` is 0 or if the calling process is daemonic, like
+        Celery prefork workers, as daemonic processes can not have children: it is
+        then not limited in time and Celery tasks must set their own time limits.
+        """
+        if content and len(content) > settings.YJS_EXECUTOR_MAX_CONTENT_SIZE:
+            raise YjsContentTooLargeError(
+                f"Content of {len(content):d} bytes is too large to be processed."
+            )
+
+        if (
+            not settings.YJS_EXECUTOR_MAX_WORKERS
+            or multiprocessing.current_process().daemon
+        ):
+            return call_yjs_function(function, content, *args)
+
+        timeout = settings.YJS_EXECUTOR_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            operation = PoolOperation()
+            pool = self.get_pool(operation)
+            try:
+                pool.apply_async(
+                    call_yjs_function,
+                    (function, content, *args),
+                    callback=operation.complete,
+                    error_callback=operation.fail,
+                )
+                if not operation.done.wait(max(deadline - time.monotonic(), 0)):
+                    logger.warning(
+                        "%s did not complete within %g seconds on a content of %d bytes",
+                        function.__name__,
+                        timeout,
+                        len(content),
+                    )
+                    # The worker can not be interrupted otherwise
+                    self.reset_pool(pool)
+                    raise YjsTimeoutError(
+                        f"Processing the content took more than {timeout:g} seconds."
+                    )
+            finally:
+                self.release_operation(operation)
+
+            if not operation.aborted:
+                break
+            # The pool was reset because another operation timed out
+            logger.info("Running %s again on a new pool", function.__name__)
+
+        if operation.error is not None:
+            raise operation.error
+        return operation.result
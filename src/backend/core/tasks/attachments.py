@@ -0,0 +1,401 @@
+"""Process the files attached to documents using celery tasks."""
+
+import hashlib
+import re
+from datetime import timedelta
+from io import BytesIO
+from logging import getLogger
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from core import enums, models, utils
+from core.tasks.versions import DELETE_OBJECTS_BATCH_SIZE
+
+from impress.celery_app import app
+
+logger = getLogger(__name__)
+
+VARIANT_CONTENT_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+VARIANT_SUFFIX = re.compile(f"{enums.IMAGE_VARIANT_SUFFIX_REGEX:s}$")
+
+# Limit of the documents already reconciled by the orphan attachments collector
+ORPHAN_ATTACHMENTS_CHECKPOINT_CACHE_KEY = "orphan_attachments_checkpoint"
+
+
+def get_variant_key(key, width, image_format):
+    """Key under which a resized variant of an image is stored, next to the image."""
+    return f"{key:s}-{width:d}w.{image_format:s}"
+
+
+@app.task
+def generate_image_variants(key):
+    """
+    Generate resized variants of an image attachment in the widths and formats defined
+    in settings and register them on the attachment. Only widths smaller than the
+    original image are generated. Returns the list of variants registered.
+    """
+    try:
+        attachment = models.Attachment.objects.get(key=key)
+    except models.Attachment.DoesNotExist:
+        return []
+
+    # Unsafe files must only be downloaded, never displayed inline
+    is_unsafe = key.rpartition(".")[0].endswith("-unsafe")
+    if is_unsafe or not attachment.content_type.startswith("image/"):
+        return []
+
+    formats = [
+        image_format
+        for image_format in settings.DOCUMENT_IMAGE_VARIANT_FORMATS
+        if image_format in VARIANT_CONTENT_TYPES and features.check(image_format)
+    ]
+    s3_client = default_storage.connection.meta.client
+    bucket_name = default_storage.bucket_name
+
+    body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    try:
+        image = Image.open(BytesIO(body))
+        # Animated images would lose their animation
+        if getattr(image, "is_animated", False):
+            return []
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as err:
+        logger.warning("Could not generate variants of image %s: %s", key, err)
+        return []
+
+    variants = []
+    for width in sorted(
+        {int(width) for width in settings.DOCUMENT_IMAGE_VARIANT_WIDTHS}
+    ):
+        if width >= image.width:
+            break
+
+        height = max(round(image.height * width / image.width), 1)
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for image_format in formats:
+            buffer = BytesIO()
+            resized.save(buffer, format=image_format)
+            variant_key = get_variant_key(key, width, image_format)
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=variant_key,
+                Body=buffer.getvalue(),
+                ContentType=VARIANT_CONTENT_TYPES[image_format],
+                ContentDisposition="inline",
+            )
+            variants.append(
+                {"width": width, "format": image_format, "key": variant_key}
+            )
+
+    attachment.variants = variants
+    attachment.save(update_fields=["variants", "updated_at"])
+
+    logger.info("Generated %d variants of image %s", len(variants), key)
+    return variants
+
+
+@app.task
+def compute_attachment_digest(key):
+    """
+    Compute the digest of an attachment uploaded directly to object storage, which
+    the backend did not receive, so that identical files uploaded later reuse it.
+    Returns the digest.
+    """
+    # Unsafe files are never reused
+    is_unsafe = key.rpartition(".")[0].endswith("-unsafe")
+    if is_unsafe or not models.Attachment.objects.filter(key=key, digest="").exists():
+        return None
+
+    file_hash = hashlib.sha256()
+    body = default_storage.connection.meta.client.get_object(
+        Bucket=default_storage.bucket_name, Key=key
+    )["Body"]
+    for chunk in body.iter_chunks():
+        file_hash.update(chunk)
+    digest = file_hash.hexdigest()
+
+    models.Attachment.objects.filter(key=key, digest="").update(digest=digest)
+    return digest
+
+
+def list_object_versions(prefix):
+    """
+    List all the versions and delete markers of the objects stored under a prefix
+    as (key, version_id, last_modified) tuples.
+    """
+    paginator = default_storage.connection.meta.client.get_paginator(
+        "list_object_versions"
+    )
+    for page in paginator.paginate(Bucket=default_storage.bucket_name, Prefix=prefix):
+        for item in page.get("Versions", []) + page.get("DeleteMarkers", []):
+            yield item["Key"], item["VersionId"], item["LastModified"]
+
+
+def delete_object_versions(objects):
+    """
+    Delete a batch of object versions from object storage. `objects` is a list of
+    (key, version_id) tuples. Returns the number of versions deleted.
+    """
+    response = default_storage.connection.meta.client.delete_objects(
+        Bucket=default_storage.bucket_name,
+        Delete={
+            "Objects": [
+                {"Key": key, "VersionId": version_id} for key, version_id in objects
+            ],
+            "Quiet": False,
+        },
+    )
+
+    for error in response.get("Errors", []):
+        logger.error(
+            "Could not delete version %s of %s: %s",
+            error.get("VersionId"),
+            error.get("Key"),
+            error.get("Message"),
+        )
+
+    return len(response.get("Deleted", []))
+
+
+def reconcile_document_attachments(document, dry_run=False):
+    """
+    Remove from the attachments of a document the media that are not included in its
+    content anymore. Returns the keys removed.
+    """
+    # Never remove attachments of a document which content could not be read
+    content = document.content
+    if not document.attachments or content is None:
+        return set()
+
+    try:
+        content_keys = set(utils.extract_attachments(content))
+    except ValueError:
+        logger.warning("Could not extract attachments of document %s", document.pk)
+        return set()
+    removed_keys = set(document.attachments) - content_keys
+    if not removed_keys or dry_run:
+        return removed_keys
+
+    attachments = [key for key in document.attachments if key in content_keys]
+    # Don't overwrite the attachments if the document was modified in the meantime
+    if not models.Document.objects.filter(
+        pk=document.pk, updated_at=document.updated_at
+    ).update(attachments=attachments):
+        return set()
+
+    document.attachments = attachments
+    document.sync_attachment_index()
+    return removed_keys
+
+
+def get_retained_keys(keys):
+    """
+    Select among attachment keys those included in versions of documents that are
+    retained: restoring these versions would include them again.
+    """
+    keys = set(keys)
+    retained_keys = set()
+    if not keys:
+        return retained_keys
+
+    for attachments in (
+        models.DocumentVersion.objects.filter(attachments__overlap=list(keys))
+        .values_list("attachments", flat=True)
+        .iterator()
+    ):
+        retained_keys.update(keys.intersection(attachments))
+    return retained_keys
+
+
+def get_orphan_objects(prefix, grace_limit):
+    """
+    Group the versions of the objects stored under a prefix by attachment, the
+    variants of an image going with it, and keep the attachments that are not
+    included in any document or retained version and were not modified since the
+    grace limit. Returns a dictionary mapping their keys to the list of their versions.
+    """
+    objects = {}
+    last_modified = {}
+    for key, version_id, modified_at in list_object_versions(prefix):
+        attachment_key = VARIANT_SUFFIX.sub("", key)
+        objects.setdefault(attachment_key, []).append((key, version_id))
+        last_modified[attachment_key] = max(
+            modified_at, last_modified.get(attachment_key, modified_at)
+        )
+
+    referenced_keys = set(
+        models.DocumentAttachment.objects.filter(key__in=objects).values_list(
+            "key", flat=True
+        )
+    )
+    referenced_keys |= get_retained_keys(set(objects) - referenced_keys)
+    return {
+        key: versions
+        for key, versions in objects.items()
+        if key not in referenced_keys and last_modified[key] < grace_limit
+    }
+
+
+def delete_orphans(orphans):
+    """
+    Delete orphan attachments with all their versions and variants from object
+    storage then from the attachment registry. `orphans` is a dictionary mapping
+    their keys to the list of their versions. Returns the number of versions deleted.
+    """
+    objects = [version for versions in orphans.values() for version in versions]
+    deleted = 0
+    for index in range(0, len(objects), DELETE_OBJECTS_BATCH_SIZE):
+        deleted += delete_object_versions(
+            objects[index : index + DELETE_OBJECTS_BATCH_SIZE]
+        )
+    models.Attachment.objects.filter(key__in=orphans).delete()
+    return deleted
+
+
+def list_expired_uploads(limit):
+    """
+    List the multipart uploads of attachments initiated before a limit as
+    (key, upload_id) tuples.
+    """
+    paginator = default_storage.connection.meta.client.get_paginator(
+        "list_multipart_uploads"
+    )
+    for page in paginator.paginate(Bucket=default_storage.bucket_name):
+        for upload in page.get("Uploads", []):
+            if (
+                f"/{enums.ATTACHMENTS_FOLDER:s}/" in upload["Key"]
+                and upload["Initiated"] < limit
+            ):
+                yield upload["Key"], upload["UploadId"]
+
+
+def abort_expired_uploads(dry_run=False):
+    """
+    Abort the multipart uploads of attachments which upload slot expired: they can't
+    be confirmed anymore and their parts would be kept in object storage forever.
+    Returns the number of uploads aborted.
+    """
+    limit = timezone.now() - timedelta(
+        seconds=settings.DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION
+    )
+    s3_client = default_storage.connection.meta.client
+    aborted = 0
+    for key, upload_id in list_expired_uploads(limit):
+        if not dry_run:
+            try:
+                s3_client.abort_multipart_upload(
+                    Bucket=default_storage.bucket_name, Key=key, UploadId=upload_id
+                )
+            except ClientError as err:
+                logger.error("Could not abort multipart upload of %s: %s", key, err)
+                continue
+        aborted += 1
+    return aborted
+
+
+def get_documents_to_reconcile(grace_limit, full):
+    """
+    Select the documents that were not modified since the grace limit, or only those
+    modified since the last run if a checkpoint is available and `full` is not set.
+    """
+    documents = models.Document.objects.filter(updated_at__lt=grace_limit)
+    checkpoint = None if full else cache.get(ORPHAN_ATTACHMENTS_CHECKPOINT_CACHE_KEY)
+    if checkpoint is not None:
+        documents = documents.filter(updated_at__gte=checkpoint)
+    return documents.only("id", "attachments", "updated_at").order_by("pk")
+
+
+@app.task
+def collect_orphan_attachments(dry_run=False, full=False):
+    """
+    Delete the attachments that are not included in any document anymore:
+    - the attachments of each document are reconciled with its content: media removed
+      from the content are removed from its attachments,
+    - the files stored under the attachments prefix of each document and the
+      registered attachments that are not included in any document or in any
+      retained version of a document, and were not modified during the grace
+      period, are deleted with all their versions and variants,
+    - the multipart uploads of attachments which upload slot expired are aborted.
+
+    Only documents that were not modified during the grace period are reconciled and,
+    unless `full` is set, only those modified since the previous run. Deletions are
+    sent to object storage by batches. In dry-run mode, nothing is modified and the
+    report only tells what would be collected.
+    """
+    grace_limit = timezone.now() - timedelta(
+        days=settings.DOCUMENT_ATTACHMENT_ORPHAN_GRACE_DAYS
+    )
+    report = {
+        "dry_run": dry_run,
+        "documents": 0,
+        "keys": 0,
+        "attachments": 0,
+        "objects": 0,
+        "deleted": 0,
+        "uploads": 0,
+    }
+    collected_keys = set()
+    batch = {}
+
+    def collect(orphans):
+        nonlocal batch
+        orphans = {
+            key: versions
+            for key, versions in orphans.items()
+            if key not in collected_keys
+        }
+        collected_keys.update(orphans)
+        report["attachments"] += len(orphans)
+        report["objects"] += sum(len(versions) for versions in orphans.values())
+        if dry_run:
+            return
+
+        batch.update(orphans)
+        if sum(len(versions) for versions in batch.values()) >= (
+            DELETE_OBJECTS_BATCH_SIZE
+        ):
+            report["deleted"] += delete_orphans(batch)
+            batch = {}
+
+    for document in get_documents_to_reconcile(grace_limit, full).iterator():
+        report["documents"] += 1
+        report["keys"] += len(reconcile_document_attachments(document, dry_run))
+        collect(get_orphan_objects(f"{document.pk!s}/attachments/", grace_limit))
+
+    # Files of documents that were deleted or reconciled during a previous run. Files
+    # missing from object storage are removed from the registry all the same.
+    for key in (
+        models.Attachment.objects.unreferenced()
+        .filter(updated_at__lt=grace_limit)
+        .values_list("key", flat=True)
+        .iterator()
+    ):
+        if key not in collected_keys and not get_retained_keys([key]):
+            collect(get_orphan_objects(key, grace_limit) or {key: []})
+
+    if batch:
+        report["deleted"] += delete_orphans(batch)
+    report["uploads"] = abort_expired_uploads(dry_run)
+    if not dry_run:
+        cache.set(ORPHAN_ATTACHMENTS_CHECKPOINT_CACHE_KEY, grace_limit, None)
+
+    logger.info(
+        "Collected orphan attachments%s: %d documents reconciled, %d keys removed, "
+        "%d attachments (%d objects) selected, %d objects deleted, "
+        "%d incomplete uploads aborted",
+        " (dry run)" if dry_run else "",
+        report["documents"],
+        report["keys"],
+        report["attachments"],
+        report["objects"],
+        report["deleted"],
+        report["uploads"],
+    )
+    return report
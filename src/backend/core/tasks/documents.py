@@ -0,0 +1,296 @@
+"""Process the content of documents using celery tasks."""
+
+from datetime import timedelta
+from logging import getLogger
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from botocore.exceptions import ClientError
+
+from core import models, search, utils
+
+from impress.celery_app import app
+
+logger = getLogger(__name__)
+
+# Date of the start of the last compaction run
+CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY = "content_compaction_checkpoint"
+# Progress of the compaction run in progress, to resume it if it was interrupted
+CONTENT_COMPACTION_CURSOR_CACHE_KEY = "content_compaction_cursor"
+
+# Celery prefork workers are daemonic so they run yjs operations inline, without the
+# timeout of the yjs executor: tasks processing the content of a document are bounded
+# by time limits instead, the hard limit replacing a worker stuck in native code.
+CONTENT_TASK_SOFT_TIME_LIMIT = settings.YJS_EXECUTOR_TIMEOUT * 3
+CONTENT_TASK_TIME_LIMIT = CONTENT_TASK_SOFT_TIME_LIMIT + 10
+# Compaction runs stop between two documents once their maximum duration is reached.
+# A run stuck on a document is killed by the hard limit and the next run resumes
+# after this document.
+CONTENT_COMPACTION_TIME_LIMIT = (
+    settings.DOCUMENT_CONTENT_COMPACTION_MAX_DURATION + CONTENT_TASK_TIME_LIMIT
+)
+
+
+@app.task
+def flush_document_content(document_id):
+    """Flush the content buffered for a document at the end of the coalescing window."""
+    try:
+        document = models.Document.objects.get(pk=document_id)
+    except models.Document.DoesNotExist:
+        return False
+
+    return document.flush_content()
+
+
+@app.task
+def flush_stale_document_contents():
+    """
+    Flush the content of documents that has been pending for more than twice the
+    coalescing window, in case its scheduled flush was lost. Returns a report with
+    the number of documents flushed and of documents which pending content was lost
+    from the cache.
+    """
+    window = settings.DOCUMENT_CONTENT_COALESCING_WINDOW
+    documents = models.Document.objects.filter(
+        content_pending_since__lt=timezone.now() - timedelta(seconds=window * 2)
+    ).only("id")
+
+    report = {"flushed": 0, "lost": 0}
+    for document in documents.iterator():
+        if document.flush_content():
+            report["flushed"] += 1
+        else:
+            report["lost"] += 1
+            logger.error(
+                "Pending content of document %s was evicted from the cache before "
+                "being written to object storage",
+                document.id,
+            )
+
+    logger.info(
+        "Flushed the stale pending content of %d documents, %d lost",
+        report["flushed"],
+        report["lost"],
+    )
+    return report
+
+
+@app.task(
+    soft_time_limit=CONTENT_TASK_SOFT_TIME_LIMIT, time_limit=CONTENT_TASK_TIME_LIMIT
+)
+def compute_document_content_artifacts(document_id, restore_attachments=False):
+    """
+    Compute the artifacts derived from the content of a document so they are ready
+    when needed, and keep the excerpt, the search vector and the text highlighted in
+    search results of the document up to date with its title and content. If
+    `restore_attachments` is set, media included in the content that are missing from
+    the attachments of the document, like after restoring a previous version, are
+    attached again. Returns the excerpt.
+    """
+    try:
+        document = (
+            models.Document.objects.select_related("creator")
+            .only("id", "title", "excerpt", "attachments", "creator__language")
+            .get(pk=document_id)
+        )
+    except models.Document.DoesNotExist:
+        return None
+
+    excerpt = document.excerpt
+    text = ""
+    if content := document.content:
+        try:
+            artifacts = utils.get_content_artifacts(content, full=True)
+        except ValueError:
+            logger.warning("Could not parse the content of document %s", document_id)
+        else:
+            excerpt = artifacts["excerpt"]
+            text = artifacts["text"]
+            if restore_attachments:
+                restore_document_attachments(document, artifacts["attachments"])
+
+    # Documents are indexed in the language of their creator
+    config = search.get_search_config(
+        document.creator.language if document.creator else None
+    )
+    # Deriving data from the content is not a modification of the document
+    models.Document.objects.filter(pk=document.pk).update(
+        excerpt=excerpt,
+        search_vector=search.get_search_vector(document.title, text, config),
+        search_text=search.get_search_text(text),
+    )
+    return excerpt
+
+
+def restore_document_attachments(document, content_keys):
+    """
+    Attach again to a document the media included in its content that are missing
+    from its attachments. Returns the keys attached again.
+    """
+    attachments = document.attachments or []
+    restored_keys = set(content_keys) - set(attachments)
+    if not restored_keys:
+        return set()
+
+    # Don't overwrite attachments added in the meantime
+    new_attachments = [*attachments, *sorted(restored_keys)]
+    if not models.Document.objects.filter(
+        pk=document.pk, attachments=document.attachments
+    ).update(attachments=new_attachments):
+        return set()
+
+    document.attachments = new_attachments
+    document.sync_attachment_index()
+    return restored_keys
+
+
+def get_compacted_content(document_id, content):
+    """
+    Return the compacted yjs state of a document if it holds the same content and is
+    smaller by at least DOCUMENT_CONTENT_COMPACTION_MIN_SAVING percent, None otherwise.
+    """
+    try:
+        compacted_content = utils.compact_yjs_state(content)
+        is_same_content = utils.base64_yjs_to_xml(
+            compacted_content
+        ) == utils.base64_yjs_to_xml(content) and utils.base64_yjs_to_state_vector(
+            compacted_content
+        ) == utils.base64_yjs_to_state_vector(content)
+    except ValueError:
+        logger.warning("Could not parse the content of document %s", document_id)
+        return None
+
+    if not is_same_content:
+        logger.error("Compacting document %s would alter its content", document_id)
+        return None
+
+    saved = len(content) - len(compacted_content)
+    if saved * 100 < len(content) * settings.DOCUMENT_CONTENT_COMPACTION_MIN_SAVING:
+        return None
+    return compacted_content
+
+
+@app.task(
+    soft_time_limit=CONTENT_TASK_SOFT_TIME_LIMIT, time_limit=CONTENT_TASK_TIME_LIMIT
+)
+def compact_document_content(document_id, dry_run=False):
+    """
+    Replace the yjs state of a document by a compacted state holding the same content
+    if it is materially smaller. The compacted state is saved as a new version of the
+    document, unless the document was modified in the meantime. In dry-run mode,
+    nothing is saved.
+
+    Returns a report with the size of the state before and after compaction, and the
+    number of bytes saved (0 if the compacted state was not saved).
+    """
+    report = {"size": 0, "compacted_size": 0, "saved": 0}
+    try:
+        document = models.Document.objects.only("id").get(pk=document_id)
+    except models.Document.DoesNotExist:
+        return report
+
+    # Content waiting to be flushed is newer than object storage
+    if settings.DOCUMENT_CONTENT_COALESCING_WINDOW and cache.get(
+        document.get_pending_content_cache_key()
+    ):
+        return report
+
+    try:
+        response = document.get_content_response()
+    except ClientError:
+        return report
+    content = response["Body"].read().decode("utf-8")
+    report["size"] = report["compacted_size"] = len(content)
+
+    compacted_content = get_compacted_content(document_id, content)
+    if compacted_content is None:
+        return report
+
+    if not dry_run:
+        # Don't overwrite a version saved while the content was being compacted
+        try:
+            document.write_content(compacted_content, if_match=response["ETag"])
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "PreconditionFailed":
+                raise
+            return report
+        logger.info(
+            "Compacted the content of document %s from %d to %d bytes",
+            document_id,
+            len(content),
+            len(compacted_content),
+        )
+
+    report["compacted_size"] = len(compacted_content)
+    report["saved"] = len(content) - len(compacted_content)
+    return report
+
+
+@app.task(time_limit=CONTENT_COMPACTION_TIME_LIMIT)
+def compact_document_contents(dry_run=False, full=False):
+    """
+    Compact the yjs state of the documents modified since the previous run, or of all
+    documents if `full` is set. Returns a report with the number of documents
+    processed and compacted, the number of bytes saved and whether the run completed.
+
+    Documents are compacted one after the other in the order of their ids and a run
+    stops once DOCUMENT_CONTENT_COMPACTION_MAX_DURATION is reached. The document
+    being compacted is recorded before compacting it so that the next run resumes
+    after it, even if the run was killed while compacting it. Dry runs are not
+    resumed.
+    """
+    cursor = None if dry_run or full else cache.get(CONTENT_COMPACTION_CURSOR_CACHE_KEY)
+    if cursor is None:
+        checkpoint = (
+            None if full else cache.get(CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY)
+        )
+        cursor = {"start": timezone.now(), "checkpoint": checkpoint, "last_id": None}
+    elif cursor["last_id"] is not None:
+        logger.warning(
+            "Resuming the compaction of documents after document %s",
+            cursor["last_id"],
+        )
+
+    documents = models.Document.objects.filter(ancestors_deleted_at__isnull=True)
+    if cursor["checkpoint"] is not None:
+        documents = documents.filter(updated_at__gte=cursor["checkpoint"])
+    if cursor["last_id"] is not None:
+        documents = documents.filter(id__gt=cursor["last_id"])
+
+    deadline = monotonic() + settings.DOCUMENT_CONTENT_COMPACTION_MAX_DURATION
+    report = {
+        "dry_run": dry_run,
+        "documents": 0,
+        "compacted": 0,
+        "saved": 0,
+        "complete": True,
+    }
+    for document_id in documents.order_by("id").values_list("id", flat=True).iterator():
+        if monotonic() > deadline:
+            report["complete"] = False
+            break
+
+        if not dry_run:
+            cursor["last_id"] = str(document_id)
+            cache.set(CONTENT_COMPACTION_CURSOR_CACHE_KEY, cursor, None)
+
+        document_report = compact_document_content(str(document_id), dry_run)
+        report["documents"] += 1
+        report["compacted"] += bool(document_report["saved"])
+        report["saved"] += document_report["saved"]
+
+    if not dry_run and report["complete"]:
+        cache.set(CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY, cursor["start"], None)
+        cache.delete(CONTENT_COMPACTION_CURSOR_CACHE_KEY)
+
+    logger.info(
+        "Compacted %d of %d documents, saving %d bytes%s",
+        report["compacted"],
+        report["documents"],
+        report["saved"],
+        "" if report["complete"] else " (stopped before the end of the run)",
+    )
+    return report
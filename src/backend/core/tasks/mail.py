@@ -22,3 +22,13 @@ def send_ask_for_access_mail(ask_for_access_id):
                 access.user.email,
                 access.user.language or settings.LANGUAGE_CODE,
             )
+
+
+@app.task
+def send_invitation_mails(document_id, sender_id, invitations):
+    """Send invitation emails for the accesses given at once on a document."""
+    document = models.Document.objects.get(id=document_id)
+    sender = models.User.objects.get(id=sender_id)
+
+    for email, role, language in invitations:
+        document.send_invitation_email(email, role, sender, language)
@@ -0,0 +1,142 @@
+"""Prune document versions according to the retention policy using celery task."""
+
+from datetime import timedelta
+from logging import getLogger
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count
+from django.utils import timezone
+
+from core import models
+
+from impress.celery_app import app
+
+logger = getLogger(__name__)
+
+# Maximum number of keys accepted by a single "delete_objects" call
+DELETE_OBJECTS_BATCH_SIZE = 1000
+
+
+def get_versions_to_prune(versions, now):
+    """
+    Select the versions to remove according to the retention policy:
+    - all versions more recent than DOCUMENT_VERSIONS_KEEP_ALL_HOURS are kept,
+    - then the most recent version of each hour is kept during
+      DOCUMENT_VERSIONS_KEEP_HOURLY_DAYS,
+    - then the most recent version of each day is kept.
+
+    `versions` is an iterable of (version_id, last_modified) tuples sorted from the
+    most recent to the oldest. The most recent version is always kept as it is
+    the current version of the document, and it counts as the version kept for its
+    hour or day.
+    """
+    keep_all_limit = now - timedelta(hours=settings.DOCUMENT_VERSIONS_KEEP_ALL_HOURS)
+    hourly_limit = keep_all_limit - timedelta(
+        days=settings.DOCUMENT_VERSIONS_KEEP_HOURLY_DAYS
+    )
+
+    to_prune = []
+    kept_buckets = set()
+    for index, (version_id, last_modified) in enumerate(versions):
+        if last_modified >= keep_all_limit:
+            continue
+
+        if last_modified >= hourly_limit:
+            bucket = last_modified.replace(minute=0, second=0, microsecond=0)
+        else:
+            bucket = last_modified.date()
+
+        if index > 0 and bucket in kept_buckets:
+            to_prune.append(version_id)
+        else:
+            kept_buckets.add(bucket)
+
+    return to_prune
+
+
+def delete_versions(objects):
+    """
+    Delete a batch of versions from object storage then from the version index.
+    `objects` is a list of (document_id, version_id) tuples.
+    """
+    response = default_storage.connection.meta.client.delete_objects(
+        Bucket=default_storage.bucket_name,
+        Delete={
+            "Objects": [
+                {"Key": f"{document_id!s}/file", "VersionId": version_id}
+                for document_id, version_id in objects
+            ],
+            "Quiet": False,
+        },
+    )
+
+    for error in response.get("Errors", []):
+        logger.error(
+            "Could not delete version %s of %s: %s",
+            error.get("VersionId"),
+            error.get("Key"),
+            error.get("Message"),
+        )
+
+    deleted_ids = {item["VersionId"] for item in response.get("Deleted", [])}
+    models.DocumentVersion.objects.filter(
+        document_id__in={document_id for document_id, _version_id in objects},
+        version_id__in=deleted_ids,
+    ).delete()
+
+    return len(deleted_ids)
+
+
+@app.task
+def prune_document_versions(dry_run=False):
+    """
+    Apply the retention policy to the versions of all documents. Deletions are sent
+    to object storage by batches. In dry-run mode, nothing is deleted and the report
+    only tells what would be pruned.
+    """
+    now = timezone.now()
+    keep_all_limit = now - timedelta(hours=settings.DOCUMENT_VERSIONS_KEEP_ALL_HOURS)
+
+    # Only documents with several versions out of the "keep all" window can be pruned
+    document_ids = (
+        models.DocumentVersion.objects.filter(last_modified__lt=keep_all_limit)
+        .values("document_id")
+        .annotate(nb_versions=Count("id"))
+        .filter(nb_versions__gt=1)
+        .values_list("document_id", flat=True)
+    )
+
+    report = {"dry_run": dry_run, "documents": 0, "versions": 0, "deleted": 0}
+    batch = []
+    for document_id in document_ids.iterator():
+        versions = (
+            models.DocumentVersion.objects.filter(document_id=document_id)
+            .order_by("-last_modified", "-id")
+            .values_list("version_id", "last_modified")
+        )
+        to_prune = get_versions_to_prune(versions, now)
+        if not to_prune:
+            continue
+
+        report["documents"] += 1
+        report["versions"] += len(to_prune)
+        if dry_run:
+            continue
+
+        batch.extend((document_id, version_id) for version_id in to_prune)
+        while len(batch) >= DELETE_OBJECTS_BATCH_SIZE:
+            report["deleted"] += delete_versions(batch[:DELETE_OBJECTS_BATCH_SIZE])
+            batch = batch[DELETE_OBJECTS_BATCH_SIZE:]
+
+    if batch:
+        report["deleted"] += delete_versions(batch)
+
+    logger.info(
+        "Pruned document versions%s: %d versions of %d documents selected, %d deleted",
+        " (dry run)" if dry_run else "",
+        report["versions"],
+        report["documents"],
+        report["deleted"],
+    )
+    return report
@@ -0,0 +1,42 @@
+"""
+Unit test for `benchmark_text_extraction` command.
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+
+from core import utils
+from core.management.commands.benchmark_text_extraction import (
+    build_content,
+    serialize_and_parse,
+)
+
+
+def test_benchmark_text_extraction():
+    """The command should time both implementations for each document size."""
+    stdout = StringIO()
+    call_command("benchmark_text_extraction", blocks=[1, 5], repeat=1, stdout=stdout)
+
+    lines = stdout.getvalue().splitlines()
+    assert lines[0].split() == [
+        "blocks",
+        "size",
+        "(kB)",
+        "parse",
+        "(ms)",
+        "walk",
+        "(ms)",
+        "speedup",
+    ]
+    assert [line.split()[0] for line in lines[1:]] == ["1", "5"]
+
+
+def test_benchmark_text_extraction_same_text():
+    """Both implementations should extract the same text from generated documents."""
+    content = build_content(3)
+
+    text = utils.base64_yjs_to_text(content)
+    assert text == serialize_and_parse(content)
+    assert text == utils.get_content_artifacts(content, full=True)["text"]
+    assert text.startswith("Paragraph 0 with some bold words.")
@@ -0,0 +1,50 @@
+"""
+Unit test for `collect_orphan_attachments` command.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from uuid import uuid4
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.utils import timezone
+
+import pytest
+from freezegun import freeze_time
+
+from core import factories, models
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.parametrize(
+    "options,expected_output,expected_count",
+    [
+        (
+            {"dry_run": True},
+            "Would delete 1 attachments (1 objects) and 0 keys from the attachments "
+            "of 1 documents.",
+            1,
+        ),
+        (
+            {"full": True},
+            "Deleted 1 attachments (1 objects) and 0 keys from the attachments "
+            "of 1 documents.",
+            0,
+        ),
+    ],
+)
+def test_collect_orphan_attachments(options, expected_output, expected_count):
+    """The command should delete the orphan attachments and report on it."""
+    document = factories.DocumentFactory()
+    key = f"{document.id!s}/attachments/{uuid4()!s}.png"
+    default_storage.save(key, StringIO("my prose"))
+    factories.AttachmentFactory(key=key, document=document)
+
+    stdout = StringIO()
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        call_command("collect_orphan_attachments", stdout=stdout, **options)
+
+    assert expected_output in stdout.getvalue()
+    assert models.Attachment.objects.filter(key=key).count() == expected_count
@@ -0,0 +1,38 @@
+"""
+Unit test for `compact_document_contents` command.
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+
+import pytest
+
+from core import factories
+from core.tests.test_utils import get_uncompacted_ydoc
+
+pytestmark = pytest.mark.django_db
+
+
+def test_compact_document_contents():
+    """
+    Test that the command `compact_document_contents` compacts the yjs state of
+    documents and reports the bytes saved.
+    """
+    content = get_uncompacted_ydoc()
+    document = factories.DocumentFactory(content=content)
+
+    stdout = StringIO()
+    call_command("compact_document_contents", dry_run=True, stdout=stdout)
+
+    assert document.get_content_response()["Body"].read().decode("utf-8") == content
+    assert "Would compact 1 of 1 documents, saving" in stdout.getvalue()
+
+    stdout = StringIO()
+    call_command("compact_document_contents", stdout=stdout)
+
+    compacted = document.get_content_response()["Body"].read().decode("utf-8")
+    assert (
+        f"Compacted 1 of 1 documents, saving {len(content) - len(compacted):d} bytes."
+        in stdout.getvalue()
+    )
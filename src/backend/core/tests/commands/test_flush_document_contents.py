@@ -0,0 +1,40 @@
+"""
+Unit test for `flush_document_contents` command.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.utils import timezone
+
+import pytest
+from freezegun import freeze_time
+
+from core import factories
+
+pytestmark = pytest.mark.django_db
+
+
+def test_flush_document_contents(settings):
+    """
+    Test that the command `flush_document_contents` writes the content of documents
+    which flush was lost to object storage.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    document = factories.DocumentFactory()
+
+    with (
+        mock.patch("core.tasks.documents.flush_document_content.apply_async"),
+        freeze_time(timezone.now() - timedelta(seconds=30)),
+    ):
+        document.content = "pending content"
+        document.save()
+
+    stdout = StringIO()
+    call_command("flush_document_contents", stdout=stdout)
+
+    assert "Flushed the pending content of 1 documents." in stdout.getvalue()
+    response = document.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "pending content"
@@ -0,0 +1,68 @@
+"""
+Unit test for `index_document_contents` command.
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+
+import pytest
+
+from core import factories, models
+
+pytestmark = pytest.mark.django_db
+
+
+def get_search_vector(document):
+    """Return the search vector of a document as stored in database."""
+    return models.Document.objects.values_list("search_vector", flat=True).get(
+        pk=document.pk
+    )
+
+
+def test_index_document_contents():
+    """
+    Test that the command `index_document_contents` indexes the documents created
+    before full-text search existed, skipping those already indexed unless asked.
+    """
+    document = factories.DocumentFactory(
+        title="Onboarding", excerpt=None, creator__language="en-us"
+    )
+    assert get_search_vector(document) is None
+
+    stdout = StringIO()
+    call_command("index_document_contents", stdout=stdout)
+
+    assert "Indexed 1 documents." in stdout.getvalue()
+    assert get_search_vector(document) == "'hello':2B 'ld':5B 'onboard':1A 'w':3B"
+    assert (
+        models.Document.objects.values_list("search_text", flat=True).get(
+            pk=document.pk
+        )
+        == "Hello w or ld"
+    )
+    document.refresh_from_db()
+    assert document.excerpt == "Hello w or ld"
+
+    stdout = StringIO()
+    call_command("index_document_contents", stdout=stdout)
+    assert "Indexed 0 documents." in stdout.getvalue()
+
+    stdout = StringIO()
+    call_command("index_document_contents", all=True, run_async=True, stdout=stdout)
+    assert "Indexed 1 documents." in stdout.getvalue()
+
+
+def test_index_document_contents_without_text():
+    """Documents indexed before their text was stored should be indexed again."""
+    document = factories.DocumentFactory()
+    call_command("index_document_contents", stdout=StringIO())
+    models.Document.objects.filter(pk=document.pk).update(search_text=None)
+
+    stdout = StringIO()
+    call_command("index_document_contents", stdout=stdout)
+
+    assert "Indexed 1 documents." in stdout.getvalue()
+    assert models.Document.objects.filter(
+        pk=document.pk, search_text__isnull=False
+    ).exists()
@@ -0,0 +1,38 @@
+"""
+Unit test for `index_document_versions` command.
+"""
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+
+import pytest
+
+from core import factories, models
+
+
+@pytest.mark.django_db
+def test_index_document_versions():
+    """
+    Test that the command `index_document_versions` indexes in database the versions
+    of documents that were written to the storage without being indexed.
+    """
+    document = factories.DocumentFactory()
+    # Simulate versions written before the version index existed
+    models.DocumentVersion.objects.all().delete()
+    default_storage.save(document.file_key, ContentFile(b"unindexed"))
+
+    call_command("index_document_versions")
+
+    response = default_storage.connection.meta.client.list_object_versions(
+        Bucket=default_storage.bucket_name, Prefix=document.file_key
+    )
+    assert len(response["Versions"]) == 2
+    assert sorted(v["VersionId"] for v in response["Versions"]) == sorted(
+        document.versions.values_list("version_id", flat=True)
+    )
+    assert 9 in document.versions.values_list("size", flat=True)
+
+    # Running the command again should be a no-op
+    call_command("index_document_versions")
+    assert document.versions.count() == 2
@@ -0,0 +1,37 @@
+"""
+Unit test for `prune_document_versions` command.
+"""
+
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+import pytest
+
+from core import factories
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.parametrize(
+    "options,expected_output,expected_count",
+    [
+        ({"dry_run": True}, "Would delete 2 versions of 1 documents.", 3),
+        ({}, "Deleted 2 versions of 1 documents.", 1),
+    ],
+)
+def test_prune_document_versions(options, expected_output, expected_count):
+    """The command should apply the retention policy and report on it."""
+    document = factories.DocumentFactory()
+    for i in range(2):
+        document.content = f"content {i:d}"
+        document.save()
+    document.versions.update(last_modified=timezone.now() - timedelta(days=60))
+
+    stdout = StringIO()
+    call_command("prune_document_versions", stdout=stdout, **options)
+
+    assert expected_output in stdout.getvalue()
+    assert document.versions.count() == expected_count
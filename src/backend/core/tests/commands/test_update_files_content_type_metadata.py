@@ -3,43 +3,83 @@ Unit test for `update_files_content_type_metadata` command.
 """
 
 import uuid
+from io import StringIO
+from unittest import mock
 
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.management import call_command
 
 import pytest
 
 from core import factories
+from core.management.commands.update_files_content_type_metadata import (
+    CHECKPOINT_CACHE_KEY,
+    fix_content_type,
+)
 
+pytestmark = pytest.mark.django_db
 
-@pytest.mark.django_db
-def test_update_files_content_type_metadata():
+FAKE_PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR..."
+
+
+def create_files(nb_files):
     """
-    Test that the command `update_files_content_type_metadata`
-    fixes the ContentType of attachment in the storage.
+    Create attachments with a wrong ContentType in documents which ids share a
+    prefix, to process them without touching the rest of the bucket.
     """
     s3_client = default_storage.connection.meta.client
-    bucket_name = default_storage.bucket_name
+    prefix = uuid.uuid4().hex[:8]
 
-    # Create files with a wrong ContentType
     keys = []
-    for _ in range(10):
-        doc_id = uuid.uuid4()
+    for _ in range(nb_files):
+        doc_id = uuid.UUID(prefix + uuid.uuid4().hex[8:])
         factories.DocumentFactory(id=doc_id)
         key = f"{doc_id}/attachments/testfile.png"
         keys.append(key)
-        fake_png = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR..."
         s3_client.put_object(
-            Bucket=bucket_name,
+            Bucket=default_storage.bucket_name,
             Key=key,
-            Body=fake_png,
+            Body=FAKE_PNG,
             ContentType="text/plain",
+            ContentDisposition='inline; filename="testfile.png"',
             Metadata={"owner": "None"},
         )
 
+    return prefix, sorted(keys)
+
+
+def get_content_type(key):
+    """Get the ContentType of a file in object storage."""
+    return default_storage.connection.meta.client.head_object(
+        Bucket=default_storage.bucket_name, Key=key
+    )["ContentType"]
+
+
+def test_update_files_content_type_metadata():
+    """
+    Test that the command `update_files_content_type_metadata`
+    fixes the ContentType of attachment in the storage.
+    """
+    s3_client = default_storage.connection.meta.client
+    bucket_name = default_storage.bucket_name
+
+    prefix, keys = create_files(10)
+    attachment = factories.AttachmentFactory(key=keys[0], content_type="text/plain")
+    # Variants of images are not processed
+    variant_key = f"{keys[0]:s}-320w.webp"
+    s3_client.put_object(
+        Bucket=bucket_name, Key=variant_key, Body=FAKE_PNG, ContentType="image/webp"
+    )
+
     # Call the command that fixes the ContentType
-    call_command("update_files_content_type_metadata")
+    stdout = StringIO()
+    call_command(
+        "update_files_content_type_metadata", prefix=prefix, workers=4, stdout=stdout
+    )
 
+    assert "Processed 10 files in" in stdout.getvalue()
+    assert "updated 10, 0 errors." in stdout.getvalue()
     for key in keys:
         head_resp = s3_client.head_object(Bucket=bucket_name, Key=key)
         assert head_resp["ContentType"] == "image/png", (
@@ -48,3 +88,106 @@ def test_update_files_content_type_metadata():
 
         # Check that original metadata was preserved
         assert head_resp["Metadata"].get("owner") == "None"
+        assert head_resp["ContentDisposition"] == 'inline; filename="testfile.png"'
+
+    assert get_content_type(variant_key) == "image/webp"
+    attachment.refresh_from_db()
+    assert attachment.content_type == "image/png"
+    assert cache.get(f"{CHECKPOINT_CACHE_KEY:s}_{prefix:s}") is None
+
+    # Files already having the right ContentType are not copied again
+    stdout = StringIO()
+    call_command("update_files_content_type_metadata", prefix=prefix, stdout=stdout)
+    assert "updated 0, 0 errors." in stdout.getvalue()
+
+
+def test_update_files_content_type_metadata_dry_run():
+    """A dry run should report the files to update without updating them."""
+    prefix, keys = create_files(2)
+    attachment = factories.AttachmentFactory(key=keys[0], content_type="text/plain")
+
+    stdout = StringIO()
+    call_command(
+        "update_files_content_type_metadata", prefix=prefix, dry_run=True, stdout=stdout
+    )
+
+    assert "would update 2, 0 errors." in stdout.getvalue()
+    for key in keys:
+        assert get_content_type(key) == "text/plain"
+    attachment.refresh_from_db()
+    assert attachment.content_type == "text/plain"
+
+
+def test_update_files_content_type_metadata_resume():
+    """
+    The command should resume after the last file processed by an interrupted run,
+    unless asked to restart.
+    """
+    prefix, keys = create_files(3)
+    cache.set(f"{CHECKPOINT_CACHE_KEY:s}_{prefix:s}", keys[1], None)
+
+    stdout = StringIO()
+    call_command("update_files_content_type_metadata", prefix=prefix, stdout=stdout)
+
+    assert f"Resuming after '{keys[1]:s}'" in stdout.getvalue()
+    assert [get_content_type(key) for key in keys] == [
+        "text/plain",
+        "text/plain",
+        "image/png",
+    ]
+
+    cache.set(f"{CHECKPOINT_CACHE_KEY:s}_{prefix:s}", keys[1], None)
+    call_command(
+        "update_files_content_type_metadata",
+        prefix=prefix,
+        restart=True,
+        stdout=StringIO(),
+    )
+
+    assert [get_content_type(key) for key in keys] == ["image/png"] * 3
+
+
+def test_update_files_content_type_metadata_errors():
+    """
+    The progress should not be recorded past files that could not be updated, and
+    their keys should be listed so that running the command again retries them.
+    """
+    prefix, keys = create_files(3)
+    checkpoint_cache_key = f"{CHECKPOINT_CACHE_KEY:s}_{prefix:s}"
+    cache.set(checkpoint_cache_key, keys[0], None)
+
+    def fail_on_last_key(s3_client, mime_detector, key, dry_run=False):
+        if key == keys[2]:
+            return key, None, Exception("unavailable")
+        return fix_content_type(s3_client, mime_detector, key, dry_run)
+
+    stdout, stderr = StringIO(), StringIO()
+    with mock.patch(
+        "core.management.commands.update_files_content_type_metadata.fix_content_type",
+        side_effect=fail_on_last_key,
+    ):
+        call_command(
+            "update_files_content_type_metadata",
+            prefix=prefix,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    assert "updated 1, 1 errors." in stdout.getvalue()
+    assert stderr.getvalue().endswith(
+        f"run the command again to retry them:\n{keys[2]:s}\n"
+    )
+    assert cache.get(checkpoint_cache_key) == keys[0]
+    assert [get_content_type(key) for key in keys] == [
+        "text/plain",
+        "image/png",
+        "text/plain",
+    ]
+
+    stdout = StringIO()
+    call_command("update_files_content_type_metadata", prefix=prefix, stdout=stdout)
+
+    assert f"Resuming after '{keys[0]:s}'" in stdout.getvalue()
+    assert "updated 1, 0 errors." in stdout.getvalue()
+    assert get_content_type(keys[2]) == "image/png"
+    assert cache.get(checkpoint_cache_key) is None
@@ -519,6 +519,80 @@ def test_api_document_accesses_list_authenticated_related_same_team(
     assert [result_dict[str(access.id)] for access in accesses] == results
 
 
+def test_api_document_accesses_list_ancestors_without_accesses():
+    """
+    Roles on ancestors should be computed across documents having no access of
+    their own.
+    """
+    user = factories.UserFactory()
+    other_user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    grand_parent = factories.DocumentFactory()
+    parent = factories.DocumentFactory(parent=grand_parent)
+    document = factories.DocumentFactory(parent=parent)
+
+    factories.UserDocumentAccessFactory(
+        document=grand_parent, user=user, role="administrator"
+    )
+    factories.UserDocumentAccessFactory(
+        document=grand_parent, user=other_user, role="editor"
+    )
+    access = factories.UserDocumentAccessFactory(
+        document=document, user=other_user, role="reader"
+    )
+
+    response = client.get(f"/api/v1.0/documents/{document.id!s}/accesses/")
+
+    assert response.status_code == 200
+    result = next(
+        result for result in response.json() if result["id"] == str(access.id)
+    )
+    assert result["max_ancestors_role"] == "editor"
+    assert result["max_role"] == "editor"
+    assert result["abilities"]["set_role_to"] == ["editor", "administrator"]
+
+
+def test_api_document_accesses_list_paginated(django_assert_num_queries):
+    """
+    Document accesses should be paginated if a page or a page size is requested,
+    roles on ancestors being computed for the accesses on each page.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    parent = factories.DocumentFactory()
+    document = factories.DocumentFactory(parent=parent)
+    factories.UserDocumentAccessFactory(document=parent, user=user, role="owner")
+    factories.UserDocumentAccessFactory.create_batch(2, document=parent)
+    accesses = factories.UserDocumentAccessFactory.create_batch(3, document=document)
+
+    response = client.get(f"/api/v1.0/documents/{document.id!s}/accesses/")
+
+    assert response.status_code == 200
+    assert len(response.json()) == 6
+
+    with django_assert_num_queries(4):
+        response = client.get(
+            f"/api/v1.0/documents/{document.id!s}/accesses/?page=2&page_size=4"
+        )
+
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 6
+    assert content["next"] is None
+    assert content["previous"] is not None
+    assert len(content["results"]) == 2
+    assert {result["id"] for result in content["results"]} <= {
+        str(access.id) for access in accesses
+    }
+    for result in content["results"]:
+        assert result["max_ancestors_role"] is None
+        assert result["max_role"] == result["role"]
+
+
 def test_api_document_accesses_retrieve_anonymous():
     """
     Anonymous users should not be allowed to retrieve a document access.
@@ -0,0 +1,452 @@
+"""
+Test the bulk creation of document accesses and invitations in impress's core app.
+"""
+
+from unittest import mock
+
+from django.core import mail
+
+import pytest
+from rest_framework.test import APIClient
+
+from core import factories, models
+from core.tests.conftest import TEAM, USER, VIA
+from core.tests.test_services_collaboration_services import (  # pylint: disable=unused-import
+    mock_reset_connections,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def test_api_document_accesses_bulk_anonymous():
+    """Anonymous users should not be allowed to share documents in bulk."""
+    document = factories.DocumentFactory()
+    other_user = factories.UserFactory()
+
+    response = APIClient().post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {"accesses": [{"user_id": str(other_user.id), "role": "reader"}]},
+        format="json",
+    )
+
+    assert response.status_code == 401
+    assert models.DocumentAccess.objects.exists() is False
+
+
+@pytest.mark.parametrize("role", ["reader", "editor"])
+@pytest.mark.parametrize("via", VIA)
+def test_api_document_accesses_bulk_reader_or_editor(via, role, mock_user_teams):
+    """Readers or editors of a document should not be allowed to share it in bulk."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    if via == USER:
+        factories.UserDocumentAccessFactory(document=document, user=user, role=role)
+    elif via == TEAM:
+        mock_user_teams.return_value = ["lasuite", "unknown"]
+        factories.TeamDocumentAccessFactory(
+            document=document, team="lasuite", role=role
+        )
+
+    other_user = factories.UserFactory()
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {
+            "accesses": [{"user_id": str(other_user.id), "role": "reader"}],
+            "invitations": [{"email": "guest@example.com", "role": "reader"}],
+        },
+        format="json",
+    )
+
+    assert response.status_code == 403
+    assert not models.DocumentAccess.objects.filter(user=other_user).exists()
+    assert models.Invitation.objects.exists() is False
+
+
+def test_api_document_accesses_bulk_administrator(
+    django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    """
+    Administrators of a document should be able to give accesses to many users and
+    teams and to invite many emails at once, invitation emails being sent after the
+    transaction.
+    """
+    user = factories.UserFactory(language="en-us")
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    factories.UserDocumentAccessFactory(
+        document=document, user=user, role="administrator"
+    )
+    other_users = factories.UserFactory.create_batch(3, language="fr-fr")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        with django_assert_num_queries(12):
+            response = client.post(
+                f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+                {
+                    "accesses": [
+                        {"user_id": str(other_user.id), "role": "editor"}
+                        for other_user in other_users
+                    ]
+                    + [{"team": "lasuite", "role": "reader"}],
+                    "invitations": [
+                        {"email": "guest1@example.com", "role": "reader"},
+                        {"email": "guest2@example.com", "role": "administrator"},
+                    ],
+                },
+                format="json",
+            )
+
+        # Invitation emails are only sent once the transaction is committed
+        assert len(mail.outbox) == 0
+
+    assert response.status_code == 201
+    content = response.json()
+    assert len(content["accesses"]) == 4
+    assert len(content["invitations"]) == 2
+    assert content["skipped"] == {"accesses": [], "invitations": []}
+
+    assert set(
+        models.DocumentAccess.objects.filter(document=document).values_list(
+            "user__email", "team", "role"
+        )
+    ) == {
+        (user.email, "", "administrator"),
+        *[(other_user.email, "", "editor") for other_user in other_users],
+        (None, "lasuite", "reader"),
+    }
+    assert set(
+        models.Invitation.objects.filter(document=document).values_list(
+            "email", "role", "issuer"
+        )
+    ) == {
+        ("guest1@example.com", "reader", user.id),
+        ("guest2@example.com", "administrator", user.id),
+    }
+
+    document.refresh_from_db()
+    assert document.nb_accesses_direct == 5
+
+    assert sorted(email.to[0] for email in mail.outbox) == sorted(
+        [other_user.email for other_user in other_users]
+        + ["guest1@example.com", "guest2@example.com"]
+    )
+    email_content = " ".join(mail.outbox[0].body.split())
+    assert f"{user.full_name} shared a document with you!" in email_content
+
+
+def test_api_document_accesses_bulk_update_roles(mock_reset_connections):  # pylint: disable=redefined-outer-name
+    """
+    Existing accesses and invitations should be updated with the requested roles,
+    connections to the collaboration server being reset once and no email being sent.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    factories.UserDocumentAccessFactory(document=document, user=user, role="owner")
+    accesses = factories.UserDocumentAccessFactory.create_batch(
+        2, document=document, role="reader"
+    )
+    unchanged_access = factories.TeamDocumentAccessFactory(
+        document=document, team="lasuite", role="editor"
+    )
+    invitation = factories.InvitationFactory(document=document, role="reader")
+
+    with mock_reset_connections(document.id):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+            {
+                "accesses": [
+                    {"user_id": str(access.user_id), "role": "editor"}
+                    for access in accesses
+                ]
+                + [{"team": "lasuite", "role": "editor"}],
+                "invitations": [{"email": invitation.email, "role": "owner"}],
+            },
+            format="json",
+        )
+
+    assert response.status_code == 201
+    content = response.json()
+    assert sorted(access["id"] for access in content["accesses"]) == sorted(
+        str(access.id) for access in accesses
+    )
+    assert [invitation["id"] for invitation in content["invitations"]] == [
+        str(invitation.id)
+    ]
+
+    for access in accesses:
+        access.refresh_from_db()
+        assert access.role == "editor"
+    unchanged_access.refresh_from_db()
+    assert unchanged_access.updated_at < accesses[0].updated_at
+    invitation.refresh_from_db()
+    assert invitation.role == "owner"
+    assert len(mail.outbox) == 0
+
+
+def test_api_document_accesses_bulk_concurrent_requests():
+    """
+    Users and emails given an access or invited by a concurrent request, between the
+    lookup of existing accesses and their creation, should be skipped and reported.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+    other_users = factories.UserFactory.create_batch(2)
+    access_bulk_create = models.DocumentAccess.objects.bulk_create
+    invitation_bulk_create = models.Invitation.objects.bulk_create
+
+    def grant_and_bulk_create(accesses, **kwargs):
+        factories.UserDocumentAccessFactory(
+            document=document, user=other_users[0], role="administrator"
+        )
+        return access_bulk_create(accesses, **kwargs)
+
+    def invite_and_bulk_create(invitations, **kwargs):
+        factories.InvitationFactory(
+            document=document, email="guest1@example.com", role="administrator"
+        )
+        return invitation_bulk_create(invitations, **kwargs)
+
+    with (
+        mock.patch.object(
+            models.DocumentAccess.objects,
+            "bulk_create",
+            side_effect=grant_and_bulk_create,
+        ),
+        mock.patch.object(
+            models.Invitation.objects,
+            "bulk_create",
+            side_effect=invite_and_bulk_create,
+        ),
+    ):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+            {
+                "accesses": [
+                    {"user_id": str(other_user.id), "role": "reader"}
+                    for other_user in other_users
+                ],
+                "invitations": [
+                    {"email": "guest1@example.com", "role": "reader"},
+                    {"email": "guest2@example.com", "role": "reader"},
+                ],
+            },
+            format="json",
+        )
+
+    assert response.status_code == 201
+    content = response.json()
+    assert [access["user"]["id"] for access in content["accesses"]] == [
+        str(other_users[1].id)
+    ]
+    assert [invitation["email"] for invitation in content["invitations"]] == [
+        "guest2@example.com"
+    ]
+    assert content["skipped"] == {
+        "accesses": [{"user_id": str(other_users[0].id), "team": ""}],
+        "invitations": [{"email": "guest1@example.com"}],
+    }
+    assert set(
+        models.DocumentAccess.objects.filter(document=document).values_list(
+            "user", "role"
+        )
+    ) == {
+        (user.id, "owner"),
+        (other_users[0].id, "administrator"),
+        (other_users[1].id, "reader"),
+    }
+    assert set(
+        models.Invitation.objects.filter(document=document).values_list("email", "role")
+    ) == {
+        ("guest1@example.com", "administrator"),
+        ("guest2@example.com", "reader"),
+    }
+    assert sorted(email.to[0] for email in mail.outbox) == sorted(
+        [other_users[1].email, "guest2@example.com"]
+    )
+
+
+def test_api_document_accesses_bulk_owner_role_forbidden():
+    """Administrators should not be allowed to give the owner role in bulk."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    factories.UserDocumentAccessFactory(
+        document=document, user=user, role="administrator"
+    )
+    other_user = factories.UserFactory()
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {
+            "accesses": [{"user_id": str(other_user.id), "role": "reader"}],
+            "invitations": [{"email": "guest@example.com", "role": "owner"}],
+        },
+        format="json",
+    )
+
+    assert response.status_code == 403
+    assert response.json() == {
+        "detail": "Only owners of a document can assign other users as owners."
+    }
+    assert not models.DocumentAccess.objects.filter(user=other_user).exists()
+    assert models.Invitation.objects.exists() is False
+
+
+def test_api_document_accesses_bulk_update_owner_forbidden():
+    """
+    Administrators should not be allowed to change the role of an owner in bulk,
+    nothing being written if any of the changes is forbidden.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    factories.UserDocumentAccessFactory(
+        document=document, user=user, role="administrator"
+    )
+    owner_access = factories.UserDocumentAccessFactory(document=document, role="owner")
+    other_user = factories.UserFactory()
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {
+            "accesses": [
+                {"user_id": str(other_user.id), "role": "reader"},
+                {"user_id": str(owner_access.user_id), "role": "reader"},
+            ]
+        },
+        format="json",
+    )
+
+    assert response.status_code == 403
+    owner_access.refresh_from_db()
+    assert owner_access.role == "owner"
+    assert not models.DocumentAccess.objects.filter(user=other_user).exists()
+
+
+@pytest.mark.parametrize(
+    "data,errors",
+    [
+        (
+            {},
+            {
+                "non_field_errors": [
+                    "At least one access or invitation must be provided."
+                ]
+            },
+        ),
+        (
+            {"accesses": [{"role": "reader"}]},
+            {
+                "accesses": [
+                    {"non_field_errors": ["Either user or team must be set, not both."]}
+                ]
+            },
+        ),
+        (
+            {"accesses": [{"team": "lasuite", "role": "reader"}] * 2},
+            {"accesses": ["Each user or team must be targeted only once."]},
+        ),
+        (
+            {"invitations": [{"email": "guest@example.com", "role": "reader"}] * 2},
+            {"invitations": ["Each email must be invited only once."]},
+        ),
+        (
+            {"invitations": [{"email": "guest@example.com", "role": "unknown"}]},
+            {"invitations": [{"role": ['"unknown" is not a valid choice.']}]},
+        ),
+    ],
+)
+def test_api_document_accesses_bulk_invalid(data, errors):
+    """Invalid requests should be rejected without writing anything."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/", data, format="json"
+    )
+
+    assert response.status_code == 400
+    assert response.json() == errors
+    assert models.DocumentAccess.objects.count() == 1
+    assert models.Invitation.objects.exists() is False
+
+
+def test_api_document_accesses_bulk_unknown_or_registered_users(settings):
+    """
+    Unknown users should be rejected, as well as invitations for emails of registered
+    users unless duplicate emails are allowed.
+    """
+    settings.OIDC_ALLOW_DUPLICATE_EMAILS = False
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+    other_user = factories.UserFactory()
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {"accesses": [{"user_id": str(document.id), "role": "reader"}]},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"accesses": [f"Unknown users: {document.id!s}."]}
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {"invitations": [{"email": other_user.email, "role": "reader"}]},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "invitations": ["This email is already associated to a registered user."]
+    }
+    assert models.Invitation.objects.exists() is False
+
+
+def test_api_document_accesses_bulk_max_size(settings):
+    """The number of accesses and invitations given at once should be limited."""
+    settings.DOCUMENT_ACCESSES_BULK_MAX_SIZE = 2
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/accesses/bulk/",
+        {
+            "accesses": [{"team": "lasuite", "role": "reader"}],
+            "invitations": [
+                {"email": "guest1@example.com", "role": "reader"},
+                {"email": "guest2@example.com", "role": "reader"},
+            ],
+        },
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "non_field_errors": ["No more than 2 accesses and invitations at once."]
+    }
+    assert models.DocumentAccess.objects.count() == 1
@@ -4,12 +4,20 @@ Test document versions API endpoints for users in impress's core app.
 
 import random
 import time
+from unittest import mock
+from uuid import uuid4
 
 import pytest
 from rest_framework.test import APIClient
 
 from core import factories, models
 from core.tests.conftest import TEAM, USER, VIA
+from core.tests.documents.test_api_documents_update_extract_attachments import (
+    get_ydoc_with_mages,
+)
+from core.tests.test_services_collaboration_services import (  # pylint: disable=unused-import
+    mock_reset_connections,
+)
 
 pytestmark = pytest.mark.django_db
 
@@ -731,3 +739,183 @@ def test_api_document_versions_delete_administrator_or_owner(via, mock_user_team
 
     versions = document.get_versions_slice()["versions"]
     assert len(versions) == 1
+
+
+def test_api_document_versions_restore_anonymous():
+    """Anonymous users should not be allowed to restore a document version."""
+    document = factories.DocumentFactory(link_reach="public", link_role="editor")
+    document.content = "new content"
+    document.save()
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+
+    response = APIClient().post(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/restore/",
+    )
+
+    assert response.status_code == 401
+    assert document.versions.count() == 2
+
+
+@pytest.mark.parametrize("via", VIA)
+def test_api_document_versions_restore_reader(via, mock_user_teams):
+    """
+    Authenticated users should not be allowed to restore a version of a document
+    in which they are a simple reader, even if the link gives them the editor role.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(link_reach="public", link_role="editor")
+    if via == USER:
+        factories.UserDocumentAccessFactory(document=document, user=user, role="reader")
+    elif via == TEAM:
+        mock_user_teams.return_value = ["lasuite", "unknown"]
+        factories.TeamDocumentAccessFactory(
+            document=document, team="lasuite", role="reader"
+        )
+
+    document.content = "new content"
+    document.save()
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/restore/",
+    )
+
+    assert response.status_code == 403
+    assert document.versions.count() == 2
+
+
+@pytest.mark.parametrize("role", ["editor", "administrator", "owner"])
+@pytest.mark.parametrize("via", VIA)
+def test_api_document_versions_restore_success(
+    via,
+    role,
+    mock_user_teams,
+    mock_reset_connections,  # pylint: disable=redefined-outer-name
+):
+    """
+    Users who are editor, administrator or owner of a document should be able to
+    restore a version they have access to. The version is copied as a new version,
+    and connected users are reset.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    if via == USER:
+        factories.UserDocumentAccessFactory(document=document, user=user, role=role)
+    elif via == TEAM:
+        mock_user_teams.return_value = ["lasuite", "unknown"]
+        factories.TeamDocumentAccessFactory(
+            document=document, team="lasuite", role=role
+        )
+
+    document.content = "old content"
+    document.save()
+    document.content = "new content"
+    document.save()
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+
+    with mock_reset_connections(document.id):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/restore/",
+        )
+
+    assert response.status_code == 201
+    new_version = document.versions.first()
+    assert response.json() == {
+        "id": new_version.version_id,
+        "last_modified": new_version.last_modified.isoformat().replace("+00:00", "Z"),
+    }
+    assert new_version.author == user
+
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.content == "old content"
+    assert document.versions.count() == 4
+
+
+def test_api_document_versions_restore_attachments(
+    django_capture_on_commit_callbacks,
+    mock_reset_connections,  # pylint: disable=redefined-outer-name
+):
+    """
+    Media included in the restored version should be attached again to the document
+    if they were removed from its attachments since. The content is not loaded by the
+    request: the attachments are restored by the content artifacts task.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    key = f"{uuid4()!s}/attachments/{uuid4()!s}.png"
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    document.content = get_ydoc_with_mages([key])
+    document.attachments = [key]
+    document.save()
+    document.content = get_ydoc_with_mages([])
+    document.attachments = []
+    document.save()
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+
+    with (
+        mock_reset_connections(document.id),
+        mock.patch("core.utils.get_content_artifacts") as mock_artifacts,
+        django_capture_on_commit_callbacks() as callbacks,
+    ):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/restore/",
+        )
+        mock_artifacts.assert_not_called()
+
+    assert response.status_code == 201
+    document.refresh_from_db()
+    assert document.attachments == []
+
+    for callback in callbacks:
+        callback()
+
+    document.refresh_from_db()
+    assert document.attachments == [key]
+    assert list(document.attachment_links.values_list("key", flat=True)) == [key]
+
+
+@pytest.mark.parametrize("via", VIA)
+def test_api_document_versions_restore_before_access(via, mock_user_teams):
+    """
+    Users should not be allowed to restore versions created before they were
+    given access to the document, or versions that do not exist.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    document.content = "old content"
+    document.save()
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+
+    if via == USER:
+        factories.UserDocumentAccessFactory(document=document, user=user, role="owner")
+    elif via == TEAM:
+        mock_user_teams.return_value = ["lasuite", "unknown"]
+        factories.TeamDocumentAccessFactory(
+            document=document, team="lasuite", role="owner"
+        )
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/restore/",
+    )
+    assert response.status_code == 404
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/versions/unknown/restore/",
+    )
+    assert response.status_code == 404
+    assert document.versions.count() == 2
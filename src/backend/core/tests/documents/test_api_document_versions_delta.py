@@ -0,0 +1,256 @@
+"""
+Test document version delta API endpoint for users in impress's core app.
+"""
+
+from base64 import b64decode, b64encode
+from unittest import mock
+
+from django.core.cache import cache
+
+import pycrdt
+import pytest
+from rest_framework.test import APIClient
+
+from core import factories, models
+from core.services.yjs_services import YjsContentTooLargeError, YjsTimeoutError
+from core.tests.conftest import TEAM, USER, VIA
+from core.utils import base64_yjs_to_state_vector
+
+pytestmark = pytest.mark.django_db
+
+
+def _yjs_content(text):
+    """Build a base64 yjs document containing the given text."""
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = pycrdt.Text(text)
+    return ydoc
+
+
+@pytest.mark.parametrize("via", VIA)
+def test_api_document_versions_delta_from_version(via, mock_user_teams):
+    """
+    Users related to a document should be able to get the yjs update between two
+    versions. The delta should be computed once and then served from the cache.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory()
+    if via == USER:
+        factories.UserDocumentAccessFactory(document=document, user=user)
+    elif via == TEAM:
+        mock_user_teams.return_value = ["lasuite", "unknown"]
+        factories.TeamDocumentAccessFactory(document=document, team="lasuite")
+
+    ydoc = _yjs_content("Hello")
+    document.content = b64encode(ydoc.get_update()).decode("utf-8")
+    document.save()
+    ydoc["document-store"] += " world"
+    document.content = b64encode(ydoc.get_update()).decode("utf-8")
+    document.save()
+    document.content = "current"
+    document.save()
+
+    versions = document.get_versions_slice()["versions"]
+    version_id, from_version_id = versions[0]["version_id"], versions[1]["version_id"]
+    url = (
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/"
+        f"?from_version_id={from_version_id:s}"
+    )
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    content = response.json()
+    assert content["id"] == version_id
+    assert content["from_version_id"] == from_version_id
+    previous_doc = pycrdt.Doc()
+    previous_doc.apply_update(
+        b64decode(document.get_content_response(from_version_id)["Body"].read())
+    )
+    previous_doc.apply_update(b64decode(content["update"]))
+    assert str(previous_doc.get("document-store", type=pycrdt.Text)) == "Hello world"
+
+    with mock.patch.object(models.Document, "get_content_response") as mock_content:
+        assert client.get(url).json() == content
+    mock_content.assert_not_called()
+
+
+def test_api_document_versions_delta_from_state_vector():
+    """Users should be able to get the delta of a version from a state vector."""
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    client_doc = _yjs_content("Hello")
+    ydoc = pycrdt.Doc()
+    ydoc.apply_update(client_doc.get_update())
+    ydoc.get("document-store", type=pycrdt.Text).insert(5, " world")
+    document.content = b64encode(ydoc.get_update()).decode("utf-8")
+    document.save()
+    document.content = "current"
+    document.save()
+
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/",
+        {"state_vector": b64encode(client_doc.get_state()).decode("utf-8")},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["from_version_id"] is None
+    update = b64decode(response.json()["update"])
+    assert len(update) < len(ydoc.get_update())
+    client_doc.apply_update(update)
+    assert str(client_doc.get("document-store", type=pycrdt.Text)) == "Hello world"
+
+
+@pytest.mark.parametrize(
+    "params,error",
+    [
+        (
+            {},
+            {
+                "non_field_errors": [
+                    "Either a version id or a state vector must be provided."
+                ]
+            },
+        ),
+        (
+            {"state_vector": "not base64!"},
+            {"state_vector": ["Invalid base64 content."]},
+        ),
+        ({"state_vector": "//8="}, {"state_vector": ["Invalid state vector."]}),
+    ],
+)
+def test_api_document_versions_delta_invalid(params, error):
+    """The base state of the delta should be validated."""
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    document.content = b64encode(_yjs_content("Hello").get_update()).decode("utf-8")
+    document.save()
+    document.content = "current"
+    document.save()
+
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/", params
+    )
+
+    assert response.status_code == 400
+    assert response.json() == error
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        None,
+        YjsContentTooLargeError("too large"),
+        YjsTimeoutError("too slow"),
+        # Pycrdt panics raise exceptions not deriving from Exception
+        BaseException("panicked"),
+    ],
+)
+def test_api_document_versions_delta_from_version_unprocessable(error):
+    """
+    A delta from a version which content is corrupt, or too large or too slow to
+    process, should be rejected instead of failing, and nothing should be cached.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    document.content = "//8="
+    document.save()
+    document.content = b64encode(_yjs_content("Hello").get_update()).decode("utf-8")
+    document.save()
+    document.content = "current"
+    document.save()
+
+    versions = document.get_versions_slice()["versions"]
+    version_id, from_version_id = versions[0]["version_id"], versions[1]["version_id"]
+    url = (
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/"
+        f"?from_version_id={from_version_id:s}"
+    )
+
+    with mock.patch(
+        "core.utils.base64_yjs_to_state_vector",
+        side_effect=error or base64_yjs_to_state_vector,
+    ):
+        response = client.get(url)
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "from_version_id": ["The delta from this version could not be computed."]
+    }
+    cache_key = (
+        f"document_{document.id!s}_version_delta_{from_version_id:s}_{version_id:s}"
+    )
+    assert cache.get(cache_key) is None
+
+
+def test_api_document_versions_delta_from_newer_version():
+    """
+    A delta from a version newer than the version requested should be rejected as a
+    yjs update can not bring a document back to an older state.
+    """
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    ydoc = _yjs_content("Hello")
+    document.content = b64encode(ydoc.get_update()).decode("utf-8")
+    document.save()
+    ydoc["document-store"] += " world"
+    document.content = b64encode(ydoc.get_update()).decode("utf-8")
+    document.save()
+    document.content = "current"
+    document.save()
+
+    versions = document.get_versions_slice()["versions"]
+    from_version_id, version_id = versions[0]["version_id"], versions[1]["version_id"]
+
+    with mock.patch.object(models.Document, "get_content_response") as mock_content:
+        response = client.get(
+            f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/",
+            {"from_version_id": from_version_id},
+        )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "from_version_id": ["This version is newer than the version requested."]
+    }
+    mock_content.assert_not_called()
+
+
+def test_api_document_versions_delta_unrelated():
+    """Users without a direct access should not be allowed to get version deltas."""
+    user = factories.UserFactory()
+
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(link_reach="public", link_role="editor")
+    document.content = "new content"
+    document.save()
+
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/versions/{version_id:s}/delta/",
+        {"state_vector": "AA=="},
+    )
+
+    assert response.status_code == 403
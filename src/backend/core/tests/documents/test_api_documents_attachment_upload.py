@@ -2,6 +2,7 @@
 Test file uploads API endpoint for users in impress's core app.
 """
 
+import hashlib
 import re
 import uuid
 from unittest import mock
@@ -13,7 +14,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 import pytest
 from rest_framework.test import APIClient
 
-from core import factories
+from core import factories, models
 from core.api.viewsets import malware_detection
 from core.tests.conftest import TEAM, USER, VIA
 
@@ -259,6 +260,15 @@ def test_api_documents_attachment_upload_success(via, role, mock_user_teams):
     assert file_head["ContentType"] == "image/png"
     assert file_head["ContentDisposition"] == 'inline; filename="test.png"'
 
+    # The attachment should be registered with its metadata
+    attachment = models.Attachment.objects.get(key=key)
+    assert attachment.document == document
+    assert attachment.size == len(PIXEL)
+    assert attachment.content_type == "image/png"
+    assert attachment.status == "processing"
+    assert attachment.digest == hashlib.sha256(PIXEL).hexdigest()
+    assert attachment.file_name == "test.png"
+
 
 def test_api_documents_attachment_upload_invalid(client):
     """Attempt to upload without a file should return an explicit error."""
@@ -492,3 +502,115 @@ def test_api_documents_attachment_upload_unsafe_mime_types_disabled(settings):
         "application/octet-stream",
     ]
     assert file_head["ContentDisposition"] == 'attachment; filename="script.exe"'
+
+
+def test_api_documents_attachment_upload_identical_file():
+    """
+    A file identical to a file already uploaded should not be stored or scanned again:
+    the key of the existing file should be included in the document.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document, other_document = factories.DocumentFactory.create_batch(
+        2, users=[(user, "editor")]
+    )
+
+    with mock.patch.object(malware_detection, "analyse_file") as mock_analyse_file:
+        response = client.post(
+            f"/api/v1.0/documents/{other_document.id!s}/attachment-upload/",
+            {
+                "file": SimpleUploadedFile(
+                    name="logo.png", content=PIXEL, content_type="image/png"
+                )
+            },
+            format="multipart",
+        )
+        assert response.status_code == 201
+        key = parse_qs(urlparse(response.json()["file"]).query)["key"][0]
+        mock_analyse_file.reset_mock()
+
+        for _i in range(2):
+            response = client.post(
+                f"/api/v1.0/documents/{document.id!s}/attachment-upload/",
+                {
+                    "file": SimpleUploadedFile(
+                        name="logo.png", content=PIXEL, content_type="image/png"
+                    )
+                },
+                format="multipart",
+            )
+
+            assert response.status_code == 201
+            url_parsed = urlparse(response.json()["file"])
+            assert (
+                url_parsed.path == f"/api/v1.0/documents/{document.id!s}/media-check/"
+            )
+            assert parse_qs(url_parsed.query)["key"][0] == key
+
+    mock_analyse_file.assert_not_called()
+    assert models.Attachment.objects.count() == 1
+    document.refresh_from_db()
+    assert document.attachments == [key]
+    assert models.DocumentAttachment.objects.filter(key=key).count() == 2
+
+
+def test_api_documents_attachment_upload_identical_file_other_name():
+    """
+    A file identical to a file already uploaded under another name should be stored
+    again, each file being served with its own name.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+    url = f"/api/v1.0/documents/{document.id!s}/attachment-upload/"
+
+    keys = []
+    with mock.patch.object(malware_detection, "analyse_file") as mock_analyse_file:
+        for name in ["test.png", "logo.png"]:
+            response = client.post(
+                url,
+                {
+                    "file": SimpleUploadedFile(
+                        name=name, content=PIXEL, content_type="image/png"
+                    )
+                },
+                format="multipart",
+            )
+            assert response.status_code == 201
+            keys.append(parse_qs(urlparse(response.json()["file"]).query)["key"][0])
+
+    assert mock_analyse_file.call_count == 2
+    assert keys[0] != keys[1]
+    for key, name in zip(keys, ["test.png", "logo.png"], strict=True):
+        file_head = default_storage.connection.meta.client.head_object(
+            Bucket=default_storage.bucket_name, Key=key
+        )
+        assert file_head["ContentDisposition"] == f'inline; filename="{name:s}"'
+        assert models.Attachment.objects.get(key=key).file_name == name
+
+
+def test_api_documents_attachment_upload_identical_file_unsafe():
+    """Unsafe files should always be stored and scanned."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "owner")])
+    url = f"/api/v1.0/documents/{document.id!s}/attachment-upload/"
+
+    with mock.patch.object(malware_detection, "analyse_file") as mock_analyse_file:
+        for _i in range(2):
+            response = client.post(
+                url,
+                {"file": SimpleUploadedFile(name="test.txt", content=PIXEL)},
+                format="multipart",
+            )
+            assert response.status_code == 201
+
+    assert mock_analyse_file.call_count == 2
+    document.refresh_from_db()
+    assert len(document.attachments) == 2
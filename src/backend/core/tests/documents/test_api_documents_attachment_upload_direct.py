@@ -0,0 +1,393 @@
+"""
+Test direct uploads of attachments to object storage in impress's core app.
+"""
+
+import hashlib
+import re
+from io import BytesIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+import pytest
+import requests
+from rest_framework.test import APIClient
+
+from core import factories, models
+from core.api.viewsets import malware_detection
+from core.tests.documents.test_api_documents_attachment_upload import PIXEL
+
+pytestmark = pytest.mark.django_db
+
+
+def upload_to_slot(slot, content):
+    """Upload a file to object storage as a client would do with a presigned POST."""
+    upload = slot["upload"]
+    response = requests.post(
+        upload["url"],
+        data=upload["fields"],
+        files={"file": ("file", BytesIO(content))},
+        timeout=5,
+    )
+    return response.status_code
+
+
+def get_key(response):
+    """Extract the key of the attachment from the media check url returned."""
+    return parse_qs(urlparse(response.json()["file"]).query)["key"][0]
+
+
+@pytest.mark.parametrize("action", ["slot", "confirm"])
+def test_api_documents_attachment_upload_direct_anonymous_forbidden(action):
+    """
+    Anonymous users should not be able to upload attachments to a document on which
+    they can't upload attachments.
+    """
+    document = factories.DocumentFactory(link_reach="public", link_role="reader")
+
+    response = APIClient().post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-{action:s}/",
+        {"key": f"{document.id!s}/attachments/file.png"},
+        format="json",
+    )
+
+    assert response.status_code == 401
+
+
+def test_api_documents_attachment_upload_direct_reader():
+    """Readers of a document should not be able to reserve an upload slot."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(
+        link_reach="restricted", users=[(user, "reader")]
+    )
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(PIXEL), "content_type": "image/png"},
+        format="json",
+    )
+
+    assert response.status_code == 403
+
+
+def test_api_documents_attachment_upload_direct_success():
+    """
+    Editors should be able to upload an attachment directly to object storage with a
+    presigned POST then confirm it to register it and trigger its analysis.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(PIXEL), "content_type": "image/png"},
+        format="json",
+    )
+
+    assert response.status_code == 201
+    slot = response.json()
+    assert re.match(rf"^{document.id!s}/attachments/[0-9a-f-]{{36}}\.png$", slot["key"])
+    assert upload_to_slot(slot, PIXEL) == 204
+
+    with mock.patch.object(malware_detection, "analyse_file") as mock_analyse_file:
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+            {"key": slot["key"]},
+            format="json",
+        )
+
+    assert response.status_code == 201
+    key = get_key(response)
+    assert key == slot["key"]
+    mock_analyse_file.assert_called_once_with(key, document_id=document.id)
+
+    document.refresh_from_db()
+    assert document.attachments == [key]
+
+    attachment = models.Attachment.objects.get(key=key)
+    assert attachment.document == document
+    assert attachment.size == len(PIXEL)
+    assert attachment.content_type == "image/png"
+    assert attachment.status == "processing"
+    # The digest is computed in the background for identical files to reuse it
+    assert attachment.digest == hashlib.sha256(PIXEL).hexdigest()
+
+    file_head = default_storage.connection.meta.client.head_object(
+        Bucket=default_storage.bucket_name, Key=key
+    )
+    assert file_head["Metadata"] == {"owner": str(user.id), "status": "processing"}
+    assert file_head["ContentType"] == "image/png"
+    assert file_head["ContentDisposition"] == 'inline; filename="test.png"'
+
+    # The slot can only be confirmed once
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+        {"key": slot["key"]},
+        format="json",
+    )
+    assert response.status_code == 400
+    assert response.json() == {"key": ["Unknown or expired upload slot."]}
+
+
+def test_api_documents_attachment_upload_direct_multipart(settings):
+    """Files larger than one part should be uploaded in several parts."""
+    settings.DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE = 5 * (2**20)
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    content = PIXEL + b"\x00" * (6 * (2**20))
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(content), "content_type": "image/png"},
+        format="json",
+    )
+
+    assert response.status_code == 201
+    slot = response.json()
+    assert slot["part_size"] == 5 * (2**20)
+    assert [part["part_number"] for part in slot["parts"]] == [1, 2]
+
+    parts = []
+    for part in slot["parts"]:
+        offset = (part["part_number"] - 1) * slot["part_size"]
+        part_response = requests.put(
+            part["url"], data=content[offset : offset + slot["part_size"]], timeout=5
+        )
+        assert part_response.status_code == 200
+        parts.append(
+            {"part_number": part["part_number"], "etag": part_response.headers["ETag"]}
+        )
+
+    # Parts acknowledged by object storage are required to complete the upload
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+        {"key": slot["key"]},
+        format="json",
+    )
+    assert response.status_code == 400
+    assert response.json() == {
+        "parts": ["This field is required for multipart uploads."]
+    }
+
+    with mock.patch.object(malware_detection, "analyse_file"):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+            {"key": slot["key"], "parts": parts},
+            format="json",
+        )
+
+    assert response.status_code == 201
+    attachment = models.Attachment.objects.get(key=get_key(response))
+    assert attachment.size == len(content)
+    assert attachment.content_type == "image/png"
+
+
+def test_api_documents_attachment_upload_direct_unsafe():
+    """
+    A file which content does not match its announced type should be moved to a key
+    tagging it as unsafe, with the extension and headers of its actual content.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.txt", "size": len(PIXEL), "content_type": "text/plain"},
+        format="json",
+    )
+    assert response.status_code == 201
+    slot = response.json()
+    assert upload_to_slot(slot, PIXEL) == 204
+
+    with mock.patch.object(malware_detection, "analyse_file"):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+            {"key": slot["key"]},
+            format="json",
+        )
+
+    assert response.status_code == 201
+    key = get_key(response)
+    assert key == slot["key"].replace(".txt", "-unsafe.png")
+    assert not default_storage.exists(slot["key"])
+
+    document.refresh_from_db()
+    assert document.attachments == [key]
+
+    file_head = default_storage.connection.meta.client.head_object(
+        Bucket=default_storage.bucket_name, Key=key
+    )
+    assert file_head["Metadata"] == {
+        "owner": str(user.id),
+        "is_unsafe": "true",
+        "status": "processing",
+    }
+    assert file_head["ContentType"] == "image/png"
+    assert file_head["ContentDisposition"] == 'attachment; filename="test.txt"'
+
+
+def test_api_documents_attachment_upload_direct_other_content_type(settings):
+    """
+    A file which content does not match its announced type should be moved to a key
+    with the extension of its actual content, even if unsafe files are not checked.
+    """
+    settings.DOCUMENT_ATTACHMENT_CHECK_UNSAFE_MIME_TYPES_ENABLED = False
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "photo.jpg", "size": len(PIXEL), "content_type": "image/jpeg"},
+        format="json",
+    )
+    assert response.status_code == 201
+    slot = response.json()
+    assert upload_to_slot(slot, PIXEL) == 204
+
+    with mock.patch.object(malware_detection, "analyse_file"):
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+            {"key": slot["key"]},
+            format="json",
+        )
+
+    assert response.status_code == 201
+    key = get_key(response)
+    assert key == slot["key"].replace(".jpg", ".png")
+    assert not default_storage.exists(slot["key"])
+
+    document.refresh_from_db()
+    assert document.attachments == [key]
+    assert models.Attachment.objects.get(key=key).content_type == "image/png"
+
+    file_head = default_storage.connection.meta.client.head_object(
+        Bucket=default_storage.bucket_name, Key=key
+    )
+    assert file_head["ContentType"] == "image/png"
+    assert file_head["ContentDisposition"] == 'inline; filename="photo.jpg"'
+
+
+def test_api_documents_attachment_upload_direct_size_limit_exceeded(settings):
+    """Upload slots should not be given for files exceeding the maximum size."""
+    settings.DOCUMENT_IMAGE_MAX_SIZE = 1048576  # 1 MB for test
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": 1048577, "content_type": "image/png"},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"size": ["File size exceeds the maximum limit of 1 MB."]}
+
+
+def test_api_documents_attachment_upload_direct_slot_other_document():
+    """A slot reserved on a document should not be confirmed on another document."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document, other_document = factories.DocumentFactory.create_batch(
+        2, users=[(user, "editor")]
+    )
+
+    response = client.post(
+        f"/api/v1.0/documents/{other_document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(PIXEL), "content_type": "image/png"},
+        format="json",
+    )
+    slot = response.json()
+    assert upload_to_slot(slot, PIXEL) == 204
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+        {"key": slot["key"]},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"key": ["Unknown or expired upload slot."]}
+    assert cache.get(f"attachment_upload_slot_{slot['key']:s}") is not None
+
+
+def test_api_documents_attachment_upload_direct_slot_other_user():
+    """A slot reserved by a user should not be confirmed by another user."""
+    user, other_user = factories.UserFactory.create_batch(2)
+    document = factories.DocumentFactory(
+        users=[(user, "editor"), (other_user, "editor")]
+    )
+
+    client = APIClient()
+    client.force_login(user)
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(PIXEL), "content_type": "image/png"},
+        format="json",
+    )
+    slot = response.json()
+    assert upload_to_slot(slot, PIXEL) == 204
+
+    client.force_login(other_user)
+    with mock.patch.object(malware_detection, "analyse_file") as mock_analyse_file:
+        response = client.post(
+            f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+            {"key": slot["key"]},
+            format="json",
+        )
+
+    assert response.status_code == 403
+    assert response.json() == {
+        "detail": "Only the user who reserved this upload slot can confirm it."
+    }
+    mock_analyse_file.assert_not_called()
+    assert models.Attachment.objects.exists() is False
+    assert cache.get(f"attachment_upload_slot_{slot['key']:s}") is not None
+
+
+def test_api_documents_attachment_upload_direct_not_uploaded():
+    """Confirming a slot in which no file was uploaded should fail."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-slot/",
+        {"file_name": "test.png", "size": len(PIXEL), "content_type": "image/png"},
+        format="json",
+    )
+    slot = response.json()
+
+    response = client.post(
+        f"/api/v1.0/documents/{document.id!s}/attachment-upload-confirm/",
+        {"key": slot["key"]},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"key": ["The file was not uploaded."]}
+    document.refresh_from_db()
+    assert document.attachments == []
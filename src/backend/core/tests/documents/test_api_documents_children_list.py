@@ -22,9 +22,9 @@ def test_api_documents_children_list_anonymous_public_standalone(
     child1, child2 = factories.DocumentFactory.create_batch(2, parent=document)
     factories.UserDocumentAccessFactory(document=child1)
 
-    with django_assert_num_queries(8):
+    with django_assert_num_queries(5):
         APIClient().get(f"/api/v1.0/documents/{document.id!s}/children/")
-    with django_assert_num_queries(4):
+    with django_assert_num_queries(5):
         response = APIClient().get(f"/api/v1.0/documents/{document.id!s}/children/")
 
     assert response.status_code == 200
@@ -96,9 +96,9 @@ def test_api_documents_children_list_anonymous_public_parent(django_assert_num_q
     child1, child2 = factories.DocumentFactory.create_batch(2, parent=document)
     factories.UserDocumentAccessFactory(document=child1)
 
-    with django_assert_num_queries(9):
+    with django_assert_num_queries(6):
         APIClient().get(f"/api/v1.0/documents/{document.id!s}/children/")
-    with django_assert_num_queries(5):
+    with django_assert_num_queries(6):
         response = APIClient().get(f"/api/v1.0/documents/{document.id!s}/children/")
 
     assert response.status_code == 200
@@ -187,9 +187,9 @@ def test_api_documents_children_list_authenticated_unrelated_public_or_authentic
     child1, child2 = factories.DocumentFactory.create_batch(2, parent=document)
     factories.UserDocumentAccessFactory(document=child1)
 
-    with django_assert_num_queries(9):
+    with django_assert_num_queries(6):
         client.get(f"/api/v1.0/documents/{document.id!s}/children/")
-    with django_assert_num_queries(5):
+    with django_assert_num_queries(6):
         response = client.get(
             f"/api/v1.0/documents/{document.id!s}/children/",
         )
@@ -267,10 +267,10 @@ def test_api_documents_children_list_authenticated_public_or_authenticated_paren
     child1, child2 = factories.DocumentFactory.create_batch(2, parent=document)
     factories.UserDocumentAccessFactory(document=child1)
 
-    with django_assert_num_queries(10):
+    with django_assert_num_queries(7):
         client.get(f"/api/v1.0/documents/{document.id!s}/children/")
 
-    with django_assert_num_queries(6):
+    with django_assert_num_queries(7):
         response = client.get(f"/api/v1.0/documents/{document.id!s}/children/")
 
     assert response.status_code == 200
@@ -373,7 +373,7 @@ def test_api_documents_children_list_authenticated_related_direct(
     child1, child2 = factories.DocumentFactory.create_batch(2, parent=document)
     factories.UserDocumentAccessFactory(document=child1)
 
-    with django_assert_num_queries(9):
+    with django_assert_num_queries(6):
         response = client.get(
             f"/api/v1.0/documents/{document.id!s}/children/",
         )
@@ -456,7 +456,7 @@ def test_api_documents_children_list_authenticated_related_parent(
         document=grand_parent, user=user
     )
 
-    with django_assert_num_queries(10):
+    with django_assert_num_queries(7):
         response = client.get(
             f"/api/v1.0/documents/{document.id!s}/children/",
         )
@@ -591,7 +591,7 @@ def test_api_documents_children_list_authenticated_related_team_members(
 
     access = factories.TeamDocumentAccessFactory(document=document, team="myteam")
 
-    with django_assert_num_queries(9):
+    with django_assert_num_queries(6):
         response = client.get(f"/api/v1.0/documents/{document.id!s}/children/")
 
     # pylint: disable=R0801
@@ -647,3 +647,40 @@ def test_api_documents_children_list_authenticated_related_team_members(
             },
         ],
     }
+
+
+def test_api_documents_children_list_filter_title_ordering():
+    """
+    Children matching the title searched should be ranked by the similarity of their
+    title with the query unless another ordering is requested.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    titles = ["Notes from the Réunion island trip", "Réunions", "Réunion"]
+    for title in titles:
+        factories.DocumentFactory(title=title, parent=document)
+
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/children/?title=reunion"
+    )
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunion",
+        "Réunions",
+        "Notes from the Réunion island trip",
+    ]
+
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/children/?title=reunion&ordering=-title"
+    )
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunions",
+        "Réunion",
+        "Notes from the Réunion island trip",
+    ]
@@ -0,0 +1,260 @@
+"""
+Tests for Documents API endpoint in impress's core app: content update
+"""
+
+import base64
+from unittest import mock
+
+from django.core.cache import cache
+
+import pycrdt
+import pytest
+import responses
+from rest_framework.test import APIClient
+
+from core import factories, models
+from core.services.yjs_services import (
+    YjsContentTooLargeError,
+    YjsExecutor,
+    YjsTimeoutError,
+)
+from core.utils import (
+    base64_yjs_to_state_vector,
+    base64_yjs_to_text,
+    compute_merged_yjs_update,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def get_yjs_update(base64_string, text):
+    """
+    Return the yjs update adding a paragraph with the text to a base64 yjs document,
+    as a client editing the document would send it.
+    """
+    ydoc = pycrdt.Doc()
+    ydoc.apply_update(base64.b64decode(base64_string))
+    state = ydoc.get_state()
+    fragment = ydoc.get("document-store", type=pycrdt.XmlFragment)
+    paragraph = fragment.children.append(pycrdt.XmlElement("paragraph"))
+    paragraph.children.append(pycrdt.XmlText(text))
+    return base64.b64encode(ydoc.get_update(state)).decode("utf-8")
+
+
+def post_update(client, document, update, **data):
+    """Post a yjs update for the document and return the response."""
+    return client.post(
+        f"/api/v1.0/documents/{document.id!s}/content-update/",
+        {"update": update, "websocket": True, **data},
+        format="json",
+    )
+
+
+@pytest.mark.parametrize("role", [None, "reader"])
+def test_api_documents_content_update_forbidden(role):
+    """Users who can not edit a document should not be allowed to update its content."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(
+        link_reach="authenticated",
+        link_role="reader",
+        users=[(user, role)] if role else [],
+    )
+    content = document.content
+
+    response = post_update(client, document, get_yjs_update(content, "new text"))
+
+    assert response.status_code == 403
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.content == content
+
+
+def test_api_documents_content_update_anonymous_public_editor():
+    """Anonymous users should be allowed to update public documents open for edition."""
+    document = factories.DocumentFactory(link_reach="public", link_role="editor")
+
+    response = post_update(
+        APIClient(), document, get_yjs_update(document.content, "anonymous edit")
+    )
+
+    assert response.status_code == 200
+    document = models.Document.objects.get(pk=document.pk)
+    assert "anonymous edit" in base64_yjs_to_text(document.content)
+
+
+def test_api_documents_content_update_success():
+    """
+    The update should be merged into the stored content, the state vector of the new
+    content being returned so that the client knows what the backend has.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(
+        content=factories.YDOC_HELLO_WORLD_BASE64, users=[(user, "editor")]
+    )
+
+    response = post_update(
+        client, document, get_yjs_update(document.content, "new paragraph")
+    )
+
+    assert response.status_code == 200
+    document = models.Document.objects.get(pk=document.pk)
+    assert base64_yjs_to_text(document.content) == "Hello w or ld new paragraph"
+    assert response.json() == {
+        "state_vector": base64.b64encode(
+            base64_yjs_to_state_vector(document.content)
+        ).decode()
+    }
+
+
+def test_api_documents_content_update_concurrent_updates():
+    """
+    Updates computed by clients from the same state should all be merged, none of them
+    overwriting the others.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(
+        content=factories.YDOC_HELLO_WORLD_BASE64, users=[(user, "editor")]
+    )
+    first_update = get_yjs_update(document.content, "first")
+    second_update = get_yjs_update(document.content, "second")
+
+    assert post_update(client, document, first_update).status_code == 200
+    assert post_update(client, document, second_update).status_code == 200
+    # Sending an update again is harmless
+    assert post_update(client, document, first_update).status_code == 200
+
+    document = models.Document.objects.get(pk=document.pk)
+    text = base64_yjs_to_text(document.content)
+    assert text.startswith("Hello w or ld")
+    assert text.count("first") == 1
+    assert text.count("second") == 1
+
+
+def test_api_documents_content_update_already_merged():
+    """An update already included in the content should not save the document."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    update = get_yjs_update(document.content, "new text")
+    assert post_update(client, document, update).status_code == 200
+    updated_at = models.Document.objects.get(pk=document.pk).updated_at
+
+    response = post_update(client, document, update)
+
+    assert response.status_code == 200
+    assert models.Document.objects.get(pk=document.pk).updated_at == updated_at
+
+
+def test_api_documents_content_update_deletion():
+    """An update only deleting content should be saved."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(
+        content=factories.YDOC_HELLO_WORLD_BASE64, users=[(user, "editor")]
+    )
+    ydoc = pycrdt.Doc()
+    ydoc.apply_update(base64.b64decode(document.content))
+    state = ydoc.get_state()
+    fragment = ydoc.get("document-store", type=pycrdt.XmlFragment)
+    del fragment.children[0]
+    update = base64.b64encode(ydoc.get_update(state)).decode("utf-8")
+
+    response = post_update(client, document, update)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "state_vector": base64.b64encode(ydoc.get_state()).decode()
+    }
+    document = models.Document.objects.get(pk=document.pk)
+    assert base64_yjs_to_text(document.content) == ""
+    assert document.versions.count() == 2
+
+
+@pytest.mark.parametrize(
+    "error", [YjsContentTooLargeError("too large"), YjsTimeoutError("too slow")]
+)
+def test_api_documents_content_update_unprocessable(error):
+    """
+    Updates should be merged by the yjs executor, failing without altering the
+    content if the content is too large or too slow to process.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    content = document.content
+
+    with mock.patch.object(YjsExecutor, "run", side_effect=error) as mock_run:
+        response = post_update(client, document, get_yjs_update(content, "new text"))
+
+    assert mock_run.call_args.args[:2] == (compute_merged_yjs_update, content)
+    assert response.status_code == 400
+    assert response.json() == {
+        "update": ["The content of the document could not be processed."]
+    }
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.content == content
+
+
+@pytest.mark.parametrize(
+    "update, error",
+    [
+        ("not base64!", "Invalid base64 content."),
+        (base64.b64encode(b"not a yjs update").decode(), "Invalid yjs update."),
+    ],
+)
+def test_api_documents_content_update_invalid(update, error):
+    """Invalid updates should be rejected without altering the content."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    content = document.content
+
+    response = post_update(client, document, update)
+
+    assert response.status_code == 400
+    assert response.json() == {"update": [error]}
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.content == content
+
+
+@responses.activate
+def test_api_documents_content_update_other_user_connected_to_websocket(settings):
+    """
+    Users not connected to the websocket should not update the content of a document
+    while other users are editing it through the websocket.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    session_key = client.session.session_key
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    content = document.content
+
+    settings.COLLABORATION_API_URL = "http://example.com/"
+    settings.COLLABORATION_SERVER_SECRET = "secret-token"
+    settings.COLLABORATION_WS_NOT_CONNECTED_READY_ONLY = True
+    endpoint_url = (
+        f"{settings.COLLABORATION_API_URL}get-connections/"
+        f"?room={document.id}&sessionKey={session_key}"
+    )
+    ws_resp = responses.get(endpoint_url, json={"count": 3, "exists": False})
+
+    response = post_update(
+        client, document, get_yjs_update(content, "new text"), websocket=False
+    )
+
+    assert response.status_code == 403
+    assert response.json() == {"detail": "You are not allowed to edit this document."}
+    assert cache.get(f"docs:no-websocket:{document.id}") is None
+    assert ws_resp.call_count == 1
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.content == content
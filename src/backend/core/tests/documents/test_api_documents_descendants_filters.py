@@ -93,3 +93,40 @@ def test_api_documents_descendants_filter_title(query, nb_results):
             remove_accents(query).lower().strip()
             in remove_accents(result["title"]).lower()
         )
+
+
+def test_api_documents_descendants_filter_title_ordering():
+    """
+    Descendants matching the title searched should be ranked by the similarity of their
+    title with the query unless another ordering is requested.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(users=[user])
+    titles = ["Notes from the Réunion island trip", "Réunions", "Réunion"]
+    for title in titles:
+        factories.DocumentFactory(title=title, parent=document)
+
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/descendants/?title=reunion"
+    )
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunion",
+        "Réunions",
+        "Notes from the Réunion island trip",
+    ]
+
+    response = client.get(
+        f"/api/v1.0/documents/{document.id!s}/descendants/?title=reunion&ordering=-title"
+    )
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunions",
+        "Réunion",
+        "Notes from the Réunion island trip",
+    ]
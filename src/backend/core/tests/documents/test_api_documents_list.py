@@ -152,11 +152,11 @@ def test_api_documents_list_authenticated_direct(django_assert_num_queries):
         str(child4_with_access.id),
     }
 
-    with django_assert_num_queries(14):
+    with django_assert_num_queries(7):
         response = client.get("/api/v1.0/documents/")
 
-    # nb_accesses should now be cached
-    with django_assert_num_queries(6):
+    # The number of accesses does not depend on a cache
+    with django_assert_num_queries(7):
         response = client.get("/api/v1.0/documents/")
 
     assert response.status_code == 200
@@ -190,11 +190,11 @@ def test_api_documents_list_authenticated_via_team(
 
     expected_ids = {str(document.id) for document in documents_team1 + documents_team2}
 
-    with django_assert_num_queries(14):
+    with django_assert_num_queries(5):
         response = client.get("/api/v1.0/documents/")
 
-    # nb_accesses should now be cached
-    with django_assert_num_queries(4):
+    # The number of accesses does not depend on a cache
+    with django_assert_num_queries(5):
         response = client.get("/api/v1.0/documents/")
 
     assert response.status_code == 200
@@ -223,11 +223,11 @@ def test_api_documents_list_authenticated_link_reach_restricted(
     other_document = factories.DocumentFactory(link_reach="public")
     models.LinkTrace.objects.create(document=other_document, user=user)
 
-    with django_assert_num_queries(6):
+    with django_assert_num_queries(5):
         response = client.get("/api/v1.0/documents/")
 
-    # nb_accesses should now be cached
-    with django_assert_num_queries(4):
+    # The number of accesses does not depend on a cache
+    with django_assert_num_queries(5):
         response = client.get("/api/v1.0/documents/")
 
     assert response.status_code == 200
@@ -272,11 +272,11 @@ def test_api_documents_list_authenticated_link_reach_public_or_authenticated(
 
     expected_ids = {str(document1.id), str(document2.id), str(visible_child.id)}
 
-    with django_assert_num_queries(11):
+    with django_assert_num_queries(6):
         response = client.get("/api/v1.0/documents/")
 
-    # nb_accesses should now be cached
-    with django_assert_num_queries(5):
+    # The number of accesses does not depend on a cache
+    with django_assert_num_queries(6):
         response = client.get("/api/v1.0/documents/")
 
     assert response.status_code == 200
@@ -396,11 +396,11 @@ def test_api_documents_list_favorites_no_extra_queries(django_assert_num_queries
     factories.DocumentFactory.create_batch(2, users=[user])
 
     url = "/api/v1.0/documents/"
-    with django_assert_num_queries(14):
+    with django_assert_num_queries(5):
         response = client.get(url)
 
-    # nb_accesses should now be cached
-    with django_assert_num_queries(4):
+    # The number of accesses does not depend on a cache
+    with django_assert_num_queries(5):
         response = client.get(url)
 
     assert response.status_code == 200
@@ -413,7 +413,7 @@ def test_api_documents_list_favorites_no_extra_queries(django_assert_num_queries
     for document in special_documents:
         models.DocumentFavorite.objects.create(document=document, user=user)
 
-    with django_assert_num_queries(4):
+    with django_assert_num_queries(5):
         response = client.get(url)
 
     assert response.status_code == 200
@@ -6,11 +6,14 @@ import operator
 import random
 from urllib.parse import urlencode
 
+from django.db import connection
+
 import pytest
 from faker import Faker
 from rest_framework.test import APIClient
 
 from core import factories, models
+from core.api.filters import DocumentFilter
 
 fake = Faker()
 pytestmark = pytest.mark.django_db
@@ -432,3 +435,50 @@ def test_api_documents_list_filter_title(query, nb_results):
     # Ensure all results contain the query in their title
     for result in results:
         assert query.lower().strip() in result["title"].lower()
+
+
+def test_api_documents_list_filter_title_ranked_by_similarity():
+    """
+    Documents matching the title searched should be ranked by the similarity of their
+    title with the query unless another ordering is requested.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    titles = ["Notes from the Réunion island trip", "Réunions", "Réunion"]
+    for title in titles:
+        factories.DocumentFactory(title=title, users=[user])
+
+    response = client.get("/api/v1.0/documents/?title=reunion")
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunion",
+        "Réunions",
+        "Notes from the Réunion island trip",
+    ]
+
+    response = client.get("/api/v1.0/documents/?title=reunion&ordering=-title")
+
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == [
+        "Réunions",
+        "Réunion",
+        "Notes from the Réunion island trip",
+    ]
+
+
+def test_api_documents_list_filter_title_uses_index():
+    """Searching documents by title should use the trigram index on their title."""
+    queryset = DocumentFilter(
+        {"title": "vélo"}, queryset=models.Document.objects.all()
+    ).qs
+    sql, params = queryset.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(f"EXPLAIN {sql:s}", params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+
+    assert "document_title_trgm_idx" in plan
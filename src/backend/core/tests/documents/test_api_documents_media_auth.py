@@ -3,11 +3,13 @@ Test media-auth authorization API endpoint in docs core app.
 """
 
 from io import BytesIO
+from unittest import mock
 from urllib.parse import urlparse
 from uuid import uuid4
 
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.test import override_settings
 from django.utils import timezone
 
 import pytest
@@ -17,6 +19,7 @@ from rest_framework.test import APIClient
 
 from core import factories, models
 from core.enums import DocumentAttachmentStatus
+from core.services.collaboration_services import CollaborationService
 from core.tests.conftest import TEAM, USER, VIA
 
 pytestmark = pytest.mark.django_db
@@ -139,7 +142,9 @@ def test_api_documents_media_auth_anonymous_authenticated_or_restricted(reach):
     assert "Authorization" not in response
 
 
-def test_api_documents_media_auth_anonymous_attachments():
+def test_api_documents_media_auth_anonymous_attachments(
+    django_capture_on_commit_callbacks,
+):
     """
     Declaring a media key as original attachment on a document to which
     a user has access should give them access to the attachment file
@@ -168,7 +173,10 @@ def test_api_documents_media_auth_anonymous_attachments():
     # Let's now add a document to which the anonymous user has access and
     # pointing to the attachment
     parent = factories.DocumentFactory(link_reach="public")
-    factories.DocumentFactory(parent=parent, link_reach="restricted", attachments=[key])
+    with django_capture_on_commit_callbacks(execute=True):
+        factories.DocumentFactory(
+            parent=parent, link_reach="restricted", attachments=[key]
+        )
 
     now = timezone.now()
     with freeze_time(now):
@@ -412,3 +420,332 @@ def test_api_documents_media_auth_missing_status_metadata():
         timeout=1,
     )
     assert response.content.decode("utf-8") == "my prose"
+
+
+def test_api_documents_media_auth_ancestor_queries(django_assert_num_queries):
+    """
+    Access to an attachment given on an ancestor of the document including it should
+    be checked through the attachment index with a constant number of queries.
+    """
+    parent = factories.DocumentFactory(link_reach="public")
+    document = factories.DocumentFactory(parent=parent, link_reach="restricted")
+    key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Body=BytesIO(b"my prose"),
+        ContentType="text/plain",
+        Metadata={"status": DocumentAttachmentStatus.READY},
+    )
+    document.attachments = [key]
+    document.save()
+    # Documents not including the attachment should not be considered
+    factories.DocumentFactory.create_batch(3, link_reach="public")
+
+    with django_assert_num_queries(2):
+        response = APIClient().get(
+            "/api/v1.0/documents/media-auth/",
+            HTTP_X_ORIGINAL_URL=f"http://localhost/media/{key:s}",
+        )
+
+    assert response.status_code == 200
+
+
+def test_api_documents_media_auth_cached_decision(
+    django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    """
+    Repeated requests for the same attachment by the same user should be answered
+    from the cache with the same signed headers.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    document = factories.DocumentFactory(
+        link_reach="restricted", users=[(user, "reader")]
+    )
+    key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Body=BytesIO(b"my prose"),
+        ContentType="text/plain",
+        Metadata={"status": DocumentAttachmentStatus.READY},
+    )
+    document.attachments = [key]
+    document.save()
+
+    original_url = f"http://localhost/media/{key:s}"
+    response = client.get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 200
+
+    # Only the authenticated user is loaded
+    with django_assert_num_queries(1):
+        cached_response = client.get(
+            "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+        )
+
+    assert cached_response.status_code == 200
+    assert cached_response["Authorization"] == response["Authorization"]
+    assert cached_response["X-Amz-Date"] == response["X-Amz-Date"]
+
+    # Losing access should invalidate the cached decision once committed
+    with django_capture_on_commit_callbacks(execute=True):
+        document.accesses.get(user=user).delete()
+
+    response = client.get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 403
+
+
+def test_api_documents_media_auth_cached_decision_link_configuration(
+    django_capture_on_commit_callbacks,
+):
+    """
+    A denial cached for anonymous users should be discarded when the link
+    configuration of the document is updated.
+    """
+    user = factories.UserFactory()
+    document = factories.DocumentFactory(
+        link_reach="restricted", users=[(user, "owner")]
+    )
+    key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Body=BytesIO(b"my prose"),
+        ContentType="text/plain",
+        Metadata={"status": DocumentAttachmentStatus.READY},
+    )
+    document.attachments = [key]
+    document.save()
+
+    original_url = f"http://localhost/media/{key:s}"
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 403
+
+    client = APIClient()
+    client.force_login(user)
+    with (
+        mock.patch.object(CollaborationService, "reset_connections"),
+        django_capture_on_commit_callbacks(execute=True),
+    ):
+        response = client.put(
+            f"/api/v1.0/documents/{document.id!s}/link-configuration/",
+            {"link_reach": "public", "link_role": "reader"},
+            format="json",
+        )
+    assert response.status_code == 200
+
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 200
+
+
+def test_api_documents_media_auth_cached_decision_other_tree(
+    django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    """
+    Cached decisions should only be discarded by changes in the tree of the documents
+    including the attachment, once these changes are committed.
+    """
+    keys = []
+    for _i in range(2):
+        root = factories.DocumentFactory(link_reach="public")
+        document = factories.DocumentFactory(parent=root, link_reach="restricted")
+        key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+        default_storage.connection.meta.client.put_object(
+            Bucket=default_storage.bucket_name,
+            Key=key,
+            Body=BytesIO(b"my prose"),
+            ContentType="text/plain",
+            Metadata={"status": DocumentAttachmentStatus.READY},
+        )
+        with django_capture_on_commit_callbacks(execute=True):
+            document.attachments = [key]
+            document.save()
+        keys.append(key)
+
+    for key in keys:
+        response = APIClient().get(
+            "/api/v1.0/documents/media-auth/",
+            HTTP_X_ORIGINAL_URL=f"http://localhost/media/{key:s}",
+        )
+        assert response.status_code == 200
+
+    # Change the accesses of the second tree, the transaction not being committed yet
+    with django_capture_on_commit_callbacks() as callbacks:
+        factories.UserDocumentAccessFactory(document=root)
+
+    for key in keys:
+        with django_assert_num_queries(0):
+            APIClient().get(
+                "/api/v1.0/documents/media-auth/",
+                HTTP_X_ORIGINAL_URL=f"http://localhost/media/{key:s}",
+            )
+
+    # Once committed, only the decisions on the second tree should be discarded
+    for callback in callbacks:
+        callback()
+
+    with django_assert_num_queries(0):
+        APIClient().get(
+            "/api/v1.0/documents/media-auth/",
+            HTTP_X_ORIGINAL_URL=f"http://localhost/media/{keys[0]:s}",
+        )
+    with django_assert_num_queries(2):
+        response = APIClient().get(
+            "/api/v1.0/documents/media-auth/",
+            HTTP_X_ORIGINAL_URL=f"http://localhost/media/{keys[1]:s}",
+        )
+    assert response.status_code == 200
+
+
+def test_api_documents_media_auth_cached_decision_not_ready_status():
+    """Denials due to an attachment not ready yet should not be cached."""
+    document = factories.DocumentFactory(link_reach="public")
+    key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Body=BytesIO(b"my prose"),
+        ContentType="text/plain",
+        Metadata={"status": DocumentAttachmentStatus.PROCESSING},
+    )
+    document.attachments = [key]
+    document.save()
+
+    original_url = f"http://localhost/media/{key:s}"
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 403
+
+    default_storage.connection.meta.client.copy_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        CopySource={"Bucket": default_storage.bucket_name, "Key": key},
+        Metadata={"status": DocumentAttachmentStatus.READY},
+        MetadataDirective="REPLACE",
+    )
+
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+    )
+    assert response.status_code == 200
+
+
+@override_settings(MEDIA_AUTH_CACHE_TIMEOUT=0)
+def test_api_documents_media_auth_cache_disabled(django_assert_num_queries):
+    """Decisions should not be cached when the cache timeout is set to 0."""
+    document = factories.DocumentFactory(link_reach="public")
+    key = f"{document.id!s}/attachments/{uuid4()!s}.jpg"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Body=BytesIO(b"my prose"),
+        ContentType="text/plain",
+        Metadata={"status": DocumentAttachmentStatus.READY},
+    )
+    document.attachments = [key]
+    document.save()
+
+    original_url = f"http://localhost/media/{key:s}"
+    for _i in range(2):
+        with django_assert_num_queries(2):
+            response = APIClient().get(
+                "/api/v1.0/documents/media-auth/", HTTP_X_ORIGINAL_URL=original_url
+            )
+        assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "status,expected_status_code",
+    [
+        (DocumentAttachmentStatus.PROCESSING, 403),
+        (DocumentAttachmentStatus.READY, 200),
+    ],
+)
+def test_api_documents_media_auth_registered_attachment(status, expected_status_code):
+    """
+    The status of registered attachments should be read from the database without
+    requesting the object storage.
+    """
+    document = factories.DocumentFactory(link_reach="public")
+    attachment = factories.AttachmentFactory(document=document, status=status)
+    document.attachments = [attachment.key]
+    document.save()
+
+    with mock.patch.object(
+        default_storage.connection.meta.client, "head_object"
+    ) as mock_head_object:
+        response = APIClient().get(
+            "/api/v1.0/documents/media-auth/",
+            HTTP_X_ORIGINAL_URL=f"http://localhost/media/{attachment.key:s}",
+        )
+
+    assert response.status_code == expected_status_code
+    mock_head_object.assert_not_called()
+
+
+def test_api_documents_media_auth_image_variant():
+    """
+    Resized variants of an image should be authorized as the image itself, with
+    headers signed for the variant.
+    """
+    document = factories.DocumentFactory(link_reach="public")
+    attachment = factories.AttachmentFactory(
+        document=document, status=DocumentAttachmentStatus.READY
+    )
+    document.attachments = [attachment.key]
+    document.save()
+    variant_key = f"{attachment.key:s}-640w.webp"
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name,
+        Key=variant_key,
+        Body=BytesIO(b"my variant"),
+        ContentType="image/webp",
+    )
+
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/",
+        HTTP_X_ORIGINAL_URL=f"http://localhost/media/{variant_key:s}",
+    )
+
+    assert response.status_code == 200
+    s3_url = urlparse(settings.AWS_S3_ENDPOINT_URL)
+    response = requests.get(
+        f"{settings.AWS_S3_ENDPOINT_URL:s}/impress-media-storage/{variant_key:s}",
+        headers={
+            "authorization": response["Authorization"],
+            "x-amz-date": response["x-amz-date"],
+            "x-amz-content-sha256": response["x-amz-content-sha256"],
+            "Host": f"{s3_url.hostname:s}:{s3_url.port:d}",
+        },
+        timeout=1,
+    )
+    assert response.content.decode("utf-8") == "my variant"
+
+
+def test_api_documents_media_auth_image_variant_not_included():
+    """Variants of an image not included in any readable document should be denied."""
+    document = factories.DocumentFactory(link_reach="restricted")
+    attachment = factories.AttachmentFactory(
+        document=document, status=DocumentAttachmentStatus.READY
+    )
+    document.attachments = [attachment.key]
+    document.save()
+
+    response = APIClient().get(
+        "/api/v1.0/documents/media-auth/",
+        HTTP_X_ORIGINAL_URL=f"http://localhost/media/{attachment.key:s}-640w.webp",
+    )
+
+    assert response.status_code == 403
@@ -1,6 +1,7 @@
 """Test the "media_check" endpoint."""
 
 from io import BytesIO
+from unittest import mock
 from uuid import uuid4
 
 from django.core.files.storage import default_storage
@@ -242,3 +243,60 @@ def test_api_documents_media_check_restricted_document(via, mock_user_teams):
         "status": DocumentAttachmentStatus.READY,
         "file": f"/media/{key:s}",
     }
+
+
+@pytest.mark.parametrize(
+    "status", [DocumentAttachmentStatus.PROCESSING, DocumentAttachmentStatus.READY]
+)
+def test_api_documents_media_check_registered_attachment(status):
+    """
+    The status of registered attachments should be read from the database without
+    requesting the object storage, whatever its metadata says.
+    """
+    document = factories.DocumentFactory(link_reach="public")
+    attachment = factories.AttachmentFactory(document=document, status=status)
+    document.attachments = [attachment.key]
+    document.save(update_fields=["attachments"])
+
+    with mock.patch.object(
+        default_storage.connection.meta.client, "head_object"
+    ) as mock_head_object:
+        response = APIClient().get(
+            f"/api/v1.0/documents/{document.id!s}/media-check/",
+            {"key": attachment.key},
+        )
+
+    assert response.status_code == 200
+    mock_head_object.assert_not_called()
+    if status == DocumentAttachmentStatus.READY:
+        assert response.json() == {
+            "status": DocumentAttachmentStatus.READY,
+            "file": f"/media/{attachment.key:s}",
+        }
+    else:
+        assert response.json() == {"status": DocumentAttachmentStatus.PROCESSING}
+
+
+def test_api_documents_media_check_image_variants():
+    """The resized variants of a ready image should be listed."""
+    document = factories.DocumentFactory(link_reach="public")
+    attachment = factories.AttachmentFactory(
+        document=document,
+        status=DocumentAttachmentStatus.READY,
+        variants=[{"width": 640, "format": "webp", "key": "variant-640w.webp"}],
+    )
+    document.attachments = [attachment.key]
+    document.save(update_fields=["attachments"])
+
+    response = APIClient().get(
+        f"/api/v1.0/documents/{document.id!s}/media-check/", {"key": attachment.key}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": DocumentAttachmentStatus.READY,
+        "file": f"/media/{attachment.key:s}",
+        "variants": [
+            {"width": 640, "format": "webp", "file": "/media/variant-640w.webp"}
+        ],
+    }
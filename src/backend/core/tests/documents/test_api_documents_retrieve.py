@@ -60,6 +60,7 @@ def test_api_documents_retrieve_anonymous_public_standalone():
             "update": document.link_role == "editor",
             "versions_destroy": False,
             "versions_list": False,
+            "versions_restore": False,
             "versions_retrieve": False,
         },
         "ancestors_link_reach": None,
@@ -133,6 +134,7 @@ def test_api_documents_retrieve_anonymous_public_parent():
             "update": grand_parent.link_role == "editor",
             "versions_destroy": False,
             "versions_list": False,
+            "versions_restore": False,
             "versions_retrieve": False,
         },
         "ancestors_link_reach": "public",
@@ -239,6 +241,7 @@ def test_api_documents_retrieve_authenticated_unrelated_public_or_authenticated(
             "update": document.link_role == "editor",
             "versions_destroy": False,
             "versions_list": False,
+            "versions_restore": False,
             "versions_retrieve": False,
         },
         "ancestors_link_reach": None,
@@ -319,6 +322,7 @@ def test_api_documents_retrieve_authenticated_public_or_authenticated_parent(rea
             "update": grand_parent.link_role == "editor",
             "versions_destroy": False,
             "versions_list": False,
+            "versions_restore": False,
             "versions_retrieve": False,
         },
         "ancestors_link_reach": reach,
@@ -513,6 +517,7 @@ def test_api_documents_retrieve_authenticated_related_parent():
             "update": access.role != "reader",
             "versions_destroy": access.role in ["administrator", "owner"],
             "versions_list": True,
+            "versions_restore": access.role != "reader",
             "versions_retrieve": True,
         },
         "ancestors_link_reach": "restricted",
@@ -866,10 +871,10 @@ def test_api_documents_retrieve_numqueries_with_link_trace(django_assert_num_que
 
     document = factories.DocumentFactory(users=[user], link_traces=[user])
 
-    with django_assert_num_queries(5):
+    with django_assert_num_queries(4):
         response = client.get(f"/api/v1.0/documents/{document.id!s}/")
 
-    with django_assert_num_queries(3):
+    with django_assert_num_queries(4):
         response = client.get(f"/api/v1.0/documents/{document.id!s}/")
 
     assert response.status_code == 200
@@ -0,0 +1,246 @@
+"""
+Tests for Documents API endpoint in impress's core app: search
+"""
+
+import base64
+from unittest import mock
+
+import pycrdt
+import pytest
+from rest_framework.test import APIClient
+
+from core import factories, models
+from core.tasks.documents import compute_document_content_artifacts
+
+pytestmark = pytest.mark.django_db
+
+
+def get_ydoc_with_text(text):
+    """Return a base64 yjs document with a paragraph containing the text."""
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = fragment = pycrdt.XmlFragment()
+    paragraph = fragment.children.append(pycrdt.XmlElement("paragraph"))
+    paragraph.children.append(pycrdt.XmlText(text))
+    return base64.b64encode(ydoc.get_update()).decode("utf-8")
+
+
+def create_indexed_document(text="", **kwargs):
+    """Create a document with the text as content and index it for search."""
+    kwargs.setdefault("creator__language", "en-us")
+    document = factories.DocumentFactory(content=get_ydoc_with_text(text), **kwargs)
+    compute_document_content_artifacts(str(document.pk))
+    return document
+
+
+def search(client, query):
+    """Search documents and return the response."""
+    return client.get("/api/v1.0/documents/search/", {"q": query})
+
+
+def test_api_documents_search_anonymous():
+    """Anonymous users should not be allowed to search documents."""
+    create_indexed_document("annual report", link_reach="public")
+
+    response = search(APIClient(), "report")
+
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("query", ["", " ", "a"])
+def test_api_documents_search_query_too_short(query):
+    """Queries too short to be meaningful should not return any result."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    create_indexed_document("a report", users=[user])
+
+    response = search(client, query)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == []
+
+
+def test_api_documents_search_ranking():
+    """
+    Documents matching the query in their title should rank above documents matching
+    it only in their content, and documents not matching the query should be excluded.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    in_content = create_indexed_document(
+        "The budget is detailed in the reports of the year.", users=[user]
+    )
+    in_title = create_indexed_document(
+        "Nothing to see here.", title="Annual report", users=[user]
+    )
+    create_indexed_document("Minutes of the meeting.", users=[user])
+
+    response = search(client, "reporting")
+
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 2
+    results = content["results"]
+    assert [result["id"] for result in results] == [
+        str(in_title.id),
+        str(in_content.id),
+    ]
+    assert results[0]["rank"] > results[1]["rank"]
+    assert results[0]["title"] == "Annual report"
+
+
+def test_api_documents_search_language_and_accents():
+    """
+    Documents should be indexed in the language of their creator and found whatever
+    the accents typed in the query or found in the document.
+    """
+    user = factories.UserFactory(language="en-us")
+    client = APIClient()
+    client.force_login(user)
+
+    document = create_indexed_document(
+        "Les élèves mangeaient à la cantine.",
+        creator__language="fr-fr",
+        users=[user],
+    )
+
+    for query in ["élève", "eleves", "ÉLÈVES cantine"]:
+        response = search(client, query)
+
+        assert response.status_code == 200
+        assert [result["id"] for result in response.json()["results"]] == [
+            str(document.id)
+        ]
+
+
+def test_api_documents_search_permissions(mock_user_teams):
+    """
+    Users should find the documents on which they or their teams have an access, the
+    descendants of such documents and the documents they visited unless restricted.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    mock_user_teams.return_value = ["lasuite"]
+
+    direct = create_indexed_document("secret plan", users=[user])
+    parent = create_indexed_document("other topic", teams=[("lasuite", "reader")])
+    child = create_indexed_document("secret plan", parent=parent)
+    grand_child = create_indexed_document("secret plan", parent=child)
+    traced = create_indexed_document(
+        "secret plan", link_reach="authenticated", link_traces=[user]
+    )
+
+    # Documents visited but restricted since, never visited or deleted
+    create_indexed_document("secret plan", link_reach="restricted", link_traces=[user])
+    create_indexed_document("secret plan", link_reach="public")
+    deleted = create_indexed_document("secret plan", users=[user])
+    deleted.soft_delete()
+
+    response = search(client, "secret")
+
+    assert response.status_code == 200
+    assert sorted(result["id"] for result in response.json()["results"]) == sorted(
+        str(document.id) for document in [direct, child, grand_child, traced]
+    )
+
+
+def test_api_documents_search_permissions_link_reach_inherited():
+    """
+    Users should find the documents they visited whose link reach is inherited from a
+    public or authenticated ancestor, and the descendants of documents they visited,
+    but not documents they never came across.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    public = create_indexed_document("other topic", link_reach="public")
+    inherited = create_indexed_document(
+        "secret plan", parent=public, link_reach="restricted", link_traces=[user]
+    )
+    traced = create_indexed_document(
+        "other topic", link_reach="authenticated", link_traces=[user]
+    )
+    child = create_indexed_document(
+        "secret plan", parent=traced, link_reach="restricted"
+    )
+    grand_child = create_indexed_document(
+        "secret plan", parent=child, link_reach="restricted"
+    )
+
+    # Visited but restricted all the way up, or never visited
+    restricted = create_indexed_document("other topic", link_reach="restricted")
+    create_indexed_document(
+        "secret plan", parent=restricted, link_reach="restricted", link_traces=[user]
+    )
+    create_indexed_document("secret plan", parent=public, link_reach="public")
+
+    response = search(client, "secret")
+
+    assert response.status_code == 200
+    assert sorted(result["id"] for result in response.json()["results"]) == sorted(
+        str(document.id) for document in [inherited, child, grand_child]
+    )
+
+
+def test_api_documents_search_highlight():
+    """
+    Results should come with the fragments of their content matching the query, the
+    content being escaped.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    create_indexed_document("Tom & Jerry are matching <b> items.", users=[user])
+    create_indexed_document("", title="matching title only", users=[user])
+
+    # Highlights are computed from the text stored in database
+    with mock.patch.object(models.Document, "content", None):
+        response = search(client, "matching")
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["title"] == "matching title only"
+    assert results[0]["highlight"] is None
+    assert results[1]["highlight"] == "Jerry are <mark>matching</mark> &lt;b&gt; items"
+
+
+def test_api_documents_search_index_title(django_capture_on_commit_callbacks):
+    """Changing the title of a document should index it again."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = create_indexed_document("content", title="draft", users=[user])
+
+    document = models.Document.objects.get(pk=document.pk)
+    document.title = "Release notes"
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        document.save()
+    assert len(callbacks) == 1
+
+    response = search(client, "release")
+    assert [result["id"] for result in response.json()["results"]] == [str(document.id)]
+
+    # Saving the document without changing its title does not index it again
+    with django_capture_on_commit_callbacks() as callbacks:
+        document.save()
+    assert not callbacks
+
+
+def test_api_documents_search_vector_preserved_on_save():
+    """Saving a document loaded before it was indexed should not reset its index."""
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+    document = factories.DocumentFactory(title="Budget", users=[user])
+    stale = models.Document.objects.get(pk=document.pk)
+    compute_document_content_artifacts(str(document.pk))
+
+    stale.save()
+
+    response = search(client, "budget")
+    assert [result["id"] for result in response.json()["results"]] == [str(document.id)]
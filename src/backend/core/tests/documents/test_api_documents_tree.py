@@ -23,10 +23,10 @@ def test_api_documents_tree_list_anonymous_public_standalone(django_assert_num_q
     )
     child = factories.DocumentFactory(link_reach="public", parent=document)
 
-    with django_assert_num_queries(14):
+    with django_assert_num_queries(5):
         APIClient().get(f"/api/v1.0/documents/{document.id!s}/tree/")
 
-    with django_assert_num_queries(4):
+    with django_assert_num_queries(5):
         response = APIClient().get(f"/api/v1.0/documents/{document.id!s}/tree/")
 
     assert response.status_code == 200
@@ -377,10 +377,10 @@ def test_api_documents_tree_list_authenticated_unrelated_public_or_authenticated
     document, sibling = factories.DocumentFactory.create_batch(2, parent=parent)
     child = factories.DocumentFactory(link_reach="public", parent=document)
 
-    with django_assert_num_queries(13):
+    with django_assert_num_queries(6):
         client.get(f"/api/v1.0/documents/{document.id!s}/tree/")
 
-    with django_assert_num_queries(5):
+    with django_assert_num_queries(6):
         response = client.get(f"/api/v1.0/documents/{document.id!s}/tree/")
 
     assert response.status_code == 200
@@ -3,13 +3,14 @@ Test extract-attachments on document update in docs core app.
 """
 
 import base64
+from unittest import mock
 from uuid import uuid4
 
 import pycrdt
 import pytest
 from rest_framework.test import APIClient
 
-from core import factories
+from core import factories, utils
 
 pytestmark = pytest.mark.django_db
 
@@ -47,7 +48,7 @@ def test_api_documents_update_new_attachment_keys_anonymous(django_assert_num_qu
     factories.DocumentFactory(attachments=[image_keys[3]], link_reach="restricted")
     expected_keys = {image_keys[i] for i in [0, 1]}
 
-    with django_assert_num_queries(11):
+    with django_assert_num_queries(12):
         response = APIClient().put(
             f"/api/v1.0/documents/{document.id!s}/",
             {"content": get_ydoc_with_mages(image_keys), "websocket": True},
@@ -60,7 +61,7 @@ def test_api_documents_update_new_attachment_keys_anonymous(django_assert_num_qu
 
     # Check that the db query to check attachments readability for extracted
     # keys is not done if the content changes but no new keys are found
-    with django_assert_num_queries(7):
+    with django_assert_num_queries(9):
         response = APIClient().put(
             f"/api/v1.0/documents/{document.id!s}/",
             {"content": get_ydoc_with_mages(image_keys[:2]), "websocket": True},
@@ -98,7 +99,7 @@ def test_api_documents_update_new_attachment_keys_authenticated(
     factories.DocumentFactory(attachments=[image_keys[4]], users=[user])
     expected_keys = {image_keys[i] for i in [0, 1, 2, 4]}
 
-    with django_assert_num_queries(12):
+    with django_assert_num_queries(13):
         response = client.put(
             f"/api/v1.0/documents/{document.id!s}/",
             {"content": get_ydoc_with_mages(image_keys)},
@@ -111,7 +112,7 @@ def test_api_documents_update_new_attachment_keys_authenticated(
 
     # Check that the db query to check attachments readability for extracted
     # keys is not done if the content changes but no new keys are found
-    with django_assert_num_queries(8):
+    with django_assert_num_queries(10):
         response = client.put(
             f"/api/v1.0/documents/{document.id!s}/",
             {"content": get_ydoc_with_mages(image_keys[:2])},
@@ -152,3 +153,132 @@ def test_api_documents_update_new_attachment_keys_duplicate():
     document.refresh_from_db()
     assert len(document.attachments) == 2
     assert set(document.attachments) == {image_key1, image_key2}
+
+
+def test_api_documents_update_new_attachment_keys_not_parsed():
+    """
+    The content should not be parsed again to extract attachment keys if it did not
+    change since its attachment keys were last extracted for the document.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    image_keys = [f"{uuid4()!s}/attachments/{uuid4()!s}.png" for _ in range(2)]
+    document = factories.DocumentFactory(
+        attachments=image_keys, users=[(user, "editor")]
+    )
+    content = get_ydoc_with_mages(image_keys[:1])
+
+    with mock.patch.object(
+        utils, "extract_attachments", wraps=utils.extract_attachments
+    ) as mock_extract:
+        for _ in range(2):
+            response = client.put(
+                f"/api/v1.0/documents/{document.id!s}/",
+                {"content": content},
+                format="json",
+            )
+            assert response.status_code == 200
+
+        mock_extract.assert_called_once_with(content)
+
+        response = client.put(
+            f"/api/v1.0/documents/{document.id!s}/",
+            {"content": get_ydoc_with_mages(image_keys)},
+            format="json",
+        )
+        assert response.status_code == 200
+        assert mock_extract.call_count == 2
+
+    document.refresh_from_db()
+    assert document.attachments == image_keys
+
+
+def test_api_documents_update_new_attachment_keys_split_text():
+    """
+    Attachment keys typed as text should be extracted even if their characters are
+    stored in separate items of the yjs document, out of order.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    image_key = f"{uuid4()!s}/attachments/{uuid4()!s}.png"
+    document = factories.DocumentFactory(users=[(user, "editor")])
+    factories.DocumentFactory(attachments=[image_key], users=[user])
+
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = fragment = pycrdt.XmlFragment()
+    text = fragment.children.append(pycrdt.XmlText())
+    url = f"http://localhost/media/{image_key:s}"
+    text.insert(0, url[-10:])
+    text.insert(0, url[:-10])
+    content = base64.b64encode(ydoc.get_update()).decode("utf-8")
+    assert utils.extract_attachments_candidates(content) == set()
+
+    response = client.put(
+        f"/api/v1.0/documents/{document.id!s}/",
+        {"content": content},
+        format="json",
+    )
+
+    assert response.status_code == 200
+    document.refresh_from_db()
+    assert document.attachments == [image_key]
+
+
+def test_api_documents_update_new_attachment_keys_readable_ancestor():
+    """
+    Attachment keys included in a document should be readable if the user has access
+    to one of its ancestors.
+    """
+    user = factories.UserFactory()
+    client = APIClient()
+    client.force_login(user)
+
+    image_keys = [f"{uuid4()!s}/attachments/{uuid4()!s}.png" for _ in range(2)]
+    document = factories.DocumentFactory(users=[(user, "editor")])
+
+    parent = factories.DocumentFactory(link_reach="restricted", users=[user])
+    factories.DocumentFactory(
+        parent=parent, link_reach="restricted", attachments=[image_keys[0]]
+    )
+    other_parent = factories.DocumentFactory(link_reach="restricted")
+    factories.DocumentFactory(
+        parent=other_parent, link_reach="restricted", attachments=[image_keys[1]]
+    )
+
+    response = client.put(
+        f"/api/v1.0/documents/{document.id!s}/",
+        {"content": get_ydoc_with_mages(image_keys)},
+        format="json",
+    )
+
+    assert response.status_code == 200
+    document.refresh_from_db()
+    assert document.attachments == [image_keys[0]]
+
+
+def test_api_documents_update_new_attachment_keys_content_too_large(settings):
+    """
+    When the content can not be processed, the keys found in its binary encoding should
+    be added to the attachments if readable by the user, without loading the content.
+    """
+    image_keys = [f"{uuid4()!s}/attachments/{uuid4()!s}.png" for _ in range(2)]
+    document = factories.DocumentFactory(link_reach="public", link_role="editor")
+    factories.DocumentFactory(attachments=[image_keys[0]], link_reach="public")
+    factories.DocumentFactory(attachments=[image_keys[1]], link_reach="restricted")
+
+    settings.YJS_EXECUTOR_MAX_CONTENT_SIZE = 10
+    with mock.patch.object(utils, "compute_content_artifacts") as compute_mock:
+        response = APIClient().put(
+            f"/api/v1.0/documents/{document.id!s}/",
+            {"content": get_ydoc_with_mages(image_keys), "websocket": True},
+            format="json",
+        )
+    assert response.status_code == 200
+    compute_mock.assert_not_called()
+
+    document.refresh_from_db()
+    assert document.attachments == [image_keys[0]]
@@ -0,0 +1,27 @@
+import uuid
+
+import pytest
+
+
+@pytest.mark.django_db
+def test_populate_document_attachment_index(migrator):
+    """Test that the migration indexes the attachments of existing documents."""
+    old_state = migrator.apply_initial_migration(("core", "0025_document_version"))
+    OldDocument = old_state.apps.get_model("core", "Document")
+
+    image_keys = [
+        f"{uuid.uuid4()!s}/attachments/{uuid.uuid4()!s}.png" for _ in range(2)
+    ]
+    old_doc_with_attachments = OldDocument.objects.create(
+        title="Doc with attachments", depth=1, path="0000001", attachments=image_keys
+    )
+    OldDocument.objects.create(
+        title="Doc without attachments", depth=1, path="0000002", attachments=None
+    )
+
+    new_state = migrator.apply_tested_migration(("core", "0026_document_attachment"))
+    DocumentAttachment = new_state.apps.get_model("core", "DocumentAttachment")
+
+    assert sorted(
+        DocumentAttachment.objects.values_list("document_id", "key")
+    ) == sorted((old_doc_with_attachments.pk, key) for key in image_keys)
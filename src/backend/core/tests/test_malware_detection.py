@@ -1,6 +1,7 @@
 """Test malware detection callback."""
 
 import random
+from unittest import mock
 
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
@@ -9,8 +10,10 @@ import pytest
 from lasuite.malware_detection.enums import ReportStatus
 
 from core.enums import DocumentAttachmentStatus
-from core.factories import DocumentFactory
+from core.factories import AttachmentFactory, DocumentFactory
 from core.malware_detection import malware_detection_callback
+from core.models import Attachment
+from core.tasks.attachments import generate_image_variants
 
 pytestmark = pytest.mark.django_db
 
@@ -56,6 +59,31 @@ def test_malware_detection_callback_safe_status(safe_file):
     assert metadata["status"] == DocumentAttachmentStatus.READY
 
 
+def test_malware_detection_callback_safe_status_registered(safe_file):
+    """
+    The status of a registered attachment should be updated in database without
+    rewriting the file in object storage.
+    """
+    attachment = AttachmentFactory(key=safe_file)
+
+    with mock.patch.object(generate_image_variants, "delay") as mock_delay:
+        malware_detection_callback(
+            safe_file,
+            ReportStatus.SAFE,
+            error_info={},
+            document_id=attachment.document_id,
+        )
+
+    # Resized variants should be generated once the file is considered safe
+    mock_delay.assert_called_once_with(safe_file)
+    attachment.refresh_from_db()
+    assert attachment.status == DocumentAttachmentStatus.READY
+
+    s3_client = default_storage.connection.meta.client
+    head_resp = s3_client.head_object(Bucket=default_storage.bucket_name, Key=safe_file)
+    assert "status" not in head_resp.get("Metadata", {})
+
+
 def test_malware_detection_callback_unsafe_status(unsafe_file):
     """Test malware detection callback with unsafe status."""
 
@@ -74,3 +102,39 @@ def test_malware_detection_callback_unsafe_status(unsafe_file):
 
     assert unsafe_file not in document.attachments
     assert not default_storage.exists(unsafe_file)
+
+
+def test_malware_detection_callback_unsafe_status_registered(unsafe_file):
+    """An infected attachment should be removed from the attachment registry."""
+    attachment = AttachmentFactory(key=unsafe_file)
+    attachment.document.attachments = [unsafe_file]
+    attachment.document.save()
+
+    malware_detection_callback(
+        unsafe_file,
+        ReportStatus.UNSAFE,
+        error_info={"error": "test", "error_code": 4001},
+        document_id=attachment.document_id,
+    )
+
+    assert not Attachment.objects.filter(key=unsafe_file).exists()
+    assert not default_storage.exists(unsafe_file)
+
+
+def test_malware_detection_callback_unsafe_status_shared(unsafe_file):
+    """An infected file should be removed from all the documents including it."""
+    document, other_document = DocumentFactory.create_batch(
+        2, attachments=[unsafe_file, "other.txt"]
+    )
+
+    malware_detection_callback(
+        unsafe_file,
+        ReportStatus.UNSAFE,
+        error_info={"error": "test", "error_code": 4001},
+        document_id=document.id,
+    )
+
+    document.refresh_from_db()
+    other_document.refresh_from_db()
+    assert document.attachments == ["other.txt"]
+    assert other_document.attachments == ["other.txt"]
@@ -0,0 +1,21 @@
+"""
+Unit tests for the Attachment model
+"""
+
+import pytest
+
+from core import factories, models
+
+pytestmark = pytest.mark.django_db
+
+
+def test_models_attachments_unreferenced():
+    """Attachments not included in any document should be found."""
+    shared, single, orphan = factories.AttachmentFactory.create_batch(3)
+    for document in factories.DocumentFactory.create_batch(2):
+        document.attachments = [shared.key]
+        document.save()
+    single.document.attachments = [single.key]
+    single.document.save()
+
+    assert list(models.Attachment.objects.unreferenced()) == [orphan]
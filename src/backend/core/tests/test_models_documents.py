@@ -5,6 +5,8 @@ Unit tests for the Document model
 
 import random
 import smtplib
+import threading
+import uuid
 from logging import Logger
 from unittest import mock
 
@@ -13,10 +15,16 @@ from django.core import mail
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
+from django.db import connection
 from django.test.utils import override_settings
 from django.utils import timezone
 
 import pytest
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    NoCredentialsError,
+)
 
 from core import factories, models
 
@@ -182,6 +190,7 @@ def test_models_documents_get_abilities_forbidden(
         "update": False,
         "versions_destroy": False,
         "versions_list": False,
+        "versions_restore": False,
         "versions_retrieve": False,
     }
     nb_queries = 1 if is_authenticated else 0
@@ -245,6 +254,7 @@ def test_models_documents_get_abilities_reader(
         "update": False,
         "versions_destroy": False,
         "versions_list": False,
+        "versions_restore": False,
         "versions_retrieve": False,
     }
     nb_queries = 1 if is_authenticated else 0
@@ -310,6 +320,7 @@ def test_models_documents_get_abilities_editor(
         "update": True,
         "versions_destroy": False,
         "versions_list": False,
+        "versions_restore": False,
         "versions_retrieve": False,
     }
     nb_queries = 1 if is_authenticated else 0
@@ -364,6 +375,7 @@ def test_models_documents_get_abilities_owner(django_assert_num_queries):
         "update": True,
         "versions_destroy": True,
         "versions_list": True,
+        "versions_restore": True,
         "versions_retrieve": True,
     }
     with django_assert_num_queries(1):
@@ -415,6 +427,7 @@ def test_models_documents_get_abilities_administrator(django_assert_num_queries)
         "update": True,
         "versions_destroy": True,
         "versions_list": True,
+        "versions_restore": True,
         "versions_retrieve": True,
     }
     with django_assert_num_queries(1):
@@ -469,6 +482,7 @@ def test_models_documents_get_abilities_editor_user(django_assert_num_queries):
         "update": True,
         "versions_destroy": False,
         "versions_list": True,
+        "versions_restore": True,
         "versions_retrieve": True,
     }
     with django_assert_num_queries(1):
@@ -530,6 +544,7 @@ def test_models_documents_get_abilities_reader_user(
         "update": access_from_link,
         "versions_destroy": False,
         "versions_list": True,
+        "versions_restore": False,
         "versions_retrieve": True,
     }
 
@@ -589,6 +604,7 @@ def test_models_documents_get_abilities_preset_role(django_assert_num_queries):
         "update": False,
         "versions_destroy": False,
         "versions_list": True,
+        "versions_restore": False,
         "versions_retrieve": True,
     }
 
@@ -724,6 +740,317 @@ def test_models_documents_version_duplicate():
     assert len(response["Versions"]) == 2
 
 
+def test_models_documents_version_index():
+    """
+    Each version written to object storage should be indexed in database with
+    its author: the creator for the first version, the content author afterwards.
+    """
+    user = factories.UserFactory()
+    document = factories.DocumentFactory(creator=user)
+
+    version = document.versions.get()
+    assert version.author == user
+    assert version.size == len(document.content.encode("utf-8"))
+
+    # Saving without changing the content should not index a new version
+    document.save()
+    assert document.versions.count() == 1
+
+    other_user = factories.UserFactory()
+    document.content = "new content"
+    document.content_author = other_user
+    document.save()
+
+    response = default_storage.connection.meta.client.list_object_versions(
+        Bucket=default_storage.bucket_name, Prefix=document.file_key
+    )
+    assert sorted(v["VersionId"] for v in response["Versions"]) == sorted(
+        document.versions.values_list("version_id", flat=True)
+    )
+    latest = document.versions.first()
+    assert latest.author == other_user
+    assert latest.size == 11
+    assert latest.etag == response["Versions"][0]["ETag"]
+
+
+def test_models_documents_delete_version_index():
+    """Deleting a version should remove it from object storage and from the index."""
+    document = factories.DocumentFactory()
+    document.content = "new content"
+    document.save()
+
+    version_id = document.get_versions_slice()["versions"][0]["version_id"]
+    document.delete_version(version_id)
+
+    assert list(document.versions.values_list("version_id", flat=True)) != [version_id]
+    assert document.versions.count() == 1
+    response = default_storage.connection.meta.client.list_object_versions(
+        Bucket=default_storage.bucket_name, Prefix=document.file_key
+    )
+    assert len(response["Versions"]) == 1
+
+
+def test_models_documents_content_coalescing(settings):
+    """
+    When write coalescing is enabled, content updates should be buffered and written
+    once to object storage when the pending content is flushed.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    user = factories.UserFactory()
+    document = factories.DocumentFactory()
+
+    with mock.patch(
+        "core.tasks.documents.flush_document_content.apply_async"
+    ) as mock_flush:
+        for i in range(3):
+            document.content = f"new content {i:d}"
+            document.content_author = user
+            document.save()
+
+    mock_flush.assert_called_once_with((str(document.pk),), countdown=10)
+    assert document.versions.count() == 1
+    assert models.Document.objects.filter(
+        pk=document.pk, content_pending_since__isnull=False
+    ).exists()
+
+    # Reads should see the pending content
+    assert models.Document.objects.get(pk=document.pk).content == "new content 2"
+    assert models.Document.objects.fetch_contents([document.pk]) == {
+        document.pk: "new content 2"
+    }
+
+    assert document.flush_content() is True
+
+    assert document.versions.count() == 2
+    assert document.versions.first().author == user
+    assert cache.get(document.get_pending_content_cache_key()) is None
+    assert models.Document.objects.filter(
+        pk=document.pk, content_pending_since__isnull=True
+    ).exists()
+    response = document.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "new content 2"
+
+    # Nothing left to flush
+    assert document.flush_content() is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_models_documents_content_coalescing_buffered_during_flush(settings):
+    """
+    Content buffered while a flush checks whether the pending content changed should
+    wait for the flush to complete and survive it, along with its pending marker.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    document = factories.DocumentFactory()
+    pending_content_cache_key = document.get_pending_content_cache_key()
+
+    def buffer_content():
+        try:
+            models.Document.objects.get(pk=document.pk).buffer_content("newer content")
+        finally:
+            connection.close()
+
+    buffering = threading.Thread(target=buffer_content)
+    cache_get = cache.get
+
+    def check_and_buffer(key, *args, **kwargs):
+        current = cache_get(key, *args, **kwargs)
+        if (
+            key == pending_content_cache_key
+            and connection.in_atomic_block
+            and buffering.ident is None
+        ):
+            buffering.start()
+            # The content can not be buffered before the flush is complete
+            buffering.join(timeout=1)
+            assert buffering.is_alive()
+        return current
+
+    with mock.patch("core.tasks.documents.flush_document_content.apply_async"):
+        document.content = "pending content"
+        document.save()
+
+        with mock.patch.object(cache, "get", side_effect=check_and_buffer):
+            assert document.flush_content() is True
+        buffering.join()
+
+    assert cache.get(pending_content_cache_key)["content"] == "newer content"
+    assert models.Document.objects.filter(
+        pk=document.pk, content_pending_since__isnull=False
+    ).exists()
+    response = document.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "pending content"
+
+    assert document.flush_content() is True
+    response = document.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "newer content"
+
+
+def test_models_documents_restore_version_drops_pending_content(settings):
+    """
+    Restoring a version should supersede the content waiting to be flushed and clear
+    the pending marker, so that it is not reported as lost by the sweeper.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    document = factories.DocumentFactory()
+    version = document.versions.get()
+
+    with mock.patch("core.tasks.documents.flush_document_content.apply_async"):
+        document.content = "pending content"
+        document.save()
+
+    document.restore_version(version)
+
+    assert cache.get(document.get_pending_content_cache_key()) is None
+    assert models.Document.objects.filter(
+        pk=document.pk, content_pending_since__isnull=True
+    ).exists()
+    assert document.versions.count() == 2
+    assert document.flush_content() is False
+
+
+def test_models_documents_attachment_index():
+    """The attachment index should mirror the "attachments" field of documents."""
+    document = factories.DocumentFactory(attachments=["a", "b"])
+    assert set(document.attachment_links.values_list("key", flat=True)) == {"a", "b"}
+
+    document = models.Document.objects.get(pk=document.pk)
+    document.attachments = ["b", "c"]
+    document.save()
+    assert set(document.attachment_links.values_list("key", flat=True)) == {"b", "c"}
+
+    # Documents loaded without their attachments should sync from the index
+    document = models.Document.objects.only("id", "path").get(pk=document.pk)
+    document.attachments = ["c", "d"]
+    document.save()
+    assert set(document.attachment_links.values_list("key", flat=True)) == {"c", "d"}
+
+    # Saving other fields should not touch the index
+    document = models.Document.objects.defer("attachments").get(pk=document.pk)
+    with mock.patch.object(models.Document, "sync_attachment_index") as mock_sync:
+        document.title = "new title"
+        document.save()
+    mock_sync.assert_not_called()
+
+
+def test_models_documents_fetch_contents():
+    """
+    The "fetch_contents" method should return the content of each document,
+    or None for documents that have no content in object storage.
+    """
+    documents = factories.DocumentFactory.create_batch(3)
+    for i, document in enumerate(documents):
+        document.content = f"content{i:d}"
+        document.save()
+    missing_id = uuid.uuid4()
+
+    contents = models.Document.objects.fetch_contents(
+        [*(document.id for document in documents), missing_id]
+    )
+
+    assert contents == {
+        documents[0].id: "content0",
+        documents[1].id: "content1",
+        documents[2].id: "content2",
+        missing_id: None,
+    }
+
+
+def test_models_documents_fetch_contents_empty():
+    """Fetching the contents of no document should not hit object storage."""
+    with mock.patch.object(
+        default_storage.connection.meta.client, "get_object"
+    ) as mock_get_object:
+        assert models.Document.objects.fetch_contents([]) == {}
+
+    mock_get_object.assert_not_called()
+
+
+def test_models_documents_fetch_contents_retry(settings):
+    """Transient object storage errors should be retried."""
+    settings.DOCUMENT_CONTENT_FETCH_MAX_RETRIES = 2
+    document = factories.DocumentFactory()
+    document.content = "my content"
+    document.save()
+
+    s3_client = default_storage.connection.meta.client
+    error = ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+    get_object = s3_client.get_object
+
+    with (
+        mock.patch("core.models.time.sleep") as mock_sleep,
+        mock.patch.object(
+            s3_client,
+            "get_object",
+            side_effect=[
+                error,
+                error,
+                get_object(Bucket=default_storage.bucket_name, Key=document.file_key),
+            ],
+        ) as mock_get_object,
+    ):
+        contents = models.Document.objects.fetch_contents([document.id])
+
+    assert contents == {document.id: "my content"}
+    assert mock_get_object.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+def test_models_documents_fetch_contents_retry_exhausted(settings):
+    """The error should be raised when the maximum number of retries is reached."""
+    settings.DOCUMENT_CONTENT_FETCH_MAX_RETRIES = 1
+    document = factories.DocumentFactory()
+
+    error = ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+    with (
+        mock.patch("core.models.time.sleep"),
+        mock.patch.object(
+            default_storage.connection.meta.client, "get_object", side_effect=error
+        ) as mock_get_object,
+        pytest.raises(ClientError),
+    ):
+        models.Document.objects.fetch_contents([document.id])
+
+    assert mock_get_object.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "error,is_transient",
+    [
+        (ClientError({"Error": {"Code": "AccessDenied"}}, "GetObject"), False),
+        (
+            ClientError(
+                {
+                    "Error": {"Code": "InternalError"},
+                    "ResponseMetadata": {"HTTPStatusCode": 500},
+                },
+                "GetObject",
+            ),
+            True,
+        ),
+        (EndpointConnectionError(endpoint_url="http://minio:9000"), True),
+        (NoCredentialsError(), False),
+    ],
+)
+def test_models_documents_fetch_contents_retry_transient_only(
+    settings, error, is_transient
+):
+    """Only throttling, server and connection errors should be retried."""
+    settings.DOCUMENT_CONTENT_FETCH_MAX_RETRIES = 1
+    document = factories.DocumentFactory()
+
+    with (
+        mock.patch("core.models.time.sleep"),
+        mock.patch.object(
+            default_storage.connection.meta.client, "get_object", side_effect=error
+        ) as mock_get_object,
+        pytest.raises(type(error)),
+    ):
+        models.Document.objects.fetch_contents([document.id])
+
+    assert mock_get_object.call_count == (2 if is_transient else 1)
+
+
 def test_models_documents__email_invitation__success():
     """
     The email invitation is sent successfully.
@@ -860,142 +1187,116 @@ def test_models_documents__email_invitation__failed(mock_logger, _mock_send_mail
 # Document number of accesses
 
 
-def test_models_documents_nb_accesses_cache_is_set_and_retrieved_ancestors(
-    django_assert_num_queries,
-):
-    """Test that nb_accesses is cached when calling nb_accesses_ancestors."""
-    parent = factories.DocumentFactory()
-    document = factories.DocumentFactory(parent=parent)
-    key = f"document_{document.id!s}_nb_accesses"
-    nb_accesses_parent = random.randint(1, 4)
-    factories.UserDocumentAccessFactory.create_batch(
-        nb_accesses_parent, document=parent
-    )
-    nb_accesses_direct = random.randint(1, 4)
-    factories.UserDocumentAccessFactory.create_batch(
-        nb_accesses_direct, document=document
+def test_models_documents_nb_accesses_direct_maintained_on_write():
+    """
+    The number of accesses on a document should be maintained by the database whatever
+    the way accesses are created or deleted, and kept up to date in memory.
+    """
+    document = factories.DocumentFactory()
+    other_document = factories.DocumentFactory()
+    assert document.nb_accesses_direct == 0
+
+    access = factories.UserDocumentAccessFactory(document=document)
+    assert document.nb_accesses_direct == 1
+    models.DocumentAccess.objects.bulk_create(
+        [
+            models.DocumentAccess(document=document, team="lasuite", role="reader"),
+            models.DocumentAccess(
+                document=other_document, team="lasuite", role="reader"
+            ),
+        ]
     )
-    factories.UserDocumentAccessFactory()  # An unrelated access should not be counted
+    user = factories.UserDocumentAccessFactory(document=document).user
 
-    # Initially, the nb_accesses should not be cached
-    assert cache.get(key) is None
+    document = models.Document.objects.get(pk=document.pk)
+    assert document.nb_accesses_direct == 3
+    assert models.Document.objects.get(pk=other_document.pk).nb_accesses_direct == 1
 
-    # Compute the nb_accesses for the first time (this should set the cache)
-    nb_accesses_ancestors = nb_accesses_parent + nb_accesses_direct
-    with django_assert_num_queries(2):
-        assert document.nb_accesses_ancestors == nb_accesses_ancestors
+    access.delete()
+    user.delete()  # Accesses are deleted in cascade
+    models.DocumentAccess.objects.filter(team="lasuite").delete()
 
-    # Ensure that the nb_accesses is now cached
-    with django_assert_num_queries(0):
-        assert document.nb_accesses_ancestors == nb_accesses_ancestors
-    assert cache.get(key) == (nb_accesses_direct, nb_accesses_ancestors)
+    assert models.Document.objects.get(pk=document.pk).nb_accesses_direct == 0
+    assert models.Document.objects.get(pk=other_document.pk).nb_accesses_direct == 0
 
-    # The cache value should be invalidated when a document access is created
-    models.DocumentAccess.objects.create(
-        document=document, user=factories.UserFactory(), role="reader"
-    )
-    assert cache.get(key) is None  # Cache should be invalidated
-    with django_assert_num_queries(2):
-        assert document.nb_accesses_ancestors == nb_accesses_ancestors + 1
-    assert cache.get(key) == (nb_accesses_direct + 1, nb_accesses_ancestors + 1)
 
+def test_models_documents_nb_accesses_direct_not_overwritten_on_save():
+    """Saving a document loaded before accesses were created should keep its counter."""
+    document = factories.DocumentFactory()
+    stale = models.Document.objects.get(pk=document.pk)
+    factories.UserDocumentAccessFactory.create_batch(2, document=document)
 
-def test_models_documents_nb_accesses_cache_is_set_and_retrieved_direct(
-    django_assert_num_queries,
-):
-    """Test that nb_accesses is cached when calling nb_accesses_direct."""
-    parent = factories.DocumentFactory()
-    document = factories.DocumentFactory(parent=parent)
-    key = f"document_{document.id!s}_nb_accesses"
-    nb_accesses_parent = random.randint(1, 4)
-    factories.UserDocumentAccessFactory.create_batch(
-        nb_accesses_parent, document=parent
-    )
-    nb_accesses_direct = random.randint(1, 4)
-    factories.UserDocumentAccessFactory.create_batch(
-        nb_accesses_direct, document=document
-    )
-    factories.UserDocumentAccessFactory()  # An unrelated access should not be counted
+    stale.title = "new title"
+    stale.save()
+
+    document.refresh_from_db()
+    assert document.title == "new title"
+    assert document.nb_accesses_direct == 2
 
-    # Initially, the nb_accesses should not be cached
-    assert cache.get(key) is None
 
-    # Compute the nb_accesses for the first time (this should set the cache)
-    nb_accesses_ancestors = nb_accesses_parent + nb_accesses_direct
-    with django_assert_num_queries(2):
-        assert document.nb_accesses_direct == nb_accesses_direct
+def test_models_documents_nb_accesses_ancestors(django_assert_num_queries):
+    """
+    The number of accesses on a document and its ancestors should be computed in one
+    query and computed again when an access is created or deleted.
+    """
+    grand_parent = factories.DocumentFactory()
+    parent = factories.DocumentFactory(parent=grand_parent)
+    document = factories.DocumentFactory(parent=parent)
+    factories.DocumentFactory(parent=document, users=[factories.UserFactory()])
+    factories.UserDocumentAccessFactory.create_batch(2, document=grand_parent)
+    factories.UserDocumentAccessFactory(document=document)
+    factories.UserDocumentAccessFactory()  # An unrelated access should not be counted
 
-    # Ensure that the nb_accesses is now cached
+    document = models.Document.objects.get(pk=document.pk)
+    with django_assert_num_queries(1):
+        assert document.nb_accesses_ancestors == 3
     with django_assert_num_queries(0):
-        assert document.nb_accesses_direct == nb_accesses_direct
-    assert cache.get(key) == (nb_accesses_direct, nb_accesses_ancestors)
+        assert document.nb_accesses_ancestors == 3
 
-    # The cache value should be invalidated when a document access is created
-    models.DocumentAccess.objects.create(
+    access = models.DocumentAccess.objects.create(
         document=document, user=factories.UserFactory(), role="reader"
     )
-    assert cache.get(key) is None  # Cache should be invalidated
-    with django_assert_num_queries(2):
-        assert document.nb_accesses_direct == nb_accesses_direct + 1
-    assert cache.get(key) == (nb_accesses_direct + 1, nb_accesses_ancestors + 1)
-
-
-@pytest.mark.parametrize("field", ["nb_accesses_ancestors", "nb_accesses_direct"])
-def test_models_documents_nb_accesses_cache_is_invalidated_on_access_removal(
-    field,
-    django_assert_num_queries,
-):
-    """Test that the cache is invalidated when a document access is deleted."""
-    document = factories.DocumentFactory()
-    key = f"document_{document.id!s}_nb_accesses"
-    access = factories.UserDocumentAccessFactory(document=document)
-
-    # Initially, the nb_accesses should be cached
-    assert getattr(document, field) == 1
-    assert cache.get(key) == (1, 1)
+    with django_assert_num_queries(1):
+        assert document.nb_accesses_ancestors == 4
 
-    # Remove the access and check if cache is invalidated
     access.delete()
-    assert cache.get(key) is None  # Cache should be invalidated
+    with django_assert_num_queries(1):
+        assert document.nb_accesses_ancestors == 3
+
+
+def test_models_documents_compute_nb_accesses_ancestors(django_assert_num_queries):
+    """The number of accesses of several documents should be computed in one query."""
+    root = factories.DocumentFactory(users=[factories.UserFactory()])
+    child = factories.DocumentFactory(parent=root, teams=[("lasuite", "reader")])
+    other_child = factories.DocumentFactory(parent=root)
+    other_root = factories.DocumentFactory()
+    documents = list(
+        models.Document.objects.filter(
+            pk__in=[root.pk, child.pk, other_child.pk, other_root.pk]
+        ).order_by("path")
+    )
 
-    # Recompute the nb_accesses (this should trigger a cache set)
-    with django_assert_num_queries(2):
-        new_nb_accesses = getattr(document, field)
-    assert new_nb_accesses == 0
-    assert cache.get(key) == (0, 0)  # Cache should now contain the new value
+    with django_assert_num_queries(1):
+        models.Document.compute_nb_accesses_ancestors(documents)
+
+    with django_assert_num_queries(0):
+        assert {
+            document.pk: document.nb_accesses_ancestors for document in documents
+        } == {root.pk: 1, child.pk: 2, other_child.pk: 1, other_root.pk: 0}
 
 
 @pytest.mark.parametrize("field", ["nb_accesses_ancestors", "nb_accesses_direct"])
-def test_models_documents_nb_accesses_cache_is_invalidated_on_document_soft_delete_restore(
-    field,
-    django_assert_num_queries,
-):
-    """Test that the cache is invalidated when a document access is deleted."""
+def test_models_documents_nb_accesses_document_soft_delete_restore(field):
+    """Accesses should not be counted as ancestors accesses while a document is deleted."""
     document = factories.DocumentFactory()
-    key = f"document_{document.id!s}_nb_accesses"
     factories.UserDocumentAccessFactory(document=document)
-
-    # Initially, the nb_accesses should be cached
     assert getattr(document, field) == 1
-    assert cache.get(key) == (1, 1)
 
-    # Soft delete the document and check if cache is invalidated
     document.soft_delete()
-    assert cache.get(key) is None  # Cache should be invalidated
-
-    # Recompute the nb_accesses (this should trigger a cache set)
-    with django_assert_num_queries(2):
-        new_nb_accesses = getattr(document, field)
-    assert new_nb_accesses == (1 if field == "nb_accesses_direct" else 0)
-    assert cache.get(key) == (1, 0)  # Cache should now contain the new value
+    assert getattr(document, field) == (1 if field == "nb_accesses_direct" else 0)
 
     document.restore()
-
-    # Recompute the nb_accesses (this should trigger a cache set)
-    with django_assert_num_queries(2):
-        new_nb_accesses = getattr(document, field)
-    assert new_nb_accesses == 1
-    assert cache.get(key) == (1, 1)  # Cache should now contain the new value
+    assert getattr(document, field) == 1
 
 
 def test_models_documents_numchild_deleted_from_instance():
@@ -1080,7 +1381,7 @@ def test_models_documents_restore(django_assert_num_queries):
     assert document.deleted_at is not None
     assert document.ancestors_deleted_at == document.deleted_at
 
-    with django_assert_num_queries(10):
+    with django_assert_num_queries(9):
         document.restore()
     document.refresh_from_db()
     assert document.deleted_at is None
@@ -1123,7 +1424,7 @@ def test_models_documents_restore_complex(django_assert_num_queries):
     assert child2.ancestors_deleted_at == document.deleted_at
 
     # Restore the item
-    with django_assert_num_queries(13):
+    with django_assert_num_queries(12):
         document.restore()
     document.refresh_from_db()
     child1.refresh_from_db()
@@ -1173,7 +1474,7 @@ def test_models_documents_restore_complex_bis(django_assert_num_queries):
 
     # Restoring the grand parent should not restore the document
     # as it was deleted before the grand parent
-    with django_assert_num_queries(11):
+    with django_assert_num_queries(10):
         grand_parent.restore()
 
     grand_parent.refresh_from_db()
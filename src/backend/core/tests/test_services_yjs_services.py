@@ -0,0 +1,144 @@
+"""
+Test yjs services in impress's core app.
+"""
+
+import base64
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from core import factories, utils
+from core.services.yjs_services import (
+    YjsContentTooLargeError,
+    YjsExecutor,
+    YjsTimeoutError,
+)
+from core.tests.yjs_helpers import get_pid, sleep
+
+pytestmark = pytest.mark.django_db
+
+
+def run_get_pid(_arg):
+    """Run an operation with the executor and return its result with the process id."""
+    return YjsExecutor().run(get_pid, "content"), os.getpid()
+
+
+@pytest.fixture(name="pool")
+def fixture_pool(settings):
+    """Run operations in a pool of one worker process, terminated after the test."""
+    settings.YJS_EXECUTOR_MAX_WORKERS = 1
+    yield
+    if YjsExecutor._pool is not None:  # pylint: disable=protected-access
+        YjsExecutor.reset_pool(YjsExecutor._pool)  # pylint: disable=protected-access
+
+
+def test_services_yjs_executor_inline(settings):
+    """Operations should run in the calling process when no worker is configured."""
+    settings.YJS_EXECUTOR_MAX_WORKERS = 0
+
+    assert YjsExecutor().run(get_pid, "content") == os.getpid()
+
+
+@pytest.mark.usefixtures("pool")
+def test_services_yjs_executor_worker_process():
+    """Operations should run in a worker process and return their result."""
+    assert YjsExecutor().run(get_pid, "content") != os.getpid()
+    artifacts = YjsExecutor().run(
+        utils.compute_content_artifacts, factories.YDOC_HELLO_WORLD_BASE64
+    )
+    expected_artifacts = utils.compute_content_artifacts(
+        factories.YDOC_HELLO_WORLD_BASE64
+    )
+    # The order of xml attributes differs between processes
+    assert artifacts.pop("xml") != ""
+    expected_artifacts.pop("xml")
+    assert artifacts == expected_artifacts
+
+
+@pytest.mark.usefixtures("pool")
+def test_services_yjs_executor_invalid_content():
+    """
+    Pycrdt panics on invalid documents should be reported as a ValueError without
+    killing the worker.
+    """
+    content = base64.b64encode(b"not a yjs document").decode()
+
+    with pytest.raises(ValueError):
+        YjsExecutor().run(utils.compute_content_artifacts, content)
+
+    assert YjsExecutor().run(get_pid, "content") != os.getpid()
+
+
+@pytest.mark.parametrize("max_workers", [0, 1])
+def test_services_yjs_executor_content_too_large(settings, max_workers):
+    """Contents larger than the limit should be rejected without being processed."""
+    settings.YJS_EXECUTOR_MAX_WORKERS = max_workers
+    settings.YJS_EXECUTOR_MAX_CONTENT_SIZE = 10
+
+    with pytest.raises(YjsContentTooLargeError):
+        YjsExecutor().run(sleep, "0" * 11)
+
+    assert YjsExecutor().run(sleep, "0" * 10) == "0" * 10
+
+
+@pytest.mark.usefixtures("pool")
+def test_services_yjs_executor_timeout(settings):
+    """
+    Operations taking longer than the timeout should be aborted, their worker being
+    replaced for the next operations.
+    """
+    settings.YJS_EXECUTOR_TIMEOUT = 1
+    pid = YjsExecutor().run(get_pid, "content")
+
+    start = time.monotonic()
+    with pytest.raises(YjsTimeoutError):
+        YjsExecutor().run(sleep, "30")
+    assert time.monotonic() - start < 10
+
+    assert YjsExecutor().run(sleep, "0", timeout=5) == "0"
+    assert YjsExecutor().run(get_pid, "content") not in [pid, os.getpid()]
+
+    with pytest.raises(YjsTimeoutError, match="more than 0.5 seconds"):
+        YjsExecutor().run(sleep, "30", timeout=0.5)
+
+
+@pytest.mark.usefixtures("pool")
+def test_services_yjs_executor_daemonic_process():
+    """
+    Operations should run in the calling process if it is daemonic, like Celery
+    prefork workers, as daemonic processes are not allowed to have children.
+    """
+    with multiprocessing.get_context("fork").Pool(1) as daemonic_pool:
+        result, pid = daemonic_pool.apply(run_get_pid, (None,))
+
+    assert result == pid
+    assert pid != os.getpid()
+
+
+@pytest.mark.usefixtures("pool")
+def test_services_yjs_executor_timeout_retries_other_operations(settings):
+    """
+    Operations killed with the pool reset after another operation timed out should
+    run again on the new pool and complete within their own timeout.
+    """
+    settings.YJS_EXECUTOR_MAX_WORKERS = 2
+    settings.YJS_EXECUTOR_TIMEOUT = 1
+    outcome = {}
+
+    def run_other_operation():
+        start = time.monotonic()
+        outcome["result"] = YjsExecutor().run(sleep, "3", timeout=30)
+        outcome["duration"] = time.monotonic() - start
+
+    thread = threading.Thread(target=run_other_operation)
+    thread.start()
+    with pytest.raises(YjsTimeoutError):
+        YjsExecutor().run(sleep, "20")
+    thread.join()
+
+    assert outcome["result"] == "3"
+    # The operation ran once on each pool
+    assert 4 <= outcome["duration"] < 10
@@ -0,0 +1,380 @@
+"""
+Unit tests for the tasks processing the files attached to documents.
+"""
+
+import hashlib
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+from uuid import uuid4
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+import pytest
+from freezegun import freeze_time
+from PIL import Image
+
+from core import factories, models
+from core.tasks.attachments import (
+    collect_orphan_attachments,
+    compute_attachment_digest,
+    generate_image_variants,
+    get_variant_key,
+)
+from core.tests.documents.test_api_documents_update_extract_attachments import (
+    get_ydoc_with_mages,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def put_image(key, size, image_format="PNG"):
+    """Store an image of the given size in object storage."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="red").save(buffer, format=image_format)
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name, Key=key, Body=buffer.getvalue()
+    )
+
+
+def test_tasks_attachments_generate_image_variants(settings):
+    """
+    Variants should be generated in each format for the widths smaller than the
+    original image, and registered on the attachment.
+    """
+    settings.DOCUMENT_IMAGE_VARIANT_WIDTHS = ["320", "640", "1280"]
+    settings.DOCUMENT_IMAGE_VARIANT_FORMATS = ["webp", "avif"]
+    attachment = factories.AttachmentFactory()
+    put_image(attachment.key, (1000, 500))
+
+    variants = generate_image_variants(attachment.key)
+
+    assert variants == [
+        {"width": 320, "format": "webp", "key": f"{attachment.key:s}-320w.webp"},
+        {"width": 320, "format": "avif", "key": f"{attachment.key:s}-320w.avif"},
+        {"width": 640, "format": "webp", "key": f"{attachment.key:s}-640w.webp"},
+        {"width": 640, "format": "avif", "key": f"{attachment.key:s}-640w.avif"},
+    ]
+    attachment.refresh_from_db()
+    assert attachment.variants == variants
+
+    s3_client = default_storage.connection.meta.client
+    response = s3_client.get_object(
+        Bucket=default_storage.bucket_name, Key=f"{attachment.key:s}-640w.webp"
+    )
+    assert response["ContentType"] == "image/webp"
+    assert response["ContentDisposition"] == "inline"
+    variant = Image.open(BytesIO(response["Body"].read()))
+    assert variant.format == "WEBP"
+    assert variant.size == (640, 320)
+
+
+def test_tasks_attachments_generate_image_variants_unknown_format(settings):
+    """Formats for which no variant can be generated should be ignored."""
+    settings.DOCUMENT_IMAGE_VARIANT_WIDTHS = [320]
+    settings.DOCUMENT_IMAGE_VARIANT_FORMATS = ["webp", "bmp"]
+    attachment = factories.AttachmentFactory()
+    put_image(attachment.key, (1000, 500))
+
+    variants = generate_image_variants(attachment.key)
+
+    assert [variant["format"] for variant in variants] == ["webp"]
+
+
+def test_tasks_attachments_generate_image_variants_small_image(settings):
+    """No variant should be generated for images smaller than the smallest width."""
+    settings.DOCUMENT_IMAGE_VARIANT_WIDTHS = [320, 640]
+    attachment = factories.AttachmentFactory()
+    put_image(attachment.key, (200, 100))
+
+    assert not generate_image_variants(attachment.key)
+    attachment.refresh_from_db()
+    assert attachment.variants == []
+
+
+@pytest.mark.parametrize(
+    "key_suffix,content_type",
+    [("-unsafe.png", "image/png"), (".pdf", "application/pdf")],
+)
+def test_tasks_attachments_generate_image_variants_not_inline(key_suffix, content_type):
+    """No variant should be generated for unsafe files or files that are not images."""
+    document = factories.DocumentFactory()
+    attachment = factories.AttachmentFactory(
+        document=document,
+        key=f"{document.id!s}/attachments/{uuid4()!s}{key_suffix:s}",
+        content_type=content_type,
+    )
+    put_image(attachment.key, (1000, 500))
+
+    assert not generate_image_variants(attachment.key)
+
+
+def test_tasks_attachments_generate_image_variants_invalid_image():
+    """Files that can not be read as images should be ignored."""
+    attachment = factories.AttachmentFactory()
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name, Key=attachment.key, Body=b"not an image"
+    )
+
+    assert not generate_image_variants(attachment.key)
+
+
+def test_tasks_attachments_generate_image_variants_unregistered():
+    """Nothing should be done for attachments missing from the registry."""
+    assert not generate_image_variants(f"{uuid4()!s}/attachments/{uuid4()!s}.png")
+
+
+def test_tasks_attachments_compute_attachment_digest():
+    """The digest of attachments registered without one should be computed."""
+    attachment = factories.AttachmentFactory(digest="")
+    default_storage.connection.meta.client.put_object(
+        Bucket=default_storage.bucket_name, Key=attachment.key, Body=b"my prose"
+    )
+
+    digest = compute_attachment_digest(attachment.key)
+
+    assert digest == hashlib.sha256(b"my prose").hexdigest()
+    attachment.refresh_from_db()
+    assert attachment.digest == digest
+
+
+def test_tasks_attachments_compute_attachment_digest_unsafe():
+    """Unsafe files are never reused so their digest should not be computed."""
+    document = factories.DocumentFactory()
+    attachment = factories.AttachmentFactory(
+        key=f"{document.id!s}/attachments/{uuid4()!s}-unsafe.exe", digest=""
+    )
+
+    assert compute_attachment_digest(attachment.key) is None
+    attachment.refresh_from_db()
+    assert attachment.digest == ""
+
+
+def put_object(key):
+    """Store an object with two versions in object storage."""
+    for body in [b"v1", b"v2"]:
+        default_storage.connection.meta.client.put_object(
+            Bucket=default_storage.bucket_name, Key=key, Body=body
+        )
+
+
+def get_keys(prefix):
+    """List the keys of all the versions of the objects stored under a prefix."""
+    response = default_storage.connection.meta.client.list_object_versions(
+        Bucket=default_storage.bucket_name, Prefix=prefix
+    )
+    return sorted({version["Key"] for version in response.get("Versions", [])})
+
+
+@pytest.fixture(name="orphans")
+def fixture_orphans():
+    """
+    A document which content includes one of its two attachments, with an image
+    uploaded but never included and a file of a deleted document.
+    """
+    document = factories.DocumentFactory()
+    prefix = f"{document.id!s}/attachments"
+    kept, removed, unused = [f"{prefix:s}/{uuid4()!s}.png" for _ in range(3)]
+    deleted = f"{uuid4()!s}/attachments/{uuid4()!s}.png"
+
+    for key in [kept, removed, unused, deleted]:
+        put_object(key)
+        put_object(get_variant_key(key, 320, "webp"))
+    factories.AttachmentFactory(key=removed, document=document)
+    factories.AttachmentFactory(key=deleted, document=None)
+
+    document.content = get_ydoc_with_mages([kept])
+    document.attachments = [kept, removed]
+    document.save()
+
+    return document, kept, removed, unused, deleted
+
+
+def test_tasks_attachments_collect_orphan_attachments(orphans):
+    """
+    Media removed from the content of documents should be removed from their
+    attachments, then the files not included in any document or retained version
+    should be deleted with all their versions and variants after the grace period.
+    """
+    document, kept, removed, unused, deleted = orphans
+
+    # Files are kept during the grace period
+    report = collect_orphan_attachments(full=True)
+    assert report["documents"] == 0
+    assert report["attachments"] == 0
+    assert get_keys(kept.rpartition("/")[0]) == sorted(
+        [kept, removed, unused]
+        + [f"{key:s}-320w.webp" for key in [kept, removed, unused]]
+    )
+
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        report = collect_orphan_attachments()
+
+    assert report == {
+        "dry_run": False,
+        "documents": 1,
+        "keys": 1,
+        "attachments": 2,
+        "objects": 8,
+        "deleted": 8,
+        "uploads": 0,
+    }
+    document.refresh_from_db()
+    assert document.attachments == [kept]
+    assert list(document.attachment_links.values_list("key", flat=True)) == [kept]
+    # The removed media is still included in a retained version of the document
+    assert get_keys(kept.rpartition("/")[0]) == sorted(
+        [kept, removed] + [f"{key:s}-320w.webp" for key in [kept, removed]]
+    )
+    assert get_keys(deleted) == []
+    assert models.Attachment.objects.filter(key=removed).exists()
+    assert not models.Attachment.objects.filter(key=deleted).exists()
+
+    # Once no retained version includes it anymore, the removed media is collected
+    document.versions.filter(attachments__contains=[removed]).delete()
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        report = collect_orphan_attachments(full=True)
+
+    assert report["attachments"] == 1
+    assert get_keys(kept.rpartition("/")[0]) == [kept, f"{kept:s}-320w.webp"]
+    assert not models.Attachment.objects.filter(key=removed).exists()
+
+
+def test_tasks_attachments_collect_orphan_attachments_restore_version(
+    django_capture_on_commit_callbacks,
+):
+    """
+    Restoring a version after its media were removed from the document and collected
+    should include them again, their files being kept for the retained version.
+    """
+    document = factories.DocumentFactory()
+    key = f"{document.id!s}/attachments/{uuid4()!s}.png"
+    put_object(key)
+    factories.AttachmentFactory(key=key, document=document)
+    document.content = get_ydoc_with_mages([key])
+    document.attachments = [key]
+    document.save()
+    version = document.versions.first()
+    document.content = get_ydoc_with_mages([])
+    document.save()
+
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        report = collect_orphan_attachments()
+
+    assert report["keys"] == 1
+    assert report["attachments"] == 0
+    document.refresh_from_db()
+    assert document.attachments == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        document.restore_version(version)
+
+    document.refresh_from_db()
+    assert document.attachments == [key]
+    assert document.versions.first().attachments == [key]
+    assert get_keys(key) == [key]
+    assert models.Attachment.objects.filter(key=key).exists()
+
+
+def test_tasks_attachments_collect_orphan_attachments_dry_run(orphans):
+    """A dry run should report what would be collected without modifying anything."""
+    document, kept, removed, _unused, deleted = orphans
+
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        report = collect_orphan_attachments(dry_run=True)
+
+    # The removed media is still included in the document during the dry run
+    assert report == {
+        "dry_run": True,
+        "documents": 1,
+        "keys": 1,
+        "attachments": 2,
+        "objects": 8,
+        "deleted": 0,
+        "uploads": 0,
+    }
+    document.refresh_from_db()
+    assert document.attachments == [kept, removed]
+    assert len(get_keys(kept.rpartition("/")[0])) == 6
+    assert len(get_keys(deleted)) == 2
+    assert models.Attachment.objects.filter(key__in=[removed, deleted]).count() == 2
+
+
+def test_tasks_attachments_collect_orphan_attachments_shared():
+    """Files included in another document should not be deleted."""
+    document, other_document = factories.DocumentFactory.create_batch(2)
+    key = f"{document.id!s}/attachments/{uuid4()!s}.png"
+    put_object(key)
+    document.attachments = [key]
+    document.save()
+    other_document.content = get_ydoc_with_mages([key])
+    other_document.attachments = [key]
+    other_document.save()
+
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        report = collect_orphan_attachments()
+
+    assert report["keys"] == 1
+    assert report["attachments"] == 0
+    assert get_keys(key) == [key]
+
+
+def test_tasks_attachments_collect_orphan_attachments_unreadable_content():
+    """Attachments of documents which content can't be read should be kept."""
+    key = f"{uuid4()!s}/attachments/{uuid4()!s}.png"
+    document = factories.DocumentFactory(attachments=[key])
+
+    with (
+        mock.patch.object(models.Document, "content", None),
+        freeze_time(timezone.now() + timedelta(days=8)),
+    ):
+        report = collect_orphan_attachments()
+
+    assert report["keys"] == 0
+    document.refresh_from_db()
+    assert document.attachments == [key]
+
+
+def test_tasks_attachments_collect_orphan_attachments_checkpoint():
+    """Only the documents modified since the previous run should be reconciled."""
+    factories.DocumentFactory()
+
+    with freeze_time(timezone.now() + timedelta(days=8)):
+        assert collect_orphan_attachments()["documents"] == 1
+        assert collect_orphan_attachments()["documents"] == 0
+        assert collect_orphan_attachments(full=True)["documents"] == 1
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_tasks_attachments_collect_orphan_attachments_expired_uploads(
+    dry_run, settings
+):
+    """
+    Multipart uploads of attachments that were never confirmed should be aborted once
+    their upload slot expired.
+    """
+    s3_client = default_storage.connection.meta.client
+    bucket_name = default_storage.bucket_name
+    key = f"{uuid4()!s}/attachments/{uuid4()!s}.png"
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=key)[
+        "UploadId"
+    ]
+    s3_client.upload_part(
+        Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=1, Body=b"part"
+    )
+
+    def get_upload_ids():
+        response = s3_client.list_multipart_uploads(Bucket=bucket_name, Prefix=key)
+        return [upload["UploadId"] for upload in response.get("Uploads", [])]
+
+    # Uploads can still be confirmed until their slot expires
+    collect_orphan_attachments(dry_run=dry_run)
+    assert get_upload_ids() == [upload_id]
+
+    expiration = settings.DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION + 60
+    with freeze_time(timezone.now() + timedelta(seconds=expiration)):
+        report = collect_orphan_attachments(dry_run=dry_run)
+
+    assert report["uploads"] >= 1
+    assert get_upload_ids() == ([upload_id] if dry_run else [])
@@ -0,0 +1,322 @@
+"""
+Unit tests for the document content tasks.
+"""
+
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.utils import timezone
+
+import pytest
+from freezegun import freeze_time
+
+from core import factories, models, utils
+from core.tasks.documents import (
+    CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY,
+    CONTENT_COMPACTION_CURSOR_CACHE_KEY,
+    compact_document_content,
+    compact_document_contents,
+    compute_document_content_artifacts,
+    flush_document_content,
+    flush_stale_document_contents,
+)
+from core.tests.documents.test_api_documents_update_extract_attachments import (
+    get_ydoc_with_mages,
+)
+from core.tests.test_utils import get_uncompacted_ydoc
+
+pytestmark = pytest.mark.django_db
+
+
+def test_tasks_documents_flush_document_content(settings):
+    """
+    Content buffered during the coalescing window should be written to object
+    storage by the flush task. With eager tasks, the flush happens on save.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    document = factories.DocumentFactory()
+
+    document.content = "new content"
+    document.save()
+
+    assert document.versions.count() == 2
+    response = document.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "new content"
+
+    # Nothing left to flush
+    assert flush_document_content(str(document.pk)) is False
+
+
+def test_tasks_documents_flush_document_content_deleted_document():
+    """The flush task should ignore documents that do not exist anymore."""
+    assert flush_document_content(str(uuid.uuid4())) is False
+
+
+def test_tasks_documents_flush_stale_document_contents(settings):
+    """
+    Content left pending for more than twice the coalescing window, because its
+    flush was lost, should be written to object storage by the sweeper. Pending
+    content lost from the cache should be reported and its marker cleared.
+    """
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    stale, recent, lost = factories.DocumentFactory.create_batch(3)
+
+    with mock.patch("core.tasks.documents.flush_document_content.apply_async"):
+        with freeze_time(timezone.now() - timedelta(seconds=30)):
+            for document in [stale, lost]:
+                document.content = "stale content"
+                document.save()
+        recent.content = "recent content"
+        recent.save()
+    cache.delete(lost.get_pending_content_cache_key())
+
+    with mock.patch("core.tasks.documents.logger.error") as mock_error:
+        assert flush_stale_document_contents() == {"flushed": 1, "lost": 1}
+
+    mock_error.assert_called_once()
+    assert stale.versions.count() == 2
+    response = stale.get_content_response()
+    assert response["Body"].read().decode("utf-8") == "stale content"
+    assert recent.versions.count() == 1
+    assert cache.get(recent.get_pending_content_cache_key()) is not None
+    assert set(
+        models.Document.objects.filter(content_pending_since__isnull=False).values_list(
+            "id", flat=True
+        )
+    ) == {recent.id}
+
+
+def test_tasks_documents_compute_document_content_artifacts(
+    django_capture_on_commit_callbacks,
+):
+    """
+    Artifacts should be computed in the background each time new content is written
+    and the excerpt of the document should be kept up to date.
+    """
+    document = factories.DocumentFactory(excerpt=None)
+    key = f"{document.id!s}/attachments/{uuid.uuid4()!s}.png"
+
+    document.content = get_ydoc_with_mages([key])
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        document.save()
+
+    assert len(callbacks) == 1
+    document.refresh_from_db()
+    assert document.excerpt == ""
+    document.content = factories.YDOC_HELLO_WORLD_BASE64
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        document.save()
+
+    assert len(callbacks) == 1
+    document.refresh_from_db()
+    assert document.excerpt == "Hello w or ld"
+
+    # Nothing is scheduled when the content did not change
+    with django_capture_on_commit_callbacks() as callbacks:
+        document.save()
+    assert not callbacks
+
+
+@pytest.mark.parametrize(
+    "task", [compute_document_content_artifacts, compact_document_content]
+)
+def test_tasks_documents_content_tasks_time_limits(task, settings):
+    """
+    Tasks processing the content of a document should be bounded in time as yjs
+    operations run inline, without a timeout, in daemonic Celery workers.
+    """
+    assert task.soft_time_limit == settings.YJS_EXECUTOR_TIMEOUT * 3
+    assert task.time_limit > task.soft_time_limit
+
+
+def test_tasks_documents_compute_document_content_artifacts_invalid_content():
+    """
+    The excerpt of documents which content can't be parsed should be left untouched
+    but their title should still be indexed for search.
+    """
+    document = factories.DocumentFactory(
+        content="invalid", excerpt="excerpt", title="Roadmap"
+    )
+
+    assert compute_document_content_artifacts(str(document.pk)) == "excerpt"
+    document = models.Document.objects.only("excerpt", "search_vector").get(
+        pk=document.pk
+    )
+    assert document.excerpt == "excerpt"
+    assert "roadmap" in document.search_vector
+
+
+def test_tasks_documents_compute_document_content_artifacts_deleted_document():
+    """The task should ignore documents that do not exist anymore."""
+    assert compute_document_content_artifacts(str(uuid.uuid4())) is None
+
+
+def get_stored_content(document):
+    """Return the current content of a document in object storage."""
+    return document.get_content_response()["Body"].read().decode("utf-8")
+
+
+def test_tasks_documents_compact_document_content():
+    """
+    The compacted state of a document should be saved as a new version when it is
+    materially smaller, keeping the content of the document.
+    """
+    content = get_uncompacted_ydoc()
+    document = factories.DocumentFactory(content=content)
+
+    report = compact_document_content(str(document.pk))
+
+    compacted = get_stored_content(document)
+    assert report == {
+        "size": len(content),
+        "compacted_size": len(compacted),
+        "saved": len(content) - len(compacted),
+    }
+    assert utils.base64_yjs_to_xml(compacted) == utils.base64_yjs_to_xml(content)
+    assert document.versions.count() == 2
+
+    # An already compacted document is left untouched
+    report = compact_document_content(str(document.pk))
+
+    assert report["saved"] == 0
+    assert document.versions.count() == 2
+
+
+def test_tasks_documents_compact_document_content_dry_run():
+    """In dry-run mode, the bytes that would be saved are reported but not saved."""
+    content = get_uncompacted_ydoc()
+    document = factories.DocumentFactory(content=content)
+
+    report = compact_document_content(str(document.pk), dry_run=True)
+
+    assert report["saved"] > 0
+    assert get_stored_content(document) == content
+    assert document.versions.count() == 1
+
+
+def test_tasks_documents_compact_document_content_min_saving(settings):
+    """States that would not shrink enough should be left untouched."""
+    settings.DOCUMENT_CONTENT_COMPACTION_MIN_SAVING = 99
+    content = get_uncompacted_ydoc()
+    document = factories.DocumentFactory(content=content)
+
+    assert compact_document_content(str(document.pk))["saved"] == 0
+    assert get_stored_content(document) == content
+
+
+def test_tasks_documents_compact_document_content_modified_meanwhile():
+    """A version saved while the content was being compacted should not be lost."""
+    document = factories.DocumentFactory(content=get_uncompacted_ydoc())
+    compact_yjs_state = utils.compact_yjs_state
+
+    def save_and_compact(content):
+        document.write_content(factories.YDOC_HELLO_WORLD_BASE64)
+        return compact_yjs_state(content)
+
+    with mock.patch.object(utils, "compact_yjs_state", side_effect=save_and_compact):
+        report = compact_document_content(str(document.pk))
+
+    assert report["saved"] == 0
+    assert get_stored_content(document) == factories.YDOC_HELLO_WORLD_BASE64
+
+
+def test_tasks_documents_compact_document_content_modified_before_write():
+    """
+    A version saved right before the compacted state is written should not be
+    overwritten: the write is conditioned on the version that was compacted.
+    """
+    document = factories.DocumentFactory(content=get_uncompacted_ydoc())
+    write_content = models.Document.write_content
+
+    def save_and_write(instance, content, *args, **kwargs):
+        if kwargs.get("if_match"):
+            write_content(instance, factories.YDOC_HELLO_WORLD_BASE64)
+        return write_content(instance, content, *args, **kwargs)
+
+    with mock.patch.object(
+        models.Document, "write_content", autospec=True, side_effect=save_and_write
+    ):
+        report = compact_document_content(str(document.pk))
+
+    assert report["saved"] == 0
+    assert get_stored_content(document) == factories.YDOC_HELLO_WORLD_BASE64
+    assert document.versions.count() == 2
+
+
+def test_tasks_documents_compact_document_content_pending(settings):
+    """Documents which content is waiting to be flushed should be skipped."""
+    settings.DOCUMENT_CONTENT_COALESCING_WINDOW = 10
+    content = get_uncompacted_ydoc()
+    document = factories.DocumentFactory(content=content)
+    cache.set(document.get_pending_content_cache_key(), {"content": "new"})
+
+    assert compact_document_content(str(document.pk))["size"] == 0
+    assert get_stored_content(document) == content
+
+
+def test_tasks_documents_compact_document_contents():
+    """
+    Documents modified since the previous run should be compacted, or all documents
+    in a full run.
+    """
+    factories.DocumentFactory(content=get_uncompacted_ydoc())
+    factories.DocumentFactory()
+
+    report = compact_document_contents()
+
+    assert report["documents"] == 2
+    assert report["compacted"] == 1
+    assert report["saved"] > 0
+    assert cache.get(CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY) is not None
+
+    document = factories.DocumentFactory(content=get_uncompacted_ydoc())
+    report = compact_document_contents(dry_run=True)
+
+    assert report == {
+        "dry_run": True,
+        "documents": 1,
+        "compacted": 1,
+        "saved": report["saved"],
+        "complete": True,
+    }
+    assert document.versions.count() == 1
+
+    assert compact_document_contents(full=True)["documents"] == 3
+
+
+def test_tasks_documents_compact_document_contents_resume(settings):
+    """
+    A run should stop between two documents once its maximum duration is reached,
+    the next run resuming after the last document it started to compact.
+    """
+    settings.DOCUMENT_CONTENT_COMPACTION_MAX_DURATION = 60
+    documents = sorted(
+        factories.DocumentFactory.create_batch(3, content=get_uncompacted_ydoc()),
+        key=lambda document: document.id,
+    )
+
+    with mock.patch("core.tasks.documents.monotonic", side_effect=[0, 0, 61]):
+        report = compact_document_contents()
+
+    assert report["documents"] == 1
+    assert report["complete"] is False
+    assert cache.get(CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY) is None
+    assert cache.get(CONTENT_COMPACTION_CURSOR_CACHE_KEY)["last_id"] == str(
+        documents[0].id
+    )
+
+    # A run killed while compacting a document resumes after it
+    cursor = cache.get(CONTENT_COMPACTION_CURSOR_CACHE_KEY)
+    cursor["last_id"] = str(documents[1].id)
+    cache.set(CONTENT_COMPACTION_CURSOR_CACHE_KEY, cursor, None)
+
+    report = compact_document_contents()
+
+    assert report["documents"] == 1
+    assert report["complete"] is True
+    assert documents[1].versions.count() == 1
+    assert documents[2].versions.count() == 2
+    assert cache.get(CONTENT_COMPACTION_CHECKPOINT_CACHE_KEY) == cursor["start"]
+    assert cache.get(CONTENT_COMPACTION_CURSOR_CACHE_KEY) is None
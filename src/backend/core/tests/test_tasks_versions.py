@@ -0,0 +1,93 @@
+"""
+Unit tests for the document versions retention tasks.
+"""
+
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+import pytest
+
+from core import factories
+from core.tasks.versions import get_versions_to_prune, prune_document_versions
+
+pytestmark = pytest.mark.django_db
+
+
+def test_tasks_versions_get_versions_to_prune(settings):
+    """
+    All recent versions should be kept, then one version per hour, then one
+    version per day. The current version should always be kept.
+    """
+    settings.DOCUMENT_VERSIONS_KEEP_ALL_HOURS = 2
+    settings.DOCUMENT_VERSIONS_KEEP_HOURLY_DAYS = 1
+    now = timezone.now().replace(hour=12, minute=30)
+
+    ages = {
+        "current": timedelta(minutes=1),
+        "recent1": timedelta(minutes=10),
+        "recent2": timedelta(minutes=20),
+        "hourly1": timedelta(hours=5, minutes=1),
+        "hourly2": timedelta(hours=5, minutes=2),
+        "hourly3": timedelta(hours=6, minutes=1),
+        "daily1": timedelta(days=5, minutes=1),
+        "daily2": timedelta(days=5, minutes=2),
+        "daily3": timedelta(days=6),
+    }
+    versions = [(version_id, now - age) for version_id, age in ages.items()]
+
+    assert get_versions_to_prune(versions, now) == ["hourly2", "daily2"]
+
+
+def test_tasks_versions_prune_document_versions(settings):
+    """
+    Versions out of the retention policy should be deleted from object storage and
+    from the version index. A dry run should not delete anything.
+    """
+    settings.DOCUMENT_VERSIONS_KEEP_ALL_HOURS = 1
+    document = factories.DocumentFactory()
+    for i in range(4):
+        document.content = f"content {i:d}"
+        document.save()
+    # The untouched document should not be impacted
+    other_document = factories.DocumentFactory()
+
+    # Move all but the current version back to the same day of last week
+    versions = list(document.versions.all())
+    last_week = timezone.now() - timedelta(days=7)
+    for i, version in enumerate(versions[1:]):
+        version.last_modified = last_week - timedelta(minutes=i)
+        version.save()
+
+    report = prune_document_versions(dry_run=True)
+
+    assert report == {"dry_run": True, "documents": 1, "versions": 3, "deleted": 0}
+    assert document.versions.count() == 5
+
+    report = prune_document_versions()
+
+    assert report == {"dry_run": False, "documents": 1, "versions": 3, "deleted": 3}
+    assert list(document.versions.all()) == versions[:2]
+    assert other_document.versions.count() == 1
+
+    response = default_storage.connection.meta.client.list_object_versions(
+        Bucket=default_storage.bucket_name, Prefix=document.file_key
+    )
+    assert {version["VersionId"] for version in response["Versions"]} == {
+        version.version_id for version in versions[:2]
+    }
+
+
+def test_tasks_versions_get_versions_to_prune_current_version(settings):
+    """
+    The current version should be kept even if it is old, older versions of its hour
+    or day being pruned.
+    """
+    settings.DOCUMENT_VERSIONS_KEEP_ALL_HOURS = 1
+    now = timezone.now()
+    versions = [("current", now - timedelta(days=3, minutes=1))] + [
+        (f"old{i:d}", now - timedelta(days=3, minutes=2 + i)) for i in range(3)
+    ]
+
+    assert get_versions_to_prune(versions, now) == ["old0", "old1", "old2"]
@@ -2,8 +2,12 @@
 
 import base64
 import uuid
+from unittest import mock
+
+from django.core.cache import cache
 
 import pycrdt
+import pytest
 
 from core import utils
 
@@ -32,6 +36,134 @@ def test_utils_base64_yjs_to_text():
     assert utils.base64_yjs_to_text(TEST_BASE64_STRING) == "Hello w or ld"
 
 
+def test_utils_base64_yjs_to_text_no_xml():
+    """Text should be extracted by walking the tree, without serializing it to xml."""
+    with mock.patch.object(
+        pycrdt.XmlFragment, "__str__", side_effect=AssertionError
+    ) as mock_str:
+        assert utils.base64_yjs_to_text(TEST_BASE64_STRING) == "Hello w or ld"
+
+    mock_str.assert_not_called()
+
+
+def test_utils_xml_fragment_to_text():
+    """
+    Text should be extracted from the tree of the document, including characters
+    that the xml serialization of pycrdt does not escape and ignoring embeds.
+    """
+    ydoc = pycrdt.Doc()
+    text = pycrdt.XmlText()
+    ydoc["document-store"] = fragment = pycrdt.XmlFragment(
+        [
+            pycrdt.XmlElement(
+                "blockGroup",
+                {},
+                [
+                    pycrdt.XmlElement("paragraph", {}, [text]),
+                    pycrdt.XmlElement("paragraph", {}, [pycrdt.XmlText("a < b & c")]),
+                    pycrdt.XmlElement("paragraph", {}, [pycrdt.XmlText("  ")]),
+                ],
+            ),
+            pycrdt.XmlElement("paragraph", {}, [pycrdt.XmlText("end")]),
+        ]
+    )
+    text.insert(0, "hello world")
+    text.insert_embed(5, {"type": "mention"})
+    text.format(0, 5, {"bold": {}})
+
+    assert list(utils.iter_xml_text(fragment)) == [
+        "hello",
+        " world",
+        "a < b & c",
+        "  ",
+        "end",
+    ]
+    assert utils.xml_fragment_to_text(fragment) == "hello world a < b & c end"
+
+
+def test_utils_compute_content_artifacts():
+    """All the artifacts should be derived from a single parsing of the content."""
+    with mock.patch.object(
+        utils, "base64_yjs_to_fragment", wraps=utils.base64_yjs_to_fragment
+    ) as mock_to_fragment:
+        artifacts = utils.compute_content_artifacts(TEST_BASE64_STRING)
+
+    mock_to_fragment.assert_called_once_with(TEST_BASE64_STRING)
+    assert "<italic>Hello</italic>" in artifacts["xml"]
+    assert artifacts["text"] == "Hello w or ld"
+    assert artifacts["excerpt"] == "Hello w or ld"
+    assert artifacts["attachments"] == []
+    assert artifacts["word_count"] == 4
+
+
+def test_utils_compute_content_artifacts_long_excerpt():
+    """The excerpt should be truncated to the maximum length of the field."""
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = pycrdt.XmlFragment(
+        [pycrdt.XmlElement("p", {}, [pycrdt.XmlText("word " * 100)])]
+    )
+    content = base64.b64encode(ydoc.get_update()).decode("utf-8")
+
+    artifacts = utils.compute_content_artifacts(content)
+
+    assert len(artifacts["excerpt"]) == 300
+    assert artifacts["excerpt"].endswith("…")
+    assert artifacts["word_count"] == 100
+
+
+def test_utils_get_content_artifacts_cached():
+    """
+    Artifacts, including the xml and text of the content, should be computed once per
+    content and then read from cache.
+    """
+    cache.clear()
+    with (
+        mock.patch.object(
+            utils, "compute_content_artifacts", wraps=utils.compute_content_artifacts
+        ) as mock_compute,
+        mock.patch.object(
+            utils, "compute_content_text", wraps=utils.compute_content_text
+        ) as mock_compute_text,
+    ):
+        assert utils.extract_attachments(TEST_BASE64_STRING) == []
+        assert utils.get_content_artifacts(TEST_BASE64_STRING)["word_count"] == 4
+        text = utils.get_content_artifacts(TEST_BASE64_STRING, full=True)["text"]
+        assert text == "Hello w or ld"
+        assert utils.base64_yjs_to_text(TEST_BASE64_STRING) == "Hello w or ld"
+        assert "<italic>Hello</italic>" in utils.base64_yjs_to_xml(TEST_BASE64_STRING)
+
+    assert mock_compute.call_count == 1
+    mock_compute_text.assert_not_called()
+    digest = utils.get_content_digest(TEST_BASE64_STRING)
+    assert cache.get(f"content_artifacts_{digest:s}") == {
+        "excerpt": "Hello w or ld",
+        "attachments": [],
+        "word_count": 4,
+    }
+    assert cache.get(f"content_text_{digest:s}") == "Hello w or ld"
+
+
+def test_utils_base64_yjs_to_text_cached():
+    """
+    The text of a content should be computed once, without its other artifacts, and
+    then read from cache.
+    """
+    cache.clear()
+    with (
+        mock.patch.object(
+            utils, "compute_content_artifacts", wraps=utils.compute_content_artifacts
+        ) as mock_compute,
+        mock.patch.object(
+            utils, "compute_content_text", wraps=utils.compute_content_text
+        ) as mock_compute_text,
+    ):
+        for _ in range(2):
+            assert utils.base64_yjs_to_text(TEST_BASE64_STRING) == "Hello w or ld"
+
+    mock_compute_text.assert_called_once_with(TEST_BASE64_STRING)
+    mock_compute.assert_not_called()
+
+
 def test_utils_base64_yjs_to_xml():
     """Test extract xml from saved yjs document"""
     content = utils.base64_yjs_to_xml(TEST_BASE64_STRING)
@@ -75,3 +207,123 @@ def test_utils_extract_attachments():
     base64_string = base64.b64encode(update).decode("utf-8")
     # image_key2 is missing the "/media/" part and shouldn't get extracted
     assert utils.extract_attachments(base64_string) == [image_key1, image_key3]
+
+
+def test_utils_extract_attachments_candidates():
+    """
+    Attachment keys should be found in the binary content without loading it.
+    """
+    document_id = uuid.uuid4()
+    image_key1 = f"{document_id!s}/attachments/{uuid.uuid4()!s}.png"
+    image_key2 = f"{uuid.uuid4()!s}/attachments/{uuid.uuid4()!s}.png"
+    image_key3 = f"{uuid.uuid4()!s}/attachments/{uuid.uuid4()!s}.png"
+
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = pycrdt.XmlFragment(
+        [
+            pycrdt.XmlElement("img", {"src": f"http://localhost/media/{image_key1:s}"}),
+            pycrdt.XmlElement("img", {"src": f"http://localhost/{image_key2:s}"}),
+            pycrdt.XmlElement("p", {}, [pycrdt.XmlText(f"/media/{image_key3:s}")]),
+        ]
+    )
+
+    base64_string = base64.b64encode(ydoc.get_update()).decode("utf-8")
+    assert utils.extract_attachments_candidates(base64_string) == {
+        image_key1,
+        image_key3,
+    }
+    assert utils.extract_attachments_candidates(None) == set()
+
+
+def test_utils_get_yjs_update_delta():
+    """
+    The delta computed from the state vector of a previous state should only contain
+    the missing changes and bring the previous state up to date.
+    """
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = text = pycrdt.Text("Hello")
+    previous = base64.b64encode(ydoc.get_update()).decode("utf-8")
+    text += " world" * 100
+    current = base64.b64encode(ydoc.get_update()).decode("utf-8")
+
+    state_vector = utils.base64_yjs_to_state_vector(previous)
+    delta = utils.get_yjs_update_delta(current, state_vector)
+
+    assert len(delta) < len(base64.b64decode(current))
+    previous_doc = pycrdt.Doc()
+    previous_doc.apply_update(base64.b64decode(previous))
+    previous_doc.apply_update(delta)
+    assert str(previous_doc.get("document-store", type=pycrdt.Text)) == str(text)
+
+
+def test_utils_compute_merged_yjs_update():
+    """
+    Merging an update should tell if it changed the document, whether it inserted or
+    only deleted items, and return the state vector of the merged document.
+    """
+    ydoc = pycrdt.Doc()
+    ydoc["document-store"] = text = pycrdt.Text("Hello")
+    base = base64.b64encode(ydoc.get_update()).decode("utf-8")
+    state_vector = ydoc.get_state()
+    text += " world"
+    insertion = ydoc.get_update(state_vector)
+
+    merged, merged_state, has_changed = utils.compute_merged_yjs_update(base, insertion)
+
+    assert has_changed is True
+    assert merged_state == ydoc.get_state()
+    assert utils.compute_merged_yjs_update(merged, insertion)[2] is False
+
+    state_vector = ydoc.get_state()
+    del text[0:6]
+    deletion = ydoc.get_update(state_vector)
+
+    deleted, deleted_state, has_changed = utils.compute_merged_yjs_update(
+        merged, deletion
+    )
+
+    assert has_changed is True
+    assert deleted_state == merged_state
+    assert utils.compute_merged_yjs_update(deleted, deletion)[2] is False
+    deleted_doc = pycrdt.Doc()
+    deleted_doc.apply_update(base64.b64decode(deleted))
+    assert str(deleted_doc.get("document-store", type=pycrdt.Text)) == "world"
+
+    assert utils.compute_merged_yjs_update(None, insertion)[2] is True
+
+
+def get_uncompacted_ydoc(text="Hello world", nb_edits=50):
+    """
+    Return a base64 yjs document holding a paragraph with the text, made by merging the
+    updates of many edits typed and deleted, like a state saved without compaction.
+    """
+    ydoc = pycrdt.Doc()
+    updates = []
+    ydoc.observe(lambda event: updates.append(event.update))
+    ydoc["document-store"] = fragment = pycrdt.XmlFragment()
+    paragraph = fragment.children.append(pycrdt.XmlElement("paragraph"))
+    paragraph.children.append(ytext := pycrdt.XmlText())
+    for index in range(nb_edits):
+        ytext.insert(0, f"draft {index:d} ")
+        del ytext[:]
+    ytext.insert(0, text)
+    return base64.b64encode(pycrdt.merge_updates(*updates)).decode("utf-8")
+
+
+def test_utils_compact_yjs_state():
+    """
+    Compacting a yjs state should shrink it while keeping its content and its state
+    vector so that clients can still sync with it.
+    """
+    content = get_uncompacted_ydoc()
+
+    compacted = utils.compact_yjs_state(content)
+
+    assert len(compacted) < len(content) / 2
+    assert utils.base64_yjs_to_xml(compacted) == utils.base64_yjs_to_xml(content)
+    assert utils.base64_yjs_to_state_vector(
+        compacted
+    ) == utils.base64_yjs_to_state_vector(content)
+
+    # Compacting an already compacted state is a no-op
+    assert utils.compact_yjs_state(compacted) == compacted
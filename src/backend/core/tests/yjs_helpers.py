@@ -0,0 +1,18 @@
+"""
+Operations run by the yjs executor in tests, which must be importable by its worker
+processes: test modules are not with the "importlib" import mode.
+"""
+
+import os
+import time
+
+
+def get_pid(_content):
+    """Return the id of the process running the operation."""
+    return os.getpid()
+
+
+def sleep(content):
+    """Take as many seconds as the content says."""
+    time.sleep(int(content))
+    return content
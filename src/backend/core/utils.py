@@ -1,12 +1,19 @@
 """Utils for the core app."""
 
 import base64
+import hashlib
 import re
 
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.text import Truncator
+
 import pycrdt
-from bs4 import BeautifulSoup
 
 from core import enums
+from core.services.yjs_services import YjsExecutor
+
+EXCERPT_MAX_LENGTH = 300
 
 
 def filter_descendants(paths, root_paths, skip_sorting=False):
@@ -48,23 +55,139 @@ def filter_descendants(paths, root_paths, skip_sorting=False):
     return results
 
 
-def base64_yjs_to_xml(base64_string):
-    """Extract xml from base64 yjs document."""
+def base64_yjs_to_fragment(base64_string):
+    """Load the xml fragment holding the content of a base64 yjs document."""
 
     decoded_bytes = base64.b64decode(base64_string)
     # uint8_array = bytearray(decoded_bytes)
 
     doc = pycrdt.Doc()
     doc.apply_update(decoded_bytes)
-    return str(doc.get("document-store", type=pycrdt.XmlFragment))
+    return doc.get("document-store", type=pycrdt.XmlFragment)
 
 
-def base64_yjs_to_text(base64_string):
-    """Extract text from base64 yjs document."""
+def compute_content_xml(base64_string):
+    """Serialize a base64 yjs document to xml."""
+    return str(base64_yjs_to_fragment(base64_string))
+
+
+def base64_yjs_to_xml(base64_string):
+    """Get the xml of a base64 yjs document, see `get_content_conversion`."""
+    return get_content_conversion(base64_string, "xml", compute_content_xml)
+
+
+def get_xml_children(node, txn):
+    """List the children of a low-level pycrdt xml node in a single pass."""
+    if not node.len(txn):
+        return []
+    first_child = node.get(txn, 0)
+    return [first_child, *first_child.siblings(txn)]
+
+
+def iter_xml_text(node):
+    """
+    Yield the text chunks of a pycrdt xml node in document order, walking the tree
+    directly instead of serializing it. Each formatted part of a text is a chunk.
+    """
+    # pycrdt's children view gets each child by its index, which walks the siblings
+    # from the first one every time: use the low-level nodes to list them at once
+    with node.doc.transaction() as transaction:
+        txn = transaction._txn  # noqa: SLF001 # pylint: disable=protected-access
+        # Iterative depth-first walk: very deep documents can't exhaust the stack
+        stack = [iter(get_xml_children(node.integrated, txn))]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            elif hasattr(child, "diff"):  # Text node
+                for chunk, _attributes in child.diff(txn):
+                    # Embeds are not text
+                    if isinstance(chunk, str):
+                        yield chunk
+            else:
+                stack.append(iter(get_xml_children(child, txn)))
+
+
+def xml_fragment_to_text(fragment):
+    """Extract text from a pycrdt xml fragment, separating text chunks by a space."""
+    return " ".join(
+        stripped for chunk in iter_xml_text(fragment) if (stripped := chunk.strip())
+    )
+
+
+def base64_yjs_to_state_vector(base64_string):
+    """Get the state vector of a base64 yjs document, without loading the document."""
+
+    return pycrdt.get_state(base64.b64decode(base64_string))
 
-    blocknote_structure = base64_yjs_to_xml(base64_string)
-    soup = BeautifulSoup(blocknote_structure, "lxml-xml")
-    return soup.get_text(separator=" ", strip=True)
+
+def get_yjs_state_vector(base64_string):
+    """Get the state vector of a base64 yjs document out of process."""
+    return YjsExecutor().run(base64_yjs_to_state_vector, base64_string)
+
+
+def compute_yjs_update_delta(base64_string, state_vector):
+    """
+    Compute the yjs update containing the changes of a base64 yjs document that are
+    missing from a document at the given state vector.
+    """
+
+    doc = pycrdt.Doc()
+    doc.apply_update(base64.b64decode(base64_string))
+    return doc.get_update(state_vector)
+
+
+def get_yjs_update_delta(base64_string, state_vector):
+    """Compute the delta of a base64 yjs document from a state vector out of process."""
+    return YjsExecutor().run(compute_yjs_update_delta, base64_string, state_vector)
+
+
+def compute_merged_yjs_update(base64_string, update):
+    """
+    Merge a yjs update into a base64 yjs document. Return the resulting base64 yjs
+    document, its state vector and whether the update changed the document: inserted
+    items advance the state vector while deleted items only change the delete set.
+    """
+
+    if not base64_string:
+        merged = pycrdt.merge_updates(update)
+        return base64.b64encode(merged).decode("utf-8"), pycrdt.get_state(merged), True
+
+    current = base64.b64decode(base64_string)
+    merged = pycrdt.merge_updates(current, update)
+    current_state, merged_state = pycrdt.get_state(current), pycrdt.get_state(merged)
+    # An update from a state to itself only holds the delete set of the document
+    has_changed = merged_state != current_state or pycrdt.get_update(
+        merged, merged_state
+    ) != pycrdt.get_update(current, current_state)
+    return base64.b64encode(merged).decode("utf-8"), merged_state, has_changed
+
+
+def get_merged_yjs_update(base64_string, update):
+    """Merge a yjs update into a base64 yjs document out of process."""
+    return YjsExecutor().run(compute_merged_yjs_update, base64_string, update)
+
+
+def compact_yjs_state(base64_string):
+    """
+    Re-encode a base64 yjs document as a single update. Loading the document merges
+    adjacent items and drops the content of deleted items, keeping only their ids so
+    that clients holding the former state can still sync with the compacted one.
+    """
+
+    doc = pycrdt.Doc()
+    doc.apply_update(base64.b64decode(base64_string))
+    return base64.b64encode(doc.get_update()).decode("utf-8")
+
+
+def compute_content_text(base64_string):
+    """Extract text from a base64 yjs document by walking its tree, without xml."""
+    return xml_fragment_to_text(base64_yjs_to_fragment(base64_string))
+
+
+def base64_yjs_to_text(base64_string):
+    """Get the text of a base64 yjs document, see `get_content_conversion`."""
+    return get_content_conversion(base64_string, "text", compute_content_text)
 
 
 def extract_attachments(content):
@@ -72,5 +195,113 @@ def extract_attachments(content):
     if not content:
         return []
 
-    xml_content = base64_yjs_to_xml(content)
-    return re.findall(enums.MEDIA_STORAGE_URL_EXTRACT, xml_content)
+    return get_content_artifacts(content)["attachments"]
+
+
+def get_content_digest(content):
+    """SHA-256 hex digest identifying a base64 yjs document."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compute_content_artifacts(base64_string):
+    """
+    Derive from a base64 yjs document, decoding and parsing it only once:
+    - xml: the xml of the document,
+    - text: its plain text,
+    - excerpt: the beginning of its text,
+    - attachments: the media paths it includes,
+    - word_count: the number of words of its text.
+    """
+    fragment = base64_yjs_to_fragment(base64_string)
+    xml_content = str(fragment)
+    text = xml_fragment_to_text(fragment)
+    return {
+        "xml": xml_content,
+        "text": text,
+        "excerpt": Truncator(text).chars(EXCERPT_MAX_LENGTH),
+        "attachments": re.findall(enums.MEDIA_STORAGE_URL_EXTRACT, xml_content),
+        "word_count": len(text.split()),
+    }
+
+
+# Artifacts stored together for every content, the xml and the text of the content,
+# which may be large, being stored apart
+CACHED_CONTENT_ARTIFACTS = ("excerpt", "attachments", "word_count")
+
+
+def get_content_artifacts_cache_keys(base64_string):
+    """
+    Cache keys of the artifacts derived from a base64 yjs document, by name: the small
+    artifacts stored together, the xml and the text of the content.
+    """
+    digest = get_content_digest(base64_string)
+    return {
+        name: f"content_{name:s}_{digest:s}" for name in ("artifacts", "xml", "text")
+    }
+
+
+def get_content_conversion(base64_string, name, function):
+    """
+    Get the conversion of a base64 yjs document to "xml" or "text" from the artifact
+    store, computing it with `function` by the yjs executor only if it is not already
+    stored for this content. See `YjsExecutor.run` for the errors raised.
+    """
+    cache_key = get_content_artifacts_cache_keys(base64_string)[name]
+    value = cache.get(cache_key)
+    if value is None:
+        value = YjsExecutor().run(function, base64_string)
+        cache.set(cache_key, value, settings.DOCUMENT_CONTENT_ARTIFACTS_CACHE_TIMEOUT)
+    return value
+
+
+def get_content_artifacts(base64_string, full=False):
+    """
+    Get the artifacts derived from a base64 yjs document, computing them only if they
+    are not already stored for this content. Artifacts are stored in cache under the
+    digest of the content so that all the documents and versions sharing a content
+    share them, the xml and text of the content being only returned if `full` is
+    True. They are computed by the yjs executor, see `YjsExecutor.run` for the errors
+    raised.
+    """
+    cache_keys = get_content_artifacts_cache_keys(base64_string)
+    names = ("artifacts", "xml", "text") if full else ("artifacts",)
+    cached = cache.get_many([cache_keys[name] for name in names])
+    if len(cached) == len(names):
+        artifacts = dict(cached[cache_keys["artifacts"]])
+        for name in names[1:]:
+            artifacts[name] = cached[cache_keys[name]]
+        return artifacts
+
+    artifacts = YjsExecutor().run(compute_content_artifacts, base64_string)
+    cache.set_many(
+        {
+            cache_keys["artifacts"]: {
+                name: artifacts[name] for name in CACHED_CONTENT_ARTIFACTS
+            },
+            cache_keys["xml"]: artifacts["xml"],
+            cache_keys["text"]: artifacts["text"],
+        },
+        settings.DOCUMENT_CONTENT_ARTIFACTS_CACHE_TIMEOUT,
+    )
+    return artifacts
+
+
+MEDIA_STORAGE_URL_EXTRACT_BYTES = re.compile(
+    enums.MEDIA_STORAGE_URL_EXTRACT.pattern.encode("utf-8")
+)
+
+
+def extract_attachments_candidates(content):
+    """
+    Quickly find the media paths in a document's content without loading it: strings
+    are stored as is in the binary yjs encoding. The result may include media that
+    were removed from the document but are still in its history, so it must be
+    confirmed with `extract_attachments` if needed.
+    """
+    if not content:
+        return set()
+
+    return {
+        match.decode("utf-8")
+        for match in MEDIA_STORAGE_URL_EXTRACT_BYTES.findall(base64.b64decode(content))
+    }
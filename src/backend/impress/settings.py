@@ -107,6 +107,12 @@ class Base(Configuration):
     MEDIA_BASE_URL = values.Value(
         None, environ_name="MEDIA_BASE_URL", environ_prefix=None
     )
+    # Lifetime in seconds of the authorization decisions cached for media requests
+    # (0 to disable the cache). Must remain well below the 15 minutes during which
+    # the cached S3 signatures are accepted.
+    MEDIA_AUTH_CACHE_TIMEOUT = values.PositiveIntegerValue(
+        10, environ_name="MEDIA_AUTH_CACHE_TIMEOUT", environ_prefix=None
+    )
 
     SITE_ID = 1
 
@@ -147,6 +153,38 @@ class Base(Configuration):
         environ_name="DOCUMENT_IMAGE_MAX_SIZE",
         environ_prefix=None,
     )
+    # Direct uploads of attachments to object storage: lifetime in seconds of the
+    # upload slots and size of the parts of multipart uploads (at least 5MB), used
+    # for files larger than one part
+    DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION = values.PositiveIntegerValue(
+        60 * 60,  # 1 hour
+        environ_name="DOCUMENT_ATTACHMENT_UPLOAD_EXPIRATION",
+        environ_prefix=None,
+    )
+    DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE = values.PositiveIntegerValue(
+        8 * (2**20),  # 8MB
+        environ_name="DOCUMENT_ATTACHMENT_UPLOAD_PART_SIZE",
+        environ_prefix=None,
+    )
+    # Resized variants generated for images once they are considered safe: widths in
+    # pixels and formats (formats not supported by the Pillow build are skipped)
+    DOCUMENT_IMAGE_VARIANT_WIDTHS = values.ListValue(
+        [320, 640, 1280],
+        environ_name="DOCUMENT_IMAGE_VARIANT_WIDTHS",
+        environ_prefix=None,
+    )
+    DOCUMENT_IMAGE_VARIANT_FORMATS = values.ListValue(
+        ["webp", "avif"],
+        environ_name="DOCUMENT_IMAGE_VARIANT_FORMATS",
+        environ_prefix=None,
+    )
+    # Number of days after which attachments removed from the content of documents,
+    # or never included in it, are deleted from object storage
+    DOCUMENT_ATTACHMENT_ORPHAN_GRACE_DAYS = values.PositiveIntegerValue(
+        7,
+        environ_name="DOCUMENT_ATTACHMENT_ORPHAN_GRACE_DAYS",
+        environ_prefix=None,
+    )
 
     DOCUMENT_UNSAFE_MIME_TYPES = [
         # Executable Files
@@ -223,6 +261,97 @@ class Base(Configuration):
     )
     # Document versions
     DOCUMENT_VERSIONS_PAGE_SIZE = 50
+    DOCUMENT_VERSIONS_DELTA_CACHE_TIMEOUT = values.PositiveIntegerValue(
+        60 * 60 * 24,  # 1 day
+        environ_name="DOCUMENT_VERSIONS_DELTA_CACHE_TIMEOUT",
+        environ_prefix=None,
+    )
+    # Retention policy: keep all versions for a number of hours, then one version
+    # per hour for a number of days, then one version per day
+    DOCUMENT_VERSIONS_KEEP_ALL_HOURS = values.PositiveIntegerValue(
+        24,
+        environ_name="DOCUMENT_VERSIONS_KEEP_ALL_HOURS",
+        environ_prefix=None,
+    )
+    DOCUMENT_VERSIONS_KEEP_HOURLY_DAYS = values.PositiveIntegerValue(
+        30,
+        environ_name="DOCUMENT_VERSIONS_KEEP_HOURLY_DAYS",
+        environ_prefix=None,
+    )
+
+    # Document content write coalescing
+    # Number of seconds during which updates of the content of a document are buffered
+    # and written once to object storage. 0 disables coalescing.
+    DOCUMENT_CONTENT_COALESCING_WINDOW = values.PositiveIntegerValue(
+        0,
+        environ_name="DOCUMENT_CONTENT_COALESCING_WINDOW",
+        environ_prefix=None,
+    )
+
+    # Maximum number of accesses and invitations given at once on a document
+    DOCUMENT_ACCESSES_BULK_MAX_SIZE = values.PositiveIntegerValue(
+        500,
+        environ_name="DOCUMENT_ACCESSES_BULK_MAX_SIZE",
+        environ_prefix=None,
+    )
+
+    # Document content bulk fetching
+    # The default number of workers matches the size of botocore's connection pool
+    DOCUMENT_CONTENT_FETCH_MAX_WORKERS = values.PositiveIntegerValue(
+        10,
+        environ_name="DOCUMENT_CONTENT_FETCH_MAX_WORKERS",
+        environ_prefix=None,
+    )
+    DOCUMENT_CONTENT_FETCH_MAX_RETRIES = values.PositiveIntegerValue(
+        3,
+        environ_name="DOCUMENT_CONTENT_FETCH_MAX_RETRIES",
+        environ_prefix=None,
+    )
+
+    # Data derived from the content of documents (xml, text, excerpt, attachments...)
+    # is stored in cache under the digest of the content for this number of seconds.
+    # The cache must be shared by all the processes, like the Redis cache configured
+    # for production, for artifacts computed by Celery workers to be reused.
+    DOCUMENT_CONTENT_ARTIFACTS_CACHE_TIMEOUT = values.PositiveIntegerValue(
+        60 * 60 * 24,  # 1 day
+        environ_name="DOCUMENT_CONTENT_ARTIFACTS_CACHE_TIMEOUT",
+        environ_prefix=None,
+    )
+
+    # The compacted yjs state of a document is only saved if it is smaller than the
+    # current state by at least this percentage
+    DOCUMENT_CONTENT_COMPACTION_MIN_SAVING = values.PositiveIntegerValue(
+        10,
+        environ_name="DOCUMENT_CONTENT_COMPACTION_MIN_SAVING",
+        environ_prefix=None,
+    )
+    # Number of seconds after which a compaction run stops, the next run resuming
+    # from the document where it stopped
+    DOCUMENT_CONTENT_COMPACTION_MAX_DURATION = values.PositiveIntegerValue(
+        3600,
+        environ_name="DOCUMENT_CONTENT_COMPACTION_MAX_DURATION",
+        environ_prefix=None,
+    )
+
+    # CPU-bound operations on yjs documents run in a pool of worker processes created
+    # in each web server or Celery process. 0 runs them in the calling process.
+    YJS_EXECUTOR_MAX_WORKERS = values.PositiveIntegerValue(
+        2,
+        environ_name="YJS_EXECUTOR_MAX_WORKERS",
+        environ_prefix=None,
+    )
+    # Number of seconds after which an operation is aborted
+    YJS_EXECUTOR_TIMEOUT = values.PositiveIntegerValue(
+        10,
+        environ_name="YJS_EXECUTOR_TIMEOUT",
+        environ_prefix=None,
+    )
+    # Size in bytes of the largest base64 yjs document processed
+    YJS_EXECUTOR_MAX_CONTENT_SIZE = values.PositiveIntegerValue(
+        20 * 1024 * 1024,  # 20MB
+        environ_name="YJS_EXECUTOR_MAX_CONTENT_SIZE",
+        environ_prefix=None,
+    )
 
     # Internationalization
     # https://docs.djangoproject.com/en/3.1/topics/i18n/
@@ -898,6 +1027,7 @@ class Test(Base):
     STATIC_ROOT = None
 
     CELERY_TASK_ALWAYS_EAGER = values.BooleanValue(True)
+    YJS_EXECUTOR_MAX_WORKERS = 0
 
     def __init__(self):
         # pylint: disable=invalid-name
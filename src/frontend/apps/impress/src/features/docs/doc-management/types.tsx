@@ -92,6 +92,7 @@ export interface Doc {
     update: boolean;
     versions_destroy: boolean;
     versions_list: boolean;
+    versions_restore: boolean;
     versions_retrieve: boolean;
     link_select_options: LinkSelectOption;
   };
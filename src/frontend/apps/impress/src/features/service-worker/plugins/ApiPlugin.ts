@@ -200,6 +200,7 @@ export class ApiPlugin implements WorkboxPlugin {
         update: true,
         versions_destroy: true,
         versions_list: true,
+        versions_restore: true,
         versions_retrieve: true,
         link_select_options: {
           public: [LinkRole.READER, LinkRole.EDITOR],